@@ -1,11 +1,16 @@
 from __future__ import print_function
 import numpy as np
 import copy
+import os
+import pickle
+import hashlib
 import logging
+import collections
 import traceback
 from simtk import openmm, unit
-from perses.storage import NetCDFStorageView
+from perses.storage import NetCDFStorageView, AsyncConfigurationWriter
 from perses.tests.utils import quantity_is_finite
+from perses.systems import copy_system, system_fingerprint
 
 default_functions = {
     'lambda_sterics' : '2*lambda * step(0.5 - lambda) + (1.0 - step(0.5 - lambda))',
@@ -86,9 +91,9 @@ class NCMCEngine(object):
             If specified, the platform to use for OpenMM simulations.
         write_ncmc_interval : int, optional, default=None
             If a positive integer is specified, a snapshot frame will be written to storage with the specified interval on NCMC switching.
-            'storage' must also be specified.
+            'storage' must also be specified. Frames are written asynchronously by a background thread.
         integrator_type : str, optional, default='GHMC'
-            NCMC internal integrator type ['GHMC', 'VV']
+            NCMC internal integrator type ['GHMC', 'VV', 'BAOAB']
         storage : NetCDFStorageView, optional, default=None
             If specified, write data using this class.
         verbose : bool, optional, default=False
@@ -121,6 +126,24 @@ class NCMCEngine(object):
         if storage is not None:
             self._storage = NetCDFStorageView(storage, modname=self.__class__.__name__)
         self.write_ncmc_interval = write_ncmc_interval
+        self._frame_writer = None # background writer for NCMC trajectory frames, created on first use
+
+    def close(self):
+        """
+        Write pending NCMC trajectory frames and stop the background writer thread.
+
+        This must be called before the storage layer is closed; a new writer is started if frames are written later.
+        """
+        if self._frame_writer is not None:
+            frame_writer = self._frame_writer
+            self._frame_writer = None
+            frame_writer.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
 
     @property
     def beta(self):
@@ -299,8 +322,10 @@ class NCMCEngine(object):
 
             # Write trajectory frame.
             if self._storage and self.write_ncmc_interval:
+                if self._frame_writer is None:
+                    self._frame_writer = AsyncConfigurationWriter(self._storage)
                 positions = context.getState(getPositions=True).getPositions(asNumpy=True)
-                self._storage.write_configuration('positions', positions, topology, iteration=iteration, frame=0, nframes=(self.nsteps+1))
+                self._frame_writer.write_configuration('positions', positions, topology, iteration=iteration, frame=0, nframes=(self.nsteps+1))
 
             # Perform NCMC integration.
             for step in range(nsteps):
@@ -319,23 +344,34 @@ class NCMCEngine(object):
                         print(name, val)
 
                 # Store accumulated work
-                total_work[step+1] = integrator.getTotalWork(context)
-                shadow_work[step+1] = integrator.getShadowWork(context)
-                protocol_work[step+1] = integrator.getProtocolWork(context)
+                if integrator.has_work_trajectory:
+                    total_work[step+1] = integrator.getTotalWork(context)
+                    shadow_work[step+1] = integrator.getShadowWork(context)
+                    protocol_work[step+1] = integrator.getProtocolWork(context)
 
                 # Write trajectory frame.
-                if self._storage and self.write_ncmc_interval and (self.write_ncmc_interval % (step+1) == 0):
+                if self._storage and self.write_ncmc_interval and ((step+1) % self.write_ncmc_interval == 0):
                     positions = context.getState(getPositions=True).getPositions(asNumpy=True)
                     assert quantity_is_finite(positions) == True
-                    self._storage.write_configuration('positions', positions, topology, iteration=iteration, frame=(step+1), nframes=(self.nsteps+1))
+                    self._frame_writer.write_configuration('positions', positions, topology, iteration=iteration, frame=(step+1), nframes=(self.nsteps+1))
 
-            # Store work values.
-            if self._storage:
+            # Wait for pending trajectory frames, since the storage layer may only be written from one thread at a time.
+            if self._frame_writer is not None:
+                self._frame_writer.flush()
+
+            # Store work values, unless the integrator only computes the work at the end of the protocol.
+            if self._storage and integrator.has_work_trajectory:
                 self._storage.write_array('total_work_%s' % direction, total_work, iteration=iteration)
                 self._storage.write_array('shadow_work_%s' % direction, shadow_work, iteration=iteration)
                 self._storage.write_array('protocol_work_%s' % direction, protocol_work, iteration=iteration)
 
         except Exception as e:
+            # Make sure the writer thread is idle before the storage layer is used again
+            if self._frame_writer is not None:
+                try:
+                    self._frame_writer.flush()
+                except Exception:
+                    traceback.print_exc()
             # Trap NaNs as a special exception (allowing us to reject later, if desired)
             if str(e) == "Particle coordinate is nan":
                 msg = "Particle coordinate is nan during NCMC integration while using integrator_type '%s'" % self.integrator_type
@@ -380,6 +416,8 @@ class NCMCEngine(object):
             integrator = NCMCVVAlchemicalIntegrator(self.temperature, alchemical_system, functions, nsteps=self.nsteps, steps_per_propagation=self.steps_per_propagation, timestep=self.timestep, direction=direction)
         elif self.integrator_type == 'GHMC':
             integrator = NCMCGHMCAlchemicalIntegrator(self.temperature, alchemical_system, functions, nsteps=self.nsteps, steps_per_propagation=self.steps_per_propagation, timestep=self.timestep, direction=direction)
+        elif self.integrator_type == 'BAOAB':
+            integrator = NCMCBAOABAlchemicalIntegrator(self.temperature, alchemical_system, functions, nsteps=self.nsteps, steps_per_propagation=self.steps_per_propagation, timestep=self.timestep, direction=direction)
         else:
             raise Exception("integrator_type '%s' unknown" % self.integrator_type)
 
@@ -387,9 +425,12 @@ class NCMCEngine(object):
         if self.constraint_tolerance is not None:
             integrator.setConstraintTolerance(self.constraint_tolerance)
 
+        # Draw the random number seed from numpy, so that seeding numpy makes switching trajectories reproducible.
+        integrator.setRandomNumberSeed(np.random.randint(1, 2**30))
+
         return integrator
 
-    def _create_context(self, system, integrator, positions):
+    def _create_context(self, system, integrator, positions, box_vectors=None):
         """
         Instantiate context for alchemical system.
 
@@ -401,6 +442,8 @@ class NCMCEngine(object):
             NCMC switching integrator to annihilate or introduce particles alchemically.
         positions : simtk.unit.Quantity with dimension [natoms, 3] with units of distance.
             Positions of the atoms at the beginning of the NCMC switching.
+        box_vectors : simtk.unit.Quantity wrapped 3-tuple of Vec3, optional, default=None
+            If specified, the periodic box vectors of the configuration; otherwise the default box vectors of `system` are used.
 
         Returns
         -------
@@ -413,6 +456,8 @@ class NCMCEngine(object):
             context = openmm.Context(system, integrator, self.platform)
         else:
             context = openmm.Context(system, integrator)
+        if (box_vectors is not None) and system.usesPeriodicBoundaryConditions():
+            context.setPeriodicBoxVectors(*box_vectors)
         #print('before setpositions:')
         #print('positions', context.getState(getPositions=True).getPositions(asNumpy=True))
         #print('velocities', context.getState(getVelocities=True).getVelocities(asNumpy=True))
@@ -426,7 +471,7 @@ class NCMCEngine(object):
         #print('velocities', context.getState(getVelocities=True).getVelocities(asNumpy=True))
         # Set velocities to temperature and apply velocity constraints.
         #print('after setVelocitiesToTemperature:')
-        context.setVelocitiesToTemperature(self.temperature)
+        context.setVelocitiesToTemperature(self.temperature, np.random.randint(1, 2**30))
         #print('positions', context.getState(getPositions=True).getPositions(asNumpy=True))
         #print('velocities', context.getState(getVelocities=True).getVelocities(asNumpy=True))
         context.applyVelocityConstraints(integrator.getConstraintTolerance())
@@ -489,7 +534,7 @@ class NCMCEngine(object):
         # Keep track of statistics.
         self.nattempted += 1
 
-    def integrate(self, topology_proposal, initial_positions, direction='insert', platform=None, iteration=None):
+    def integrate(self, topology_proposal, initial_positions, direction='insert', platform=None, iteration=None, box_vectors=None):
         """
         Performs NCMC switching to either delete or insert atoms according to the provided `topology_proposal`.
 
@@ -510,6 +555,8 @@ class NCMCEngine(object):
             If not None, this platform is used for integration.
         iteration : int, optional, default=None
             Iteration number, for storage purposes.
+        box_vectors : simtk.unit.Quantity wrapped 3-tuple of Vec3, optional, default=None
+            If specified, the periodic box vectors of the configuration; otherwise the default box vectors of the System are used.
 
         Returns
         -------
@@ -533,7 +580,7 @@ class NCMCEngine(object):
 
         functions = self._get_functions(alchemical_system)
         integrator = self._choose_integrator(alchemical_system, functions, direction)
-        context = self._create_context(alchemical_system, integrator, initial_positions)
+        context = self._create_context(alchemical_system, integrator, initial_positions, box_vectors=box_vectors)
 
         # Integrate switching
         final_positions, logP_work = self._integrate_switching(integrator, context, topology, indices, iteration, direction)
@@ -571,11 +618,18 @@ class NCMCHybridEngine(NCMCEngine):
                  nsteps=default_nsteps, timestep=default_timestep,
                  constraint_tolerance=None, platform=None,
                  write_ncmc_interval=None, integrator_type='GHMC',
-                 storage=None):
+                 storage=None, preserve_environment=False, hybrid_cache_directory=None,
+                 max_hybrid_templates=8):
         """
         Subclass of NCMCEngine which switches directly between two different
         systems using an alchemical hybrid topology.
 
+        Hybrid systems, topologies and atom maps depend only on the pair of chemical
+        states being interconverted, so they are built once per (old, new) pair and
+        reused for later proposals of the same pair; only the hybrid positions are
+        assembled for each attempt, and the default box vectors are refreshed from
+        the old System when they have changed.
+
         Arguments
         ---------
         temperature : simtk.unit.Quantity with units compatible with kelvin
@@ -600,7 +654,16 @@ class NCMCHybridEngine(NCMCEngine):
             with the specified interval on NCMC switching, with a different
             PDB file generated for each attempt.
         integrator_type : str, optional, default='GHMC'
-            NCMC internal integrator type ['GHMC', 'VV']
+            NCMC internal integrator type ['GHMC', 'VV', 'BAOAB']
+        preserve_environment : bool, optional, default=False
+            If True, hybrid systems keep atoms whose parameters do not change in native forces,
+            so that only the perturbed region is evaluated with custom forces during switching.
+        hybrid_cache_directory : str, optional, default=None
+            If specified, hybrid templates are also written to this directory (System XML plus
+            a pickle of the topology and atom maps) and read back from it when a pair has not
+            yet been seen by this engine, so that restarts skip hybrid construction.
+        max_hybrid_templates : int, optional, default=8
+            Maximum number of hybrid templates kept in memory; the least recently used ones are evicted.
         """
         if functions is None:
             functions = default_hybrid_functions
@@ -608,6 +671,13 @@ class NCMCHybridEngine(NCMCEngine):
                                                timestep=timestep, constraint_tolerance=constraint_tolerance,
                                                platform=platform, write_ncmc_interval=write_ncmc_interval,
                                                storage=storage, integrator_type=integrator_type)
+        self.preserve_environment = preserve_environment
+        self.hybrid_cache_directory = hybrid_cache_directory
+        if hybrid_cache_directory is not None and not os.path.exists(hybrid_cache_directory):
+            os.makedirs(hybrid_cache_directory)
+        self.max_hybrid_templates = max_hybrid_templates
+        # Hybrid templates keyed by (old_chemical_state_key, new_chemical_state_key), least recently used first
+        self._hybrid_templates = collections.OrderedDict()
 
     def make_alchemical_system(self, topology_proposal, old_positions,
                                new_positions):
@@ -636,29 +706,46 @@ class NCMCHybridEngine(NCMCEngine):
         alchemical_positions : simtk.unit.Quantity of dimensions [nparticles,3]
             with units compatible with angstroms
             Positions for the alchemical hybrid topology
-        final_atom_map : dict(int : int)
-            Dictionary mapping the index of every atom in the new topology
+        final_atom_map : perses.rjmc.topology_proposal.AtomMap
+            Map of the index of every atom in the new topology
             to its index in the hybrid topology
-        initial_atom_map : dict(int : int)
-            Dictionary mapping the index of every atom in the old topology
+        initial_atom_map : perses.rjmc.topology_proposal.AtomMap
+            Map of the index of every atom in the old topology
             to its index in the hybrid topology
         """
 
         atom_map = topology_proposal.old_to_new_atom_map
 
         #take the unique atoms as those not in the {new_atom : old_atom} atom map
-        unmodified_old_system = copy.deepcopy(topology_proposal.old_system)
-        unmodified_new_system = copy.deepcopy(topology_proposal.new_system)
+        # HybridTopologyFactory only reads these systems, so no defensive copies are needed
+        unmodified_old_system = topology_proposal.old_system
+        unmodified_new_system = topology_proposal.new_system
         old_topology = topology_proposal.old_topology
         new_topology = topology_proposal.new_topology
 
+        # Reuse the hybrid template for this pair of chemical states if one has been built.
+        template = self._get_hybrid_template(topology_proposal)
+        if template is not None:
+            alchemical_system, alchemical_topology, final_atom_map, initial_atom_map = template
+            box_vectors = unmodified_old_system.getDefaultPeriodicBoxVectors()
+            if alchemical_system.getDefaultPeriodicBoxVectors() != box_vectors:
+                # The cached hybrid System may be in use elsewhere, so the new box goes into a copy.
+                alchemical_system = copy_system(alchemical_system, reason='hybrid template box vectors')
+                alchemical_system.setDefaultPeriodicBoxVectors(*box_vectors)
+                self._hybrid_templates[self._hybrid_template_key(topology_proposal)][0][0] = alchemical_system
+            alchemical_positions = self._assemble_hybrid_positions(alchemical_system.getNumParticles(), old_positions, new_positions, initial_atom_map, final_atom_map)
+            return [unmodified_old_system, unmodified_new_system,
+                    alchemical_system, alchemical_topology, alchemical_positions, final_atom_map,
+                    initial_atom_map]
+
         # Create an alchemical factory.
         from perses.annihilation.relative import HybridTopologyFactory
         alchemical_factory = HybridTopologyFactory(unmodified_old_system,
                                                    unmodified_new_system,
                                                    old_topology, new_topology,
                                                    old_positions,
-                                                   new_positions, atom_map)
+                                                   new_positions, atom_map,
+                                                   preserve_environment=self.preserve_environment)
 
         # Return the alchemically-modified system in fully-interacting form.
         alchemical_system, alchemical_topology, alchemical_positions, final_atom_map, initial_atom_map = alchemical_factory.createPerturbedSystem()
@@ -669,17 +756,149 @@ class NCMCHybridEngine(NCMCEngine):
                 if hasattr(force, 'setFrequency'):
                     force.setFrequency(0)
 
+        self._store_hybrid_template(topology_proposal, [alchemical_system, alchemical_topology, final_atom_map, initial_atom_map])
+
         return [unmodified_old_system, unmodified_new_system,
                 alchemical_system, alchemical_topology, alchemical_positions, final_atom_map,
                 initial_atom_map]
 
+    def _hybrid_template_key(self, topology_proposal):
+        return (topology_proposal.old_chemical_state_key, topology_proposal.new_chemical_state_key)
+
+    def _hybrid_template_filename(self, topology_proposal):
+        """
+        Return the path prefix of the on-disk hybrid template for the chemical state pair of `topology_proposal`.
+        State keys such as SMILES strings may contain characters that are not valid in filenames, so the
+        key is hashed, together with the hybrid construction options and fingerprints of the old and new
+        Systems, so that templates built from different force fields or system options are never mixed up.
+        """
+        key = self._hybrid_template_key(topology_proposal)
+        fingerprints = (system_fingerprint(topology_proposal.old_system), system_fingerprint(topology_proposal.new_system))
+        digest = hashlib.sha1(repr((key, self.preserve_environment, fingerprints)).encode('utf-8')).hexdigest()
+        return os.path.join(self.hybrid_cache_directory, 'hybrid-%s' % digest)
+
+    def _get_hybrid_template(self, topology_proposal):
+        """
+        Retrieve the cached hybrid template for the chemical state pair of `topology_proposal`, if any.
+
+        A template is only returned if it was built with the same old-to-new atom map as the proposal.
+
+        Parameters
+        ----------
+        topology_proposal : TopologyProposal
+            The proposal whose hybrid template is requested
+
+        Returns
+        -------
+        template : list or None
+            [alchemical_system, alchemical_topology, final_atom_map, initial_atom_map], or None if no valid template exists
+        """
+        key = self._hybrid_template_key(topology_proposal)
+        if key not in self._hybrid_templates and self.hybrid_cache_directory is not None:
+            prefix = self._hybrid_template_filename(topology_proposal)
+            if os.path.exists(prefix + '.xml') and os.path.exists(prefix + '.pickle'):
+                with open(prefix + '.xml', 'r') as infile:
+                    alchemical_system = openmm.XmlSerializer.deserialize(infile.read())
+                with open(prefix + '.pickle', 'rb') as infile:
+                    [alchemical_topology, final_atom_map, initial_atom_map, atom_map] = pickle.load(infile)
+                self._cache_hybrid_template(key, [[alchemical_system, alchemical_topology, final_atom_map, initial_atom_map], atom_map])
+                if self.verbose: print("Loaded hybrid template for %s from '%s'" % (str(key), prefix))
+        if key not in self._hybrid_templates:
+            return None
+        # Mark the template as most recently used.
+        template, atom_map = self._hybrid_templates.pop(key)
+        self._hybrid_templates[key] = [template, atom_map]
+        if atom_map != topology_proposal.old_to_new_atom_map:
+            return None
+        return template
+
+    def _store_hybrid_template(self, topology_proposal, template):
+        """
+        Cache a hybrid template for the chemical state pair of `topology_proposal`, writing it to
+        `hybrid_cache_directory` if one was specified.
+
+        Parameters
+        ----------
+        topology_proposal : TopologyProposal
+            The proposal the template was built from
+        template : list
+            [alchemical_system, alchemical_topology, final_atom_map, initial_atom_map]
+        """
+        key = self._hybrid_template_key(topology_proposal)
+        atom_map = dict(topology_proposal.old_to_new_atom_map)
+        self._cache_hybrid_template(key, [template, atom_map])
+        if self.hybrid_cache_directory is not None:
+            [alchemical_system, alchemical_topology, final_atom_map, initial_atom_map] = template
+            prefix = self._hybrid_template_filename(topology_proposal)
+            with open(prefix + '.xml', 'w') as outfile:
+                outfile.write(openmm.XmlSerializer.serialize(alchemical_system))
+            with open(prefix + '.pickle', 'wb') as outfile:
+                pickle.dump([alchemical_topology, final_atom_map, initial_atom_map, atom_map], outfile, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _cache_hybrid_template(self, key, entry):
+        """
+        Insert an entry [template, atom_map] into the in-memory template cache, evicting the least recently used entries.
+        """
+        self._hybrid_templates.pop(key, None)
+        self._hybrid_templates[key] = entry
+        while len(self._hybrid_templates) > max(self.max_hybrid_templates, 1):
+            self._hybrid_templates.popitem(last=False)
+
+    def _assemble_hybrid_positions(self, natoms, old_positions, new_positions, initial_atom_map, final_atom_map):
+        """
+        Assemble hybrid positions from old and new positions using the atom maps of a hybrid template.
+        Old positions take precedence for atoms shared by both systems, as in HybridTopologyFactory.
+
+        Parameters
+        ----------
+        natoms : int
+            Number of particles in the hybrid system
+        old_positions : simtk.unit.Quantity with dimension [n_old, 3] with units of distance
+            Positions of the old system
+        new_positions : simtk.unit.Quantity with dimension [n_new, 3] with units of distance
+            Positions of the new system
+        initial_atom_map : perses.rjmc.topology_proposal.AtomMap
+            Map of old system atom index to hybrid atom index
+        final_atom_map : perses.rjmc.topology_proposal.AtomMap
+            Map of new system atom index to hybrid atom index
+
+        Returns
+        -------
+        hybrid_positions : simtk.unit.Quantity with dimension [natoms, 3] with units of distance
+        """
+        positions_unit = old_positions.unit
+        hybrid_positions = np.zeros([natoms, 3], np.float64)
+        assigned = np.zeros([natoms], bool)
+        for (atom_map, positions) in [(final_atom_map, new_positions), (initial_atom_map, old_positions)]:
+            positions = np.asarray(positions.value_in_unit(positions_unit))
+            hybrid_positions[atom_map.destination_indices, :] = positions[atom_map.source_indices, :]
+            assigned[atom_map.destination_indices] = True
+        if not assigned.all():
+            raise Exception('Atom not found to assign position')
+        return unit.Quantity(hybrid_positions, positions_unit)
+
     def _convert_hybrid_positions_to_final(self, positions, atom_map):
-        final_positions = unit.Quantity(np.zeros([len(atom_map.keys()),3]), unit=unit.nanometers)
-        for finalatom, hybridatom in atom_map.items():
-            final_positions[finalatom] = positions[hybridatom]
-        return final_positions
+        """
+        Extract the positions of one endpoint system from hybrid positions.
 
-    def integrate(self, topology_proposal, initial_positions, proposed_positions, platform=None, iteration=None):
+        Parameters
+        ----------
+        positions : simtk.unit.Quantity with dimension [n_hybrid, 3] with units of distance
+            Hybrid system positions
+        atom_map : perses.rjmc.topology_proposal.AtomMap
+            Map of endpoint system atom index to hybrid atom index
+
+        Returns
+        -------
+        final_positions : simtk.unit.Quantity with dimension [len(atom_map), 3] with units of distance
+        """
+        positions_unit = unit.nanometers
+        hybrid_positions = np.asarray(positions.value_in_unit(positions_unit))
+        final_positions = np.zeros([len(atom_map), 3], np.float64)
+        final_positions[atom_map.source_indices, :] = hybrid_positions[atom_map.destination_indices, :]
+        return unit.Quantity(final_positions, positions_unit)
+
+    def integrate(self, topology_proposal, initial_positions, proposed_positions, platform=None, iteration=None, box_vectors=None):
         """
         Performs NCMC switching to either delete or insert atoms according to the provided `topology_proposal`.
 
@@ -693,6 +912,11 @@ class NCMCHybridEngine(NCMCEngine):
             Positions of the new system atoms proposed by geometry engine.
         platform : simtk.openmm.Platform, optional, default=None
             If not None, this platform is used for integration.
+        iteration : int, optional, default=None
+            Iteration number, for storage purposes.
+        box_vectors : simtk.unit.Quantity wrapped 3-tuple of Vec3, optional, default=None
+            If specified, the periodic box vectors of the configuration; otherwise the default box vectors of the hybrid System are used.
+
         Returns
         -------
         final_positions : simtk.unit.Quantity of dimensions [natoms, 3] with units of distance
@@ -721,7 +945,7 @@ class NCMCHybridEngine(NCMCEngine):
         indices = [initial_to_hybrid_atom_map[idx] for idx in topology_proposal.unique_old_atoms] + [final_to_hybrid_atom_map[idx] for idx in topology_proposal.unique_new_atoms]
         functions = self._get_functions(alchemical_system)
         integrator = self._choose_integrator(alchemical_system, functions, direction)
-        context = self._create_context(alchemical_system, integrator, alchemical_positions)
+        context = self._create_context(alchemical_system, integrator, alchemical_positions, box_vectors=box_vectors)
 
         final_hybrid_positions, logP_work = self._integrate_switching(integrator, context, alchemical_topology, indices, iteration, direction)
         final_positions = self._convert_hybrid_positions_to_final(final_hybrid_positions, final_to_hybrid_atom_map)
@@ -734,6 +958,155 @@ class NCMCHybridEngine(NCMCEngine):
         # Return
         return [final_positions, new_old_positions, logP_work, logP_energy]
 
+class NCMCSuperposedLigandsEngine(NCMCEngine):
+    """
+    NCMC switching engine for a SuperposedLigandsFactory hybrid System containing every ligand
+    of a library at once.
+
+    A single integrator and Context are created on first use and kept for the lifetime of the engine.
+    Switching from one ligand to another only rewrites the per-term parameters of the superposed
+    System in the existing Context, so neither Systems nor Contexts are rebuilt between attempts.
+
+    Because the superposed System with a single active ligand is used as the sampled state, the
+    endpoints of the switching protocol are the sampled states themselves and there is no
+    energy contribution to the acceptance probability beyond the NCMC work.
+    """
+
+    def __init__(self, factory, temperature=default_temperature, functions=None,
+                 nsteps=default_nsteps, timestep=default_timestep,
+                 constraint_tolerance=None, platform=None,
+                 write_ncmc_interval=None, integrator_type='GHMC',
+                 storage=None):
+        """
+        Arguments
+        ---------
+        factory : perses.annihilation.relative.SuperposedLigandsFactory
+            Factory holding the superposed System; the Context is created from factory.system itself
+        temperature : simtk.unit.Quantity with units compatible with kelvin
+            The temperature at which switching is to be run
+        functions : dict of str:str, optional, default=default_hybrid_functions
+            functions[parameter] is the function (parameterized by 't' which
+            switched from 0 to 1) that controls how alchemical context
+            parameter 'parameter' is switched
+        nsteps : int, optional, default=1
+            The number of steps to use for switching.
+        timestep : simtk.unit.Quantity with units compatible with femtoseconds,
+            optional, default=1*femtosecond
+            The timestep to use for integration of switching steps.
+        constraint_tolerance : float, optional, default=None
+            If not None, this relative constraint tolerance is used for
+            position and velocity constraints.
+        platform : simtk.openmm.Platform, optional, default=None
+            If specified, the platform to use for OpenMM simulations.
+        write_ncmc_interval : int, optional, default=None
+            If a positive integer is specified, a snapshot frame will be written to storage with the specified interval on NCMC switching.
+        integrator_type : str, optional, default='GHMC'
+            NCMC internal integrator type ['GHMC', 'VV', 'BAOAB']
+        storage : NetCDFStorageView, optional, default=None
+            If specified, write data using this class.
+        """
+        if functions is None:
+            functions = default_hybrid_functions
+        super(NCMCSuperposedLigandsEngine, self).__init__(temperature=temperature, functions=functions, nsteps=nsteps,
+                                                          timestep=timestep, constraint_tolerance=constraint_tolerance,
+                                                          platform=platform, write_ncmc_interval=write_ncmc_interval,
+                                                          storage=storage, integrator_type=integrator_type)
+        self.factory = factory
+        self._functions = None
+        self._integrator = None
+        self._context = None
+
+    def _get_persistent_context(self, positions):
+        """
+        Return the persistent integrator and Context, creating them on first use.
+
+        The Context must be created from factory.system itself (not a copy) so that
+        updateParametersInContext can locate the forces whose parameters are switched.
+        """
+        if self._context is None:
+            system = self.factory.system
+            self._functions = self._get_functions(system)
+            self._integrator = self._choose_integrator(system, self._functions, 'insert')
+            self._context = self._create_context(system, self._integrator, positions)
+        return self._integrator, self._context
+
+    def release_context(self):
+        """
+        Discard the persistent integrator and Context, so that they are recreated on next use.
+        """
+        self._integrator = None
+        self._context = None
+
+    def get_checkpoint_state(self):
+        """
+        Return an OpenMM checkpoint of the persistent Context (including its integrator state), or None if it has not been created.
+        """
+        if self._context is None:
+            return None
+        return self._context.createCheckpoint()
+
+    def set_checkpoint_state(self, checkpoint, positions):
+        """
+        Recreate the persistent Context from a checkpoint returned by `get_checkpoint_state`.
+
+        Parameters
+        ----------
+        checkpoint : bytes or None
+            The checkpoint; if None, the persistent Context is created on next use
+        positions : simtk.unit.Quantity of dimension [natoms, 3] with units of length
+            Positions used to create the Context before the checkpoint is loaded
+        """
+        self.release_context()
+        if checkpoint is not None:
+            integrator, context = self._get_persistent_context(positions)
+            context.loadCheckpoint(checkpoint)
+
+    def integrate(self, initial_state_key, final_state_key, initial_positions, box_vectors=None, iteration=None):
+        """
+        Switch the superposed System from one ligand to another.
+
+        Parameters
+        ----------
+        initial_state_key : str
+            Chemical state key of the current ligand
+        final_state_key : str
+            Chemical state key of the proposed ligand
+        initial_positions : simtk.unit.Quantity with dimension [natoms, 3] with units of distance.
+            Positions of all atoms of the superposed System at the beginning of the NCMC switching.
+        box_vectors : simtk.unit.Quantity wrapped 3-tuple of Vec3, optional, default=None
+            If given, the periodic box vectors to use.
+        iteration : int, optional, default=None
+            Iteration number, for storage purposes.
+
+        Returns
+        -------
+        final_positions : simtk.unit.Quantity of dimensions [natoms, 3] with units of distance
+            The final positions of the superposed System after `nsteps` steps of alchemical switching
+        logP_work : float
+            The NCMC work contribution to the log acceptance probability
+        """
+        assert quantity_is_finite(initial_positions) == True
+
+        integrator, context = self._get_persistent_context(initial_positions)
+        self.factory.set_ligands(initial_state_key, final_state_key, context=context)
+        integrator.reset()
+        for parameter in self._functions:
+            context.setParameter(parameter, 0.0)
+        if box_vectors is not None:
+            context.setPeriodicBoxVectors(*box_vectors)
+        context.setPositions(initial_positions)
+        context.applyConstraints(integrator.getConstraintTolerance())
+        context.setVelocitiesToTemperature(self.temperature, np.random.randint(1, 2**30))
+        context.applyVelocityConstraints(integrator.getConstraintTolerance())
+
+        indices = sorted(self.factory.ligand_atoms(initial_state_key) ^ self.factory.ligand_atoms(final_state_key))
+        final_positions, logP_work = self._integrate_switching(integrator, context, self.factory.topology, indices, iteration, 'insert')
+
+        # Keep track of statistics.
+        self.nattempted += 1
+
+        return [final_positions, logP_work]
+
 class NCMCAlchemicalIntegrator(openmm.CustomIntegrator):
     """
     Helper base class for NCMC alchemical integrators.
@@ -775,6 +1148,7 @@ class NCMCAlchemicalIntegrator(openmm.CustomIntegrator):
         self.kT = kT
 
         self.has_statistics = False # no GHMC statistics by default
+        self.has_work_trajectory = True # work is accumulated at every switching step by default
 
         self.nsteps = nsteps
 
@@ -810,6 +1184,17 @@ class NCMCAlchemicalIntegrator(openmm.CustomIntegrator):
         # Store initial potential energy
         self.addComputeGlobal("Eold", "energy")
 
+        # Update the alchemical state
+        self.addLambdaUpdateStep()
+
+        # Accumulate protocol work
+        self.addComputeGlobal("Enew", "energy")
+        self.addComputeGlobal("protocol_work", "protocol_work + (Enew-Eold)/kT")
+
+    def addLambdaUpdateStep(self):
+        """
+        Advance the master 'lambda' alchemical parameter and all slaved parameters, without computing any energies.
+        """
         # Set the master 'lambda' alchemical parameter to the current fractional state
         if self.nsteps == 0:
             # Toggle alchemical state
@@ -827,10 +1212,6 @@ class NCMCAlchemicalIntegrator(openmm.CustomIntegrator):
         # Update all slaved alchemical parameters
         self.addUpdateAlchemicalParametersStep()
 
-        # Accumulate protocol work
-        self.addComputeGlobal("Enew", "energy")
-        self.addComputeGlobal("protocol_work", "protocol_work + (Enew-Eold)/kT")
-
     def addUpdateAlchemicalParametersStep(self):
         """
         Update Context parameters according to provided functions.
@@ -1257,3 +1638,243 @@ class NCMCGHMCAlchemicalIntegrator(NCMCAlchemicalIntegrator):
             self.addComputeTotalWorkStep()
             # End block
             self.endBlock()
+
+class NCMCBAOABAlchemicalIntegrator(NCMCAlchemicalIntegrator):
+    """
+    Use NCMC switching to annihilate or introduce particles alchemically, propagating with a
+    BAOAB (VRORV) Langevin splitting.
+
+    Rather than Metropolizing every propagation step as in GHMC, the heat exchanged with the bath
+    is measured from the kinetic energy change across each stochastic (O) substep. The total work
+    then follows from the change in total energy over the whole protocol,
+
+    W = [H(x_N, v_N; lambda_N) - H(x_0, v_0; lambda_0)] / kT - Q
+
+    so the potential energy only needs to be evaluated at the beginning and end of the protocol.
+
+    Notes
+    -----
+    Because intermediate energies are not computed, `getTotalWork()` is only meaningful once the
+    full protocol has been executed, and `has_work_trajectory` is False so that NCMC engines do not
+    record per-step work trajectories. Protocol and shadow work can only be separated if
+    `measure_protocol_work=True`, which reintroduces two energy evaluations per switching step;
+    otherwise `getProtocolWork()` and `getShadowWork()` return NaN.
+
+    References
+    ----------
+    [1] Leimkuhler B and Matthews C. Robust and efficient configurational molecular sampling via Langevin dynamics. JCP 138:174102, 2013.
+    http://dx.doi.org/10.1063/1.4802990
+    [2] Sivak DA, Chodera JD, and Crooks GE. Using nonequilibrium fluctuation theorems to understand and correct errors in equilibrium and nonequilibrium discrete Langevin dynamics simulations. PRX 3:011007, 2013.
+    http://dx.doi.org/10.1103/PhysRevX.3.011007
+
+    Examples
+    --------
+
+    Annihilate a Lennard-Jones particle
+
+    >>> # Create an alchemically-perturbed test system
+    >>> from openmmtools import testsystems
+    >>> testsystem = testsystems.LennardJonesCluster()
+    >>> from alchemy import AbsoluteAlchemicalFactory
+    >>> alchemical_atoms = [0]
+    >>> factory = AbsoluteAlchemicalFactory(testsystem.system, ligand_atoms=alchemical_atoms)
+    >>> alchemical_system = factory.createPerturbedSystem()
+    >>> # Create an NCMC switching integrator.
+    >>> temperature = 300.0 * unit.kelvin
+    >>> nsteps = 5
+    >>> functions = { 'lambda_sterics' : 'lambda' }
+    >>> ncmc_integrator = NCMCBAOABAlchemicalIntegrator(temperature, alchemical_system, functions, nsteps=nsteps, direction='delete')
+    >>> # Create a Context
+    >>> context = openmm.Context(alchemical_system, ncmc_integrator)
+    >>> context.setPositions(testsystem.positions)
+    >>> # Run the integrator
+    >>> ncmc_integrator.step(nsteps)
+    >>> # Retrieve the log acceptance probability
+    >>> log_ncmc = ncmc_integrator.getLogAcceptanceProbability(context)
+
+    """
+
+    def __init__(self, temperature, system, functions, nsteps=0, steps_per_propagation=1, collision_rate=9.1/unit.picoseconds, timestep=1.0*unit.femtoseconds, direction='insert', measure_protocol_work=False):
+        """
+        Initialize an NCMC switching integrator to annihilate or introduce particles alchemically.
+
+        Parameters
+        ----------
+        temperature : simtk.unit.Quantity with units compatible with kelvin
+            The temperature to use for computing the NCMC acceptance probability.
+        system : simtk.openmm.System
+            The system to be simulated.
+        functions : dict of str : str
+            functions[parameter] is the function (parameterized by 't' which switched from 0 to 1) that
+            controls how alchemical context parameter 'parameter' is switched
+        nsteps : int, optional, default=0
+            The number of switching timesteps per call to integrator.step(1).
+        steps_per_propagation : int, optional, default=1
+            The number of propagation steps taken at each value of lambda
+        collision_rate : simtk.unit.Quantity with units compatible with 1/picoseconds, optional, default=9.1/picoseconds
+            The Langevin collision rate.
+        timestep : simtk.unit.Quantity with units compatible with femtoseconds
+            The timestep to use for each NCMC step.
+        direction : str, optional, default='insert'
+            One of ['insert', 'delete'].
+            For `insert`, the parameter 'lambda' is switched from 0 to 1.
+            For `delete`, the parameter 'lambda' is switched from 1 to 0.
+        measure_protocol_work : bool, optional, default=False
+            If True, the potential energy is evaluated before and after each perturbation so that
+            protocol and shadow work are accumulated separately.
+
+        Note that each call to integrator.step(1) executes the entire integration program; this should not be called with more than one step.
+
+        A symmetric protocol is used, in which the protocol begins and ends with a Langevin propagation step.
+
+        """
+        super(NCMCBAOABAlchemicalIntegrator, self).__init__(temperature, system, functions, nsteps, steps_per_propagation, timestep, direction)
+
+        gamma = collision_rate
+        self.measure_protocol_work = measure_protocol_work
+        # Total and shadow work are only computed once the protocol is complete
+        self.has_work_trajectory = (nsteps == 0)
+
+        # NCMC variables
+        self.addGlobalVariables(nsteps, steps_per_propagation)
+
+        if (nsteps > 0):
+            # Langevin variables
+            self.addGlobalVariable("a", np.exp(-gamma * timestep)) # velocity damping factor
+            self.addPerDofVariable("sigma", 0)
+            self.addGlobalVariable("heat", 0.0) # cumulative heat in kT
+            self.addGlobalVariable("initial_total_energy", 0.0) # total energy at initial alchemical state
+            self.addGlobalVariable("kinetic_old", 0.0) # kinetic energy before the stochastic substep
+
+        if nsteps == 0:
+            # Only run on the first call
+            self.beginIfBlock('step = 0')
+            # Constrain initial positions and velocities
+            self.addConstrainPositions()
+            self.addConstrainVelocities()
+            # Initialize alchemical state
+            self.addWorkResetStep()
+            self.addAlchemicalResetStep()
+            # Accumulate protocol work
+            self.addAlchemicalPerturbationStep()
+            # Compute total work
+            self.addComputeTotalWorkStep()
+            # Update step counter
+            self.addComputeGlobal("step", "step+1")
+            # End block
+            self.endBlock()
+
+        if nsteps > 0:
+            # Initial step only
+            self.beginIfBlock('step = 0')
+            # Constrain initial positions and velocities
+            self.addConstrainPositions()
+            self.addConstrainVelocities()
+            # Initialize alchemical state
+            self.addWorkResetStep()
+            self.addAlchemicalResetStep()
+            self.addComputeGlobal("heat", "0.0")
+            self.addComputePerDof("sigma", "sqrt(kT/m)")
+            self.addComputeSum("kinetic", "0.5*m*v*v")
+            self.addComputeGlobal("initial_total_energy", "initial_reduced_potential*kT + kinetic")
+            # Execute initial propagation steps for symmetry
+            self.addComputeGlobal('pstep', '0')
+            self.beginWhileBlock('pstep < psteps')
+            self.addBAOABStep()
+            self.addComputeGlobal('pstep', 'pstep+1')
+            self.endBlock()
+            # End block
+            self.endBlock()
+
+            # All steps, including initial step
+            self.beginIfBlock('step < nsteps')
+            # Perturb alchemical state
+            if self.measure_protocol_work:
+                self.addAlchemicalPerturbationStep()
+            else:
+                self.addLambdaUpdateStep()
+            # Execute propagation steps.
+            self.addComputeGlobal('pstep', '0')
+            self.beginWhileBlock('pstep < psteps')
+            self.addBAOABStep()
+            self.addComputeGlobal('pstep', 'pstep+1')
+            self.endBlock()
+            # Increment step
+            self.addComputeGlobal('step', 'step+1')
+            # Compute total work from the total energy change once the protocol is complete
+            self.beginIfBlock('step = nsteps')
+            self.addComputeSum("kinetic", "0.5*m*v*v")
+            self.addComputeGlobal("final_reduced_potential", "energy/kT")
+            self.addComputeGlobal("total_work", "final_reduced_potential + (kinetic - initial_total_energy)/kT - heat")
+            self.addComputeGlobal("shadow_work", "total_work - protocol_work")
+            self.endBlock()
+            # End block
+            self.endBlock()
+
+    def addBAOABStep(self):
+        """
+        Add a Langevin step with VRORV splitting, accumulating the heat absorbed during the stochastic substep.
+        NOTE: Positions and velocities must have been constrained first.
+
+        """
+        # Allow context state to be updated
+        self.addUpdateContextState()
+
+        # V: half-kick
+        self.addComputePerDof("v", "v + 0.5*dt*f/m")
+        self.addConstrainVelocities()
+
+        # R: half-drift
+        self.addComputePerDof("x", "x + 0.5*dt*v")
+        self.addComputePerDof("x1", "x")
+        self.addConstrainPositions()
+        self.addComputePerDof("v", "v + (x-x1)/(0.5*dt)")
+        self.addConstrainVelocities()
+
+        # O: velocity randomization, accumulating heat
+        self.addComputeSum("kinetic_old", "0.5*m*v*v")
+        self.addComputePerDof("v", "a*v + sqrt(1-a*a)*sigma*gaussian")
+        self.addConstrainVelocities()
+        self.addComputeSum("kinetic", "0.5*m*v*v")
+        self.addComputeGlobal("heat", "heat + (kinetic - kinetic_old)/kT")
+
+        # R: half-drift
+        self.addComputePerDof("x", "x + 0.5*dt*v")
+        self.addComputePerDof("x1", "x")
+        self.addConstrainPositions()
+        self.addComputePerDof("v", "v + (x-x1)/(0.5*dt)")
+        self.addConstrainVelocities()
+
+        # V: half-kick
+        self.addComputePerDof("v", "v + 0.5*dt*f/m")
+        self.addConstrainVelocities()
+
+    def reset(self):
+        """
+        Reset everything.
+        """
+        super(NCMCBAOABAlchemicalIntegrator, self).reset()
+        if self.nsteps > 0:
+            self.setGlobalVariableByName("heat", 0.0)
+            self.setGlobalVariableByName("initial_total_energy", 0.0)
+
+    def getHeat(self, context):
+        """Retrieve accumulated heat (in units of kT)
+        """
+        if self.nsteps == 0:
+            return 0.0
+        return self.getGlobalVariableByName("heat")
+
+    def getShadowWork(self, context):
+        """Retrieve accumulated shadow work (in units of kT), or NaN if protocol work is not being measured
+        """
+        if (self.nsteps > 0) and not self.measure_protocol_work:
+            return np.nan
+        return self.getGlobalVariableByName("shadow_work")
+
+    def getProtocolWork(self, context):
+        """Retrieve accumulated protocol work (in units of kT), or NaN if protocol work is not being measured
+        """
+        if (self.nsteps > 0) and not self.measure_protocol_work:
+            return np.nan
+        return self.getGlobalVariableByName("protocol_work")
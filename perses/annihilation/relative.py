@@ -3,7 +3,8 @@ from simtk import unit
 import simtk.openmm.app as app
 import numpy as np
 import copy
-from perses.rjmc.topology_proposal import deepcopy_topology
+from perses.rjmc.topology_proposal import deepcopy_topology, AtomMap
+from perses.systems import copy_system
 
 ONE_4PI_EPS0 = 138.935456 # OpenMM constant for Coulomb interactions (openmm/platforms/reference/include/SimTKOpenMMRealType.h) in OpenMM units
 
@@ -13,8 +14,14 @@ def unique(atom_list):
     else:
         return tuple(atom_list)
 
+def _strip_units(value):
+    """Return a plain number in the OpenMM MD unit system."""
+    if unit.is_quantity(value):
+        return value.value_in_unit_system(unit.md_unit_system)
+    return value
+
 class HybridTopologyFactory(object):
-    def __init__(self, system1, system2, topology1, topology2, positions1, positions2, atom_mapping_1to2, softening=1.0):
+    def __init__(self, system1, system2, topology1, topology2, positions1, positions2, atom_mapping_1to2, softening=1.0, preserve_environment=False):
         """
         Arguments:
             system1
@@ -26,6 +33,10 @@ class HybridTopologyFactory(object):
             atom_mapping_1to2 : dict[atom_index_in_system1] = atom_index_in_system2
             softening: float, 0 - 1
                        minimum fraction of bond angle, and torsion forces
+            preserve_environment: bool, optional, default=False
+                       if True, atoms and terms whose parameters are identical in both systems keep
+                       native OpenMM forces, and only interactions involving unique atoms or core
+                       atoms with changed parameters go through the alchemical custom forces
         """
         # Assert that number of forces and ordering of forces are same for system1 and system2
         systems_have_same_force_order = True
@@ -49,8 +60,9 @@ class HybridTopologyFactory(object):
 
         self.softcore_alpha=0.5
         self.softcore_beta=12*unit.angstrom**2
-        self.system1 = copy.deepcopy(system1)
-        self.system2 = copy.deepcopy(system2)
+        # system1 and system2 are only read; createPerturbedSystem copies system1 once to build the hybrid.
+        self.system1 = system1
+        self.system2 = system2
 
         if softening < 0.0 or softening > 1.0:
             softening = 0.1
@@ -75,9 +87,9 @@ class HybridTopologyFactory(object):
             system1_atoms[atom1.index] = atom1
         self.system1_atoms = system1_atoms
 
-        self.positions1 = copy.deepcopy(positions1)
-        self.positions2 = copy.deepcopy(positions2)
-        self.atom_mapping_1to2 = copy.deepcopy(atom_mapping_1to2)
+        self.positions1 = positions1
+        self.positions2 = positions2
+        self.atom_mapping_1to2 = dict(atom_mapping_1to2)
         keys_to_delete = list()
         for atom1idx, atom2idx in self.atom_mapping_1to2.items():
             atom1 = system1_atoms[atom1idx]
@@ -90,9 +102,10 @@ class HybridTopologyFactory(object):
             del(self.atom_mapping_1to2[key])
 
         self.atom_mapping_2to1 = {old_atom : new_atom for new_atom, old_atom in self.atom_mapping_1to2.items()}
-        self.unique_atoms1 = [atom for atom in range(topology1._numAtoms) if atom not in self.atom_mapping_1to2.keys()]
-        self.unique_atoms2 = [atom for atom in range(topology2._numAtoms) if atom not in self.atom_mapping_1to2.values()]
+        self.unique_atoms1 = [atom for atom in range(topology1._numAtoms) if atom not in self.atom_mapping_1to2]
+        self.unique_atoms2 = [atom for atom in range(topology2._numAtoms) if atom not in self.atom_mapping_2to1]
 
+        self.preserve_environment = preserve_environment
         self.verbose = False
 
     def _handle_constraints(self, system, system2, sys2_indices_in_system):
@@ -109,20 +122,20 @@ class HybridTopologyFactory(object):
 
     def _create_new_positions_array(self, topology, positions, sys1_indices_in_system, sys2_indices_in_system):
         natoms = positions.shape[0] + len(self.unique_atoms2) # new number of atoms
-        positions = unit.Quantity(np.resize(positions/positions.unit, [natoms,3]), positions.unit)
-        index_in_sys1 = { value: key for key, value in sys1_indices_in_system.items() }
-        index_in_sys2 = { value: key for key, value in sys2_indices_in_system.items() }
-        for atom in topology.atoms():
-            if atom.index in index_in_sys1.keys():
-                atomidx = index_in_sys1[atom.index]
-                position = self.positions1[atomidx]
-            elif atom.index in index_in_sys2.keys():
-                atomidx = index_in_sys2[atom.index]
-                position = self.positions2[atomidx]
-            else:
-                raise Exception('Atom not found to assign position')
-            positions[atom.index] = position
-        return positions
+        positions_unit = positions.unit
+        positions1 = np.asarray(self.positions1.value_in_unit(positions_unit))
+        positions2 = np.asarray(self.positions2.value_in_unit(positions_unit))
+        new_positions = np.zeros([natoms, 3], np.float64)
+        assigned = np.zeros([natoms], bool)
+        # Fill from system2 first so that system1 positions take precedence for shared atoms.
+        for (atoms, source_positions) in [(sys2_indices_in_system, positions2), (sys1_indices_in_system, positions1)]:
+            source_indices = np.fromiter(atoms.keys(), dtype=np.int64, count=len(atoms))
+            system_indices = np.fromiter(atoms.values(), dtype=np.int64, count=len(atoms))
+            new_positions[system_indices, :] = source_positions[source_indices, :]
+            assigned[system_indices] = True
+        if not assigned.all():
+            raise Exception('Atom not found to assign position')
+        return unit.Quantity(new_positions, positions_unit)
 
     #######################
     # HARMONIC BOND FORCE #
@@ -156,8 +169,9 @@ class HybridTopologyFactory(object):
         custom_force.addPerBondParameter('K2') # molecule2 spring constant
         return custom_force
 
-    def _harmonic_bond_add_core(self, shared_bonds, sys2_indices_in_system, force1, force2, custom_force):
+    def _harmonic_bond_add_core(self, shared_bonds, sys2_indices_in_system, force1, force2, custom_force, native_force=None):
         # Process bonds that are shared by molecule1 and molecule2.
+        # If native_force is given, bonds with unchanged parameters stay in it.
         if self.verbose: print("Translating shared bonds to CustomBondForce...")
         for (index, index1, index2) in shared_bonds:
             # Create interpolated bond parameters.
@@ -165,7 +179,10 @@ class HybridTopologyFactory(object):
             [atom2_i, atom2_j, length2, K2] = force2.getBondParameters(index2)
             atom_i = sys2_indices_in_system[atom2_i]
             atom_j = sys2_indices_in_system[atom2_j]
-            custom_force.addBond(atom_i, atom_j, [length1, K1, length2, K2])
+            if (native_force is not None) and (length1 == length2) and (K1 == K2):
+                native_force.addBond(atom_i, atom_j, length1, K1)
+            else:
+                custom_force.addBond(atom_i, atom_j, [length1, K1, length2, K2])
 
     def _harmonic_bond_add_unique(self, unique_bonds2, unique_bonds1, force2, force1, sys2_indices_in_system, sys1_indices_in_system, custom_force):
         if self.verbose: print("Adding custom parameters to unique bonds...")
@@ -181,7 +198,7 @@ class HybridTopologyFactory(object):
             atom_j = sys1_indices_in_system[atom1_j]
             custom_force.addBond(atom_i, atom_j, [length1, K1, length1, self.softening*K1])
 
-    def _harmonic_bond_force(self, force, force1, force2, common1, common2, sys1_indices_in_system, sys2_indices_in_system, mapping2, system, this_index):
+    def _harmonic_bond_force(self, force, force1, force2, common1, common2, sys1_indices_in_system, sys2_indices_in_system, mapping2, system):
         def index_bonds(force):
             bonds = dict()
             for index in range(force.getNumBonds()):
@@ -199,18 +216,17 @@ class HybridTopologyFactory(object):
         unique_bonds1 = [ bonds1[atoms] for atoms in bonds1 if not set(atoms).issubset(common1) ]
         unique_bonds2 = [ bonds2[atoms] for atoms in bonds2 if not set(atoms).issubset(common2) ]
 
-        for atoms, index in bonds.items():
-            [atom_i, atom_j, length, K] = force.getBondParameters(index)
-            force.setBondParameters(index, atom_i, atom_j, length, 0*K)
-
         shared_bonds = self._harmonic_bond_find_shared(common2, sys2_indices_in_system, mapping2, bonds, bonds1, bonds2)
 
         custom_force = self._harmonic_bond_custom_force()
         system.addForce(custom_force)
+        native_force = None
+        if self.preserve_environment:
+            native_force = mm.HarmonicBondForce()
+            system.addForce(native_force)
 
-        self._harmonic_bond_add_core(shared_bonds, sys2_indices_in_system, force1, force2, custom_force)
+        self._harmonic_bond_add_core(shared_bonds, sys2_indices_in_system, force1, force2, custom_force, native_force)
         self._harmonic_bond_add_unique(unique_bonds2, unique_bonds1, force2, force1, sys2_indices_in_system, sys1_indices_in_system, custom_force)
-        system.removeForce(this_index)
 
     ########################
     # HARMONIC ANGLE FORCE #
@@ -245,8 +261,9 @@ class HybridTopologyFactory(object):
         custom_force.addPerAngleParameter('K_2') # molecule2 spring constant
         return custom_force
 
-    def _harmonic_angle_add_core(self, shared_angles, sys1_indices_in_system, force1, force2, custom_force):
+    def _harmonic_angle_add_core(self, shared_angles, sys1_indices_in_system, force1, force2, custom_force, native_force=None):
         # Process angles that are shared by molecule1 and molecule2.
+        # If native_force is given, angles with unchanged parameters stay in it.
         if self.verbose: print("Translating shared angles to CustomAngleForce...")
         for (index, index1, index2) in shared_angles:
             # Create interpolated angle parameters.
@@ -255,7 +272,10 @@ class HybridTopologyFactory(object):
             atom_i = sys1_indices_in_system[atom1_i]
             atom_j = sys1_indices_in_system[atom1_j]
             atom_k = sys1_indices_in_system[atom1_k]
-            custom_force.addAngle(atom_i, atom_j, atom_k, [theta1, K1, theta2, K2])
+            if (native_force is not None) and (theta1 == theta2) and (K1 == K2):
+                native_force.addAngle(atom_i, atom_j, atom_k, theta1, K1)
+            else:
+                custom_force.addAngle(atom_i, atom_j, atom_k, [theta1, K1, theta2, K2])
 
     def _harmonic_angle_add_unique(self, unique_angles2, unique_angles1, force2, force1, sys2_indices_in_system, sys1_indices_in_system, custom_force):
         if self.verbose: print("Adding custom parameters to unique angles...")
@@ -272,7 +292,7 @@ class HybridTopologyFactory(object):
             atom_k = sys1_indices_in_system[atom1_k]
             custom_force.addAngle(atom_i, atom_j, atom_k, [theta1, K1, theta1, self.softening*K1])
 
-    def _harmonic_angle_force(self, force, force1, force2, common1, common2, sys1_indices_in_system, sys2_indices_in_system, mapping2, system, this_index):
+    def _harmonic_angle_force(self, force, force1, force2, common1, common2, sys1_indices_in_system, sys2_indices_in_system, mapping2, system):
         def index_angles(force):
             angles = dict()
             for index in range(force.getNumAngles()):
@@ -292,17 +312,15 @@ class HybridTopologyFactory(object):
 
         shared_angles = self._harmonic_angle_find_shared(common2, sys2_indices_in_system, mapping2, angles, angles1, angles2)
 
-        if self.verbose: print("Removing existing angle parameters...")
-        for index in range(force.getNumAngles()):
-            [atom_i, atom_j, atom_k, angle, K] = force.getAngleParameters(index)
-            force.setAngleParameters(index, atom_i, atom_j, atom_k, angle, 0*K)
-
         custom_force = self._harmonic_angle_custom_force()
         system.addForce(custom_force)
+        native_force = None
+        if self.preserve_environment:
+            native_force = mm.HarmonicAngleForce()
+            system.addForce(native_force)
 
-        self._harmonic_angle_add_core(shared_angles, sys1_indices_in_system, force1, force2, custom_force)
+        self._harmonic_angle_add_core(shared_angles, sys1_indices_in_system, force1, force2, custom_force, native_force)
         self._harmonic_angle_add_unique(unique_angles2, unique_angles1, force2, force1, sys2_indices_in_system, sys1_indices_in_system, custom_force)
-        system.removeForce(this_index)
 
     ##########################
     # PERIODIC TORSION FORCE #
@@ -376,10 +394,21 @@ class HybridTopologyFactory(object):
         custom_force.addPerTorsionParameter('K2') # molecule2 spring constant
         return custom_force
 
-    def _periodic_torsion_add_core(self, shared_torsions, sys1_indices_in_system, force1, force2, custom_force):
+    def _periodic_torsion_add_core(self, shared_torsions, sys1_indices_in_system, force1, force2, custom_force, native_force=None):
         # Process torsions that are shared by molecule1 and molecule2.
+        # If native_force is given, torsions whose terms are unchanged stay in it.
         if self.verbose: print("Translating shared torsions to CustomTorsionForce...")
         for (index, index1, index2) in shared_torsions:
+            if native_force is not None:
+                terms1 = [force1.getTorsionParameters(ix1) for ix1 in index1]
+                terms2 = [force2.getTorsionParameters(ix2) for ix2 in index2]
+                parameters1 = sorted(tuple(_strip_units(value) for value in term[4:]) for term in terms1)
+                parameters2 = sorted(tuple(_strip_units(value) for value in term[4:]) for term in terms2)
+                if parameters1 == parameters2:
+                    for [atom1_i, atom1_j, atom1_k, atom1_l, periodicity, phase, K] in terms1:
+                        atoms = [sys1_indices_in_system[atom] for atom in [atom1_i, atom1_j, atom1_k, atom1_l]]
+                        native_force.addTorsion(atoms[0], atoms[1], atoms[2], atoms[3], periodicity, phase, K)
+                    continue
             for ix1 in index1:
             # Create interpolated torsion parameters.
                 [atom1_i, atom1_j, atom1_k, atom1_l, periodicity1, phase1, K1] = force1.getTorsionParameters(ix1)
@@ -413,13 +442,13 @@ class HybridTopologyFactory(object):
                 atom_l = sys1_indices_in_system[atom1_l]
                 custom_force.addTorsion(atom_i, atom_j, atom_k, atom_l, [periodicity1, phase1, K1, periodicity1, phase1, self.softening*K1])
 
-    def _periodic_torsion_force(self, force, force1, force2, common1, common2, sys1_indices_in_system, sys2_indices_in_system, mapping2, system, system_atoms, this_index):
+    def _periodic_torsion_force(self, force, force1, force2, common1, common2, sys1_indices_in_system, sys2_indices_in_system, mapping2, system, system_atoms):
         def index_torsions(force):
             torsions = dict()
             for index in range(force.getNumTorsions()):
                 [atom_i, atom_j, atom_k, atom_l, periodicity, phase, K] = force.getTorsionParameters(index)
                 key = unique([atom_i, atom_j, atom_k, atom_l]) # unique tuple, possibly in reverse order
-                if key not in torsions.keys():
+                if key not in torsions:
                     torsions[key] = list()
                 torsions[key].append(index)
             return torsions
@@ -438,20 +467,15 @@ class HybridTopologyFactory(object):
         assert len(shared_torsions) + len(unique_torsions1) == len(torsions1.keys())
         assert len(shared_torsions) + len(unique_torsions2) == len(torsions2.keys())
 
-        if self.verbose: print("Removing existing torsion parameters...")
-        for index in range(force.getNumTorsions()):
-            [atom1_i, atom1_j, atom1_k, atom1_l, periodicity, phase, K] = force.getTorsionParameters(index)
-            atom_i = sys1_indices_in_system[atom1_i]
-            atom_j = sys1_indices_in_system[atom1_j]
-            atom_k = sys1_indices_in_system[atom1_k]
-            atom_l = sys1_indices_in_system[atom1_l]
-            force.setTorsionParameters(index, atom_i, atom_j, atom_k, atom_l, periodicity, phase, 0*K)
         custom_force = self._periodic_torsion_custom_force()
         system.addForce(custom_force)
+        native_force = None
+        if self.preserve_environment:
+            native_force = mm.PeriodicTorsionForce()
+            system.addForce(native_force)
 
-        self._periodic_torsion_add_core(shared_torsions, sys1_indices_in_system, force1, force2, custom_force)
+        self._periodic_torsion_add_core(shared_torsions, sys1_indices_in_system, force1, force2, custom_force, native_force)
         self._periodic_torsion_add_unique(unique_torsions2, unique_torsions1, force2, force1, sys2_indices_in_system, sys1_indices_in_system, custom_force)
-        system.removeForce(this_index)
 
     ###################
     # NONBONDED FORCE #
@@ -679,7 +703,6 @@ class HybridTopologyFactory(object):
                 atom_i = sys1_indices_in_system[atom1_i]
                 atom_j = sys2_indices_in_system[atom2_j]
                 force.addException(atom_i, atom_j, 0.0, 1.0, 0.0, replace=True)
-                force.addException(atom_j, atom_i, 0.0, 1.0, 0.0, replace=True)
 
     def _nonbonded_fix_noncustom(self, force, force1, force2, unique_exceptions1, unique_exceptions2, sys1_indices_in_system, sys2_indices_in_system):
         """
@@ -706,7 +729,6 @@ class HybridTopologyFactory(object):
         for atom in self.unique_atoms2:
             [charge, sigma, epsilon] = force2.getParticleParameters(atom)
             new_force.addParticle(0*charge, sigma, 0*epsilon)
-            force.addParticle(0*charge, sigma, 0*epsilon)
         # Add unique atom parameters back
         for atom1 in self.unique_atoms1:
             [charge, sigma, epsilon] = force1.getParticleParameters(atom1)
@@ -731,7 +753,23 @@ class HybridTopologyFactory(object):
             new_force.addException(atom_i, atom_j, chargeProd, sigma, epsilon, replace=True)
         return new_force
 
-    def _nonbonded_force(self, force, force1, force2, common1, common2, sys1_indices_in_system, sys2_indices_in_system, mapping1, mapping2, system, this_index):
+    def _classify_unique_exceptions(self, exceptions, common):
+        """
+        Split the exceptions that involve unique atoms into those among unique atoms only
+        and those between unique and core atoms.
+        """
+        unique_exceptions = list()
+        unique_to_core_exceptions = list()
+        for atoms, index in exceptions.items():
+            if common.issuperset(atoms):
+                continue
+            if common.isdisjoint(atoms):
+                unique_exceptions.append(index)
+            else:
+                unique_to_core_exceptions.append(index)
+        return unique_exceptions, unique_to_core_exceptions
+
+    def _nonbonded_force(self, force, force1, force2, common1, common2, sys1_indices_in_system, sys2_indices_in_system, mapping1, mapping2, system):
         """
         Will result in 3 NB forces in the system:
             NonbondedForce --> intra-unique atoms
@@ -741,7 +779,12 @@ class HybridTopologyFactory(object):
                                       core to all alchemical atoms
                 Sterics
                 Electrostatics
+        If self.preserve_environment is True, see _nonbonded_force_preserving_environment instead.
         """
+        if self.preserve_environment:
+            self._nonbonded_force_preserving_environment(force1, force2, sys1_indices_in_system, sys2_indices_in_system, mapping1, system)
+            return
+
         # Create index of exceptions in system, system1, and system2.
         def index_exceptions(force):
             exceptions = dict()
@@ -757,14 +800,8 @@ class HybridTopologyFactory(object):
 
         # Find exceptions that are unique to each molecule.
         if self.verbose: print("Finding exceptions unique to each molecule...")
-        unique_exceptions1 = [ exceptions1[atoms] for atoms in exceptions1 if not set(atoms).issubset(common1) ]
-        unique_exceptions2 = [ exceptions2[atoms] for atoms in exceptions2 if not set(atoms).issubset(common2) ]
-
-        unique_to_core_exceptions1 = [ exceptions1[atoms] for atoms in exceptions1 if (exceptions1[atoms] in unique_exceptions1 and any([x in common1 for x in atoms])) ]
-        unique_to_core_exceptions2 = [ exceptions2[atoms] for atoms in exceptions2 if (exceptions2[atoms] in unique_exceptions2 and any([x in common2 for x in atoms])) ]
-
-        unique_exceptions1 = [ index for index in unique_exceptions1 if index not in unique_to_core_exceptions1 ]
-        unique_exceptions2 = [ index for index in unique_exceptions2 if index not in unique_to_core_exceptions2 ]
+        unique_exceptions1, unique_to_core_exceptions1 = self._classify_unique_exceptions(exceptions1, common1)
+        unique_exceptions2, unique_to_core_exceptions2 = self._classify_unique_exceptions(exceptions2, common2)
 
         shared_exceptions = self._nonbonded_find_shared(common2, sys2_indices_in_system, mapping2, exceptions, exceptions1, exceptions2)
 
@@ -783,7 +820,161 @@ class HybridTopologyFactory(object):
         self._nonbonded_add_unique(common1, force1, force2, sys2_indices_in_system, sys1_indices_in_system, sterics_custom_nonbonded_force, electrostatics_custom_nonbonded_force, unique_to_core_exceptions1, unique_to_core_exceptions2)
 
         self._nonbonded_add_exceptions_to_bond(shared_exceptions, unique_to_core_exceptions1, unique_to_core_exceptions2, sys1_indices_in_system, sys2_indices_in_system, force1, force2, bond_custom_nonbonded_force)
-        system.removeForce(this_index)
+
+    def _nonbonded_custom_set_method(self, custom_force, force):
+        """
+        Give a CustomNonbondedForce the cutoff treatment matching the NonbondedForce it replaces.
+        """
+        method = force.getNonbondedMethod()
+        if method == mm.NonbondedForce.NoCutoff:
+            custom_force.setNonbondedMethod(mm.CustomNonbondedForce.NoCutoff)
+        elif method == mm.NonbondedForce.CutoffNonPeriodic:
+            custom_force.setNonbondedMethod(mm.CustomNonbondedForce.CutoffNonPeriodic)
+        else:
+            custom_force.setNonbondedMethod(mm.CustomNonbondedForce.CutoffPeriodic)
+        custom_force.setCutoffDistance(force.getCutoffDistance())
+
+    def _nonbonded_native_force(self, force):
+        """
+        Create an empty NonbondedForce with the same settings as `force`.
+        """
+        native_force = mm.NonbondedForce()
+        native_force.setNonbondedMethod(force.getNonbondedMethod())
+        native_force.setCutoffDistance(force.getCutoffDistance())
+        native_force.setReactionFieldDielectric(force.getReactionFieldDielectric())
+        native_force.setEwaldErrorTolerance(force.getEwaldErrorTolerance())
+        [alpha_ewald, nx, ny, nz] = force.getPMEParameters()
+        native_force.setPMEParameters(alpha_ewald, nx, ny, nz)
+        native_force.setUseDispersionCorrection(force.getUseDispersionCorrection())
+        native_force.setUseSwitchingFunction(force.getUseSwitchingFunction())
+        native_force.setSwitchingDistance(force.getSwitchingDistance())
+        return native_force
+
+    def _nonbonded_force_preserving_environment(self, force1, force2, sys1_indices_in_system, sys2_indices_in_system, mapping1, system):
+        """
+        Will result in 4 NB forces in the system:
+            NonbondedForce --> all interactions among environment atoms (core atoms with
+                               unchanged parameters), with their native parameters
+            CustomNonbondedForces --> 3 interaction groups:
+                                      alchemical atoms to environment
+                                      perturbed core to perturbed core
+                                      perturbed core to unique atoms
+                Sterics
+                Electrostatics
+            CustomBondForce --> exceptions that involve alchemical atoms or change between the systems,
+                                and all pairs within the unique atoms of each system
+        Alchemical atoms are the unique atoms of both systems and the core atoms whose
+        nonbonded parameters differ between the systems.
+        As in _nonbonded_force, interactions within the unique atoms of each system are not
+        switched, and unique atoms of system1 and system2 do not see each other.
+        """
+        natoms = system.getNumParticles()
+
+        # Nonbonded parameters of every hybrid atom in each system (MD units), None if the atom does not exist there.
+        parameters1 = [None] * natoms
+        parameters2 = [None] * natoms
+        for (atom1, index) in sys1_indices_in_system.items():
+            parameters1[index] = tuple(_strip_units(value) for value in force1.getParticleParameters(atom1))
+        for (atom2, index) in sys2_indices_in_system.items():
+            parameters2[index] = tuple(_strip_units(value) for value in force2.getParticleParameters(atom2))
+
+        unique1 = set(sys1_indices_in_system[atom1] for atom1 in self.unique_atoms1)
+        unique2 = set(sys2_indices_in_system[atom2] for atom2 in self.unique_atoms2)
+        core = set(sys1_indices_in_system[atom1] for atom1 in mapping1)
+        perturbed_core = set(index for index in core if parameters1[index] != parameters2[index])
+        environment = core - perturbed_core
+        alchemical = perturbed_core | unique1 | unique2
+
+        # Exceptions of each system, keyed by hybrid atom pairs.
+        def index_exceptions(force, indices_in_system):
+            exceptions = dict()
+            for index in range(force.getNumExceptions()):
+                [atom_i, atom_j, chargeProd, sigma, epsilon] = force.getExceptionParameters(index)
+                key = unique([indices_in_system[atom_i], indices_in_system[atom_j]])
+                exceptions[key] = (_strip_units(chargeProd), _strip_units(sigma), _strip_units(epsilon))
+            return exceptions
+        exceptions1 = index_exceptions(force1, sys1_indices_in_system)
+        exceptions2 = index_exceptions(force2, sys2_indices_in_system)
+
+        def pair_parameters(pair, exceptions, parameters):
+            # (chargeProd, sigma, epsilon) of a pair in one system, or None if one of the atoms does not exist
+            if pair in exceptions:
+                return exceptions[pair]
+            (atom_i, atom_j) = pair
+            if (parameters[atom_i] is None) or (parameters[atom_j] is None):
+                return None
+            (charge_i, sigma_i, epsilon_i) = parameters[atom_i]
+            (charge_j, sigma_j, epsilon_j) = parameters[atom_j]
+            return (charge_i*charge_j, 0.5*(sigma_i + sigma_j), np.sqrt(epsilon_i*epsilon_j))
+
+        # Environment atoms keep their native parameters; alchemical atoms do not interact through the native force.
+        native_force = self._nonbonded_native_force(force1)
+        for index in range(natoms):
+            if index in environment:
+                (charge, sigma, epsilon) = parameters1[index]
+                native_force.addParticle(charge, sigma, epsilon)
+            else:
+                sigma = parameters1[index][1] if parameters1[index] is not None else parameters2[index][1]
+                native_force.addParticle(0.0, sigma, 0.0)
+
+        electrostatics_custom_nonbonded_force, sterics_custom_nonbonded_force, bond_custom_nonbonded_force = self._nonbonded_custom_force(force1)
+        for index in range(natoms):
+            if index in unique1:
+                (charge, sigma, epsilon) = parameters1[index]
+                electrostatics_custom_nonbonded_force.addParticle([charge, 0.0])
+                sterics_custom_nonbonded_force.addParticle([sigma, epsilon, sigma, 0.0])
+            elif index in unique2:
+                (charge, sigma, epsilon) = parameters2[index]
+                electrostatics_custom_nonbonded_force.addParticle([0.0, charge])
+                sterics_custom_nonbonded_force.addParticle([sigma, 0.0, sigma, epsilon])
+            else:
+                (charge1, sigma1, epsilon1) = parameters1[index]
+                (charge2, sigma2, epsilon2) = parameters2[index]
+                electrostatics_custom_nonbonded_force.addParticle([charge1, charge2])
+                sterics_custom_nonbonded_force.addParticle([sigma1, epsilon1, sigma2, epsilon2])
+        interaction_groups = [(alchemical, environment), (perturbed_core, perturbed_core), (perturbed_core, unique1 | unique2)]
+        for custom_force in [sterics_custom_nonbonded_force, electrostatics_custom_nonbonded_force]:
+            self._nonbonded_custom_set_method(custom_force, force1)
+            for (group1, group2) in interaction_groups:
+                if len(group1) > 0 and len(group2) > 0:
+                    custom_force.addInteractionGroup(sorted(group1), sorted(group2))
+
+        # Exceptions.
+        for pair in set(exceptions1.keys()) | set(exceptions2.keys()):
+            if set(pair).issubset(environment):
+                if exceptions1.get(pair) == exceptions2.get(pair):
+                    native_force.addException(pair[0], pair[1], *exceptions1[pair])
+                    continue
+                # The exception changes between the systems; switch it in the custom bond force instead.
+                native_force.addException(pair[0], pair[1], 0.0, 1.0, 0.0)
+            elif (set(pair).issubset(unique1)) or (set(pair).issubset(unique2)) or (pair[0] in unique1 and pair[1] in unique2) or (pair[0] in unique2 and pair[1] in unique1):
+                # Handled with the intra-unique pairs below.
+                continue
+            else:
+                sterics_custom_nonbonded_force.addExclusion(pair[0], pair[1])
+                electrostatics_custom_nonbonded_force.addExclusion(pair[0], pair[1])
+            parameters_A = pair_parameters(pair, exceptions1, parameters1)
+            parameters_B = pair_parameters(pair, exceptions2, parameters2)
+            if parameters_A is None:
+                parameters_A = (0.0, parameters_B[1], 0.0)
+            if parameters_B is None:
+                parameters_B = (0.0, parameters_A[1], 0.0)
+            bond_custom_nonbonded_force.addBond(pair[0], pair[1], list(parameters_A + parameters_B))
+
+        # Interactions within the unique atoms of each system are kept at full strength.
+        for (unique_atoms, exceptions, parameters) in [(sorted(unique1), exceptions1, parameters1), (sorted(unique2), exceptions2, parameters2)]:
+            for (position, atom_i) in enumerate(unique_atoms):
+                for atom_j in unique_atoms[position+1:]:
+                    pair = (atom_i, atom_j)
+                    pair_parameter = pair_parameters(pair, exceptions, parameters)
+                    if (pair_parameter[0] == 0.0) and (pair_parameter[2] == 0.0):
+                        continue
+                    bond_custom_nonbonded_force.addBond(atom_i, atom_j, list(pair_parameter + pair_parameter))
+
+        system.addForce(native_force)
+        system.addForce(sterics_custom_nonbonded_force)
+        system.addForce(electrostatics_custom_nonbonded_force)
+        system.addForce(bond_custom_nonbonded_force)
 
     ################################
     # END CUSTOM FORCE DEFINITIONS #
@@ -794,17 +985,15 @@ class HybridTopologyFactory(object):
         sys1_indices_in_system = { a:a for a in self.system1_atoms.keys() }
 
         if self.return_self:
-            return [self.system1, self.topology1, self.positions1, self.atom_mapping_2to1, sys1_indices_in_system]
-
-        self.topology1 = deepcopy_topology(self.topology1)
-        self.topology2 = deepcopy_topology(self.topology2)
+            return [copy_system(self.system1, reason='HybridTopologyFactory'), self.topology1, self.positions1, AtomMap(self.atom_mapping_2to1), AtomMap(sys1_indices_in_system)]
 
         system2_atoms = self.system2_atoms
         system1_atoms = self.system1_atoms
 
-        system = copy.deepcopy(self.system1)
+        # The hybrid is built from the only copy of system1; topology1 is already a private copy.
+        system = copy_system(self.system1, reason='HybridTopologyFactory')
         topology = deepcopy_topology(self.topology1)
-        positions = copy.deepcopy(self.positions1)
+        positions = self.positions1
 
         system_atoms = dict()
         for atom in topology.atoms():
@@ -814,11 +1003,11 @@ class HybridTopologyFactory(object):
         system2 = self.system2
         mapping1 = self.atom_mapping_1to2
         mapping2 = self.atom_mapping_2to1
-        common1 = mapping1.keys()
-        common2 = mapping2.keys()
+        common1 = set(mapping1.keys())
+        common2 = set(mapping2.keys())
         assert len(common1) == len(common2)
 
-        sys2_indices_in_system = copy.deepcopy(self.atom_mapping_2to1)
+        sys2_indices_in_system = dict(self.atom_mapping_2to1)
 
         residues_2_to_sys = dict()
         for index2, index in sys2_indices_in_system.items():
@@ -845,10 +1034,10 @@ class HybridTopologyFactory(object):
         sys_index_in_sys2 = { value: key for key, value in sys2_indices_in_system.items() }
         for k, atom in enumerate(topology.atoms()):
             system_atoms[k] = atom
-            if atom.index in sys_index_in_sys1.keys():
+            if atom.index in sys_index_in_sys1:
                 atom1idx = sys_index_in_sys1[atom.index]
                 sys1_indices_in_system[atom1idx] = k
-            if atom.index in sys_index_in_sys2.keys():
+            if atom.index in sys_index_in_sys2:
                 atom2idx = sys_index_in_sys2[atom.index]
                 sys2_indices_in_system[atom2idx] = k
             atom.index = k
@@ -864,26 +1053,387 @@ class HybridTopologyFactory(object):
         forces1 = { system1.getForce(index).__class__.__name__ : system1.getForce(index) for index in range(system1.getNumForces()) }
         forces2 = { system2.getForce(index).__class__.__name__ : system2.getForce(index) for index in range(system2.getNumForces()) }
 
-        # Process forces.
-        for force in forces:
+        # Process forces. New custom forces are appended, so the indices of the original forces stay
+        # valid until the replaced ones are removed at the end.
+        replaced_force_indices = list()
+        for (force_index, force) in enumerate(forces):
             # Get force name.
             force_name = force.__class__.__name__
             force1 = forces1[force_name]
             force2 = forces2[force_name]
             if self.verbose: print(force_name)
             if force_name == 'HarmonicBondForce':
-                force_to_idx = { system.getForce(index).__class__.__name__ : index for index in range(system.getNumForces()) }
-                self._harmonic_bond_force(force, force1, force2, common1, common2, sys1_indices_in_system, sys2_indices_in_system, mapping2, system, force_to_idx[force_name])
+                self._harmonic_bond_force(force, force1, force2, common1, common2, sys1_indices_in_system, sys2_indices_in_system, mapping2, system)
+            elif force_name == 'HarmonicAngleForce':
+                self._harmonic_angle_force(force, force1, force2, common1, common2, sys1_indices_in_system, sys2_indices_in_system, mapping2, system)
+            elif force_name == 'PeriodicTorsionForce':
+                self._periodic_torsion_force(force, force1, force2, common1, common2, sys1_indices_in_system, sys2_indices_in_system, mapping2, system, system_atoms)
+            elif force_name == 'NonbondedForce':
+                self._nonbonded_force(force, force1, force2, common1, common2, sys1_indices_in_system, sys2_indices_in_system, mapping1, mapping2, system)
+            else:
+                continue
+            replaced_force_indices.append(force_index)
+
+        for force_index in reversed(replaced_force_indices):
+            system.removeForce(force_index)
+
+        return [system, topology, positions, AtomMap(sys2_indices_in_system), AtomMap(sys1_indices_in_system)]
+
+
+class SuperposedLigandsFactory(HybridTopologyFactory):
+    """
+    Build a single hybrid System containing the environment, the atoms shared by a library of
+    ligands, and the unique substituents of every ligand at once (lambda-dynamics style).
+
+    Every alchemical term carries two parameter slots (the "1"/"A" and "2"/"B" parameters of the
+    HybridTopologyFactory custom forces).  Switching between any pair of ligands only rewrites the
+    per-term parameters of these forces, which can be pushed into an existing Context with
+    updateParametersInContext, so no System or Context has to be rebuilt.
+
+    When a ligand is active, its own bonded and nonbonded parameters are used; atoms belonging only
+    to other ligands carry no nonbonded interactions and are held in place by their bonded terms
+    scaled by `softening`.
+
+    The masses of atoms shared by several ligands are taken from the reference ligand.
+    """
+    def __init__(self, topology_proposals, reference_positions, new_positions, residue_name='MOL', softening=1.0):
+        """
+        Arguments:
+            topology_proposals : list of TopologyProposal
+                proposals from a common reference state (old_system/old_topology) to every other ligand
+            reference_positions : simtk.unit.Quantity of [n, 3]
+                positions of the reference state
+            new_positions : list of simtk.unit.Quantity
+                positions of the new system of each proposal
+            residue_name : str
+                name of the ligand residue; all other atoms are the environment
+            softening: float, 0 - 1
+                fraction of the bonded terms kept for atoms that do not belong to the active ligand
+        """
+        # The two-system bookkeeping of HybridTopologyFactory.__init__ does not apply here;
+        # only the custom force builders are reused.
+        self.softcore_alpha=0.5
+        self.softcore_beta=12*unit.angstrom**2
+        if softening < 0.0 or softening > 1.0:
+            softening = 0.1
+        self.softening = softening
+        self.verbose = False
+
+        if len(topology_proposals) == 0:
+            raise Exception("SuperposedLigandsFactory requires at least one TopologyProposal")
+        reference_system = topology_proposals[0].old_system
+        reference_topology = topology_proposals[0].old_topology
+        self._state_keys = [topology_proposals[0].old_chemical_state_key] + [proposal.new_chemical_state_key for proposal in topology_proposals]
+        systems = [reference_system] + [proposal.new_system for proposal in topology_proposals]
+        topologies = [reference_topology] + [proposal.new_topology for proposal in topology_proposals]
+
+        # Build the superposed topology and particle list.
+        self._topology = deepcopy_topology(reference_topology)
+        ligand_residues = [residue for residue in self._topology.residues() if residue.name == residue_name]
+        if len(ligand_residues) != 1:
+            raise Exception("There must be exactly one residue named '%s' in the reference topology; found %d" % (residue_name, len(ligand_residues)))
+        ligand_residue = ligand_residues[0]
+
+        self._system = mm.System()
+        self._system.setDefaultPeriodicBoxVectors(*reference_system.getDefaultPeriodicBoxVectors())
+        natoms_reference = reference_system.getNumParticles()
+        for index in range(natoms_reference):
+            self._system.addParticle(reference_system.getParticleMass(index))
+        positions_unit = reference_positions.unit
+        positions = list(np.array(reference_positions / positions_unit))
+
+        # self._atom_maps[k][index in system k] = index in superposed system
+        self._atom_maps = [{ index : index for index in range(natoms_reference) }]
+        for (proposal, proposal_positions) in zip(topology_proposals, new_positions):
+            atom_map = dict(proposal.new_to_old_atom_map)
+            new_atoms = list(proposal.new_topology.atoms())
+            for new_index in proposal.unique_new_atoms:
+                atom = new_atoms[new_index]
+                if atom.residue.name != residue_name:
+                    raise Exception("Atom %d (%s) outside residue '%s' is not mapped onto the reference environment" % (new_index, atom.name, residue_name))
+                atom_map[new_index] = self._system.addParticle(proposal.new_system.getParticleMass(new_index))
+                self._topology.addAtom(atom.name, atom.element, ligand_residue)
+                positions.append(np.array(proposal_positions[new_index].value_in_unit(positions_unit)))
+            self._atom_maps.append(atom_map)
+        self._positions = unit.Quantity(np.array(positions), positions_unit)
+
+        # Atoms of each ligand in the superposed system.
+        self._ligand_atoms = list()
+        for (topology, atom_map) in zip(topologies, self._atom_maps):
+            self._ligand_atoms.append(set(atom_map[atom.index] for atom in topology.atoms() if atom.residue.name == residue_name))
+        self._all_ligand_atoms = set.union(*self._ligand_atoms)
+        self._environment_atoms = set(range(self._system.getNumParticles())) - self._all_ligand_atoms
+
+        self._handle_superposed_constraints(systems)
+
+        # [(custom_force, set_term, terms, tables)] where terms is a list of (term_index, atoms)
+        # and tables[k] lists the parameters of each term when ligand k is active
+        self._switchable_terms = list()
+
+        forces = [{ force.__class__.__name__ : force for force in system.getForces() } for system in systems]
+        for force in reference_system.getForces():
+            force_name = force.__class__.__name__
+            if self.verbose: print(force_name)
+            ligand_forces = [system_forces[force_name] for system_forces in forces]
+            if force_name == 'HarmonicBondForce':
+                self._superpose_bonded_force(force, ligand_forces, self._bond_terms, self._harmonic_bond_custom_force(),
+                                             mm.HarmonicBondForce.addBond, mm.CustomBondForce.addBond, mm.CustomBondForce.setBondParameters)
             elif force_name == 'HarmonicAngleForce':
-                force_to_idx = { system.getForce(index).__class__.__name__ : index for index in range(system.getNumForces()) }
-                self._harmonic_angle_force(force, force1, force2, common1, common2, sys1_indices_in_system, sys2_indices_in_system, mapping2, system, force_to_idx[force_name])
+                self._superpose_bonded_force(force, ligand_forces, self._angle_terms, self._harmonic_angle_custom_force(),
+                                             mm.HarmonicAngleForce.addAngle, mm.CustomAngleForce.addAngle, mm.CustomAngleForce.setAngleParameters)
             elif force_name == 'PeriodicTorsionForce':
-                force_to_idx = { system.getForce(index).__class__.__name__ : index for index in range(system.getNumForces()) }
-                self._periodic_torsion_force(force, force1, force2, common1, common2, sys1_indices_in_system, sys2_indices_in_system, mapping2, system, system_atoms, force_to_idx[force_name])
+                self._superpose_bonded_force(force, ligand_forces, self._torsion_terms, self._periodic_torsion_custom_force(),
+                                             mm.PeriodicTorsionForce.addTorsion, mm.CustomTorsionForce.addTorsion, mm.CustomTorsionForce.setTorsionParameters)
             elif force_name == 'NonbondedForce':
-                force_to_idx = { system.getForce(index).__class__.__name__ : index for index in range(system.getNumForces()) }
-                self._nonbonded_force(force, force1, force2, common1, common2, sys1_indices_in_system, sys2_indices_in_system, mapping1, mapping2, system, force_to_idx[force_name])
+                self._superpose_nonbonded_force(force, ligand_forces)
+            elif force_name in ['CMMotionRemover', 'MonteCarloBarostat']:
+                self._system.addForce(copy.deepcopy(force))
             else:
-                pass
+                raise Exception("Force %s is not supported by SuperposedLigandsFactory" % force_name)
+
+        self._active_pair = None
+        self.set_ligand(self._state_keys[0])
+
+    @property
+    def system(self):
+        return self._system
 
-        return [system, topology, positions, sys2_indices_in_system, sys1_indices_in_system]
+    @property
+    def topology(self):
+        return self._topology
+
+    @property
+    def positions(self):
+        return self._positions
+
+    @property
+    def state_keys(self):
+        return self._state_keys
+
+    @property
+    def active_pair(self):
+        """(initial, final) chemical state keys currently written into the System."""
+        return self._active_pair
+
+    def ligand_atoms(self, state_key):
+        """Indices in the superposed system of the atoms of the ligand with the given state key."""
+        return self._ligand_atoms[self._state_keys.index(state_key)]
+
+    def atom_map(self, state_key):
+        """dict mapping atom indices of the ligand's own system onto the superposed system."""
+        return self._atom_maps[self._state_keys.index(state_key)]
+
+    def set_ligands(self, initial_state_key, final_state_key, context=None):
+        """
+        Write the parameters of the initial ligand into the lambda=0 slots and those of the
+        final ligand into the lambda=1 slots of every alchemical term.
+
+        Arguments:
+            initial_state_key : str
+                chemical state key of the ligand at lambda = 0
+            final_state_key : str
+                chemical state key of the ligand at lambda = 1
+            context : simtk.openmm.Context, optional
+                if given, a Context created from self.system that is updated in place
+        """
+        initial_index = self._state_keys.index(initial_state_key)
+        final_index = self._state_keys.index(final_state_key)
+        for (custom_force, set_term, terms, tables) in self._switchable_terms:
+            initial_table = tables[initial_index]
+            final_table = tables[final_index]
+            for (term, (term_index, atoms)) in enumerate(terms):
+                set_term(custom_force, term_index, *(atoms + [list(initial_table[term] + final_table[term])]))
+            if context is not None:
+                custom_force.updateParametersInContext(context)
+        self._active_pair = (initial_state_key, final_state_key)
+
+    def set_ligand(self, state_key, context=None):
+        """Make the ligand with the given state key active at every value of lambda."""
+        self.set_ligands(state_key, state_key, context=context)
+
+    def _handle_superposed_constraints(self, systems):
+        if self.verbose: print("Adding constraints from all ligands...")
+        constraints = dict()
+        for (system, atom_map) in zip(systems, self._atom_maps):
+            for index in range(system.getNumConstraints()):
+                [atom_i, atom_j, distance] = system.getConstraintParameters(index)
+                atoms = unique([atom_map[atom_i], atom_map[atom_j]])
+                distance = _strip_units(distance)
+                if atoms in constraints:
+                    if abs(constraints[atoms] - distance) > 1.0e-6:
+                        raise Exception("Constraint between atoms %d and %d differs between ligands (%f and %f nm)" % (atoms[0], atoms[1], constraints[atoms], distance))
+                    continue
+                constraints[atoms] = distance
+                self._system.addConstraint(atoms[0], atoms[1], distance)
+
+    @staticmethod
+    def _bond_terms(force):
+        for index in range(force.getNumBonds()):
+            [atom_i, atom_j, length, K] = force.getBondParameters(index)
+            yield [atom_i, atom_j], (_strip_units(length), _strip_units(K)), 1
+
+    @staticmethod
+    def _angle_terms(force):
+        for index in range(force.getNumAngles()):
+            [atom_i, atom_j, atom_k, theta0, K] = force.getAngleParameters(index)
+            yield [atom_i, atom_j, atom_k], (_strip_units(theta0), _strip_units(K)), 1
+
+    @staticmethod
+    def _torsion_terms(force):
+        for index in range(force.getNumTorsions()):
+            [atom_i, atom_j, atom_k, atom_l, periodicity, phase, K] = force.getTorsionParameters(index)
+            yield [atom_i, atom_j, atom_k, atom_l], (periodicity, _strip_units(phase), _strip_units(K)), 2
+
+    def _superpose_bonded_force(self, reference_force, ligand_forces, get_terms, custom_force, add_native, add_custom, set_custom):
+        """
+        Environment terms go into a native force; every term touching a ligand atom gets one
+        parameter set per ligand in a two-slot custom force.
+        """
+        native_force = reference_force.__class__()
+        self._system.addForce(native_force)
+        for (atoms, parameters, _) in get_terms(reference_force):
+            if set(atoms).issubset(self._environment_atoms):
+                add_native(native_force, *(atoms + list(parameters)))
+
+        # Collect ligand terms, keyed by (superposed atoms, occurrence) so multiple terms on the same atoms are kept.
+        ligand_terms = list()
+        keys = list()
+        owners = dict()
+        for (ligand_index, (force, atom_map)) in enumerate(zip(ligand_forces, self._atom_maps)):
+            terms = dict()
+            occurrences = dict()
+            for (atoms, parameters, K_index) in get_terms(force):
+                atoms = [atom_map[atom] for atom in atoms]
+                if set(atoms).issubset(self._environment_atoms):
+                    continue
+                atoms = unique(atoms)
+                occurrence = occurrences.get(atoms, 0)
+                occurrences[atoms] = occurrence + 1
+                key = (atoms, occurrence)
+                terms[key] = parameters
+                if key not in owners:
+                    owners[key] = (parameters, K_index)
+                    keys.append(key)
+            ligand_terms.append(terms)
+
+        tables = list()
+        for (ligand_index, terms) in enumerate(ligand_terms):
+            table = list()
+            for key in keys:
+                if key in terms:
+                    table.append(terms[key])
+                    continue
+                (parameters, K_index) = owners[key]
+                parameters = list(parameters)
+                if set(key[0]).issubset(self._ligand_atoms[ligand_index]):
+                    # The ligand contains all atoms but not this term.
+                    parameters[K_index] = 0.0
+                else:
+                    parameters[K_index] *= self.softening
+                table.append(tuple(parameters))
+            tables.append(table)
+
+        terms = list()
+        for (term, key) in enumerate(keys):
+            atoms = list(key[0])
+            term_index = add_custom(custom_force, *(atoms + [list(tables[0][term] + tables[0][term])]))
+            terms.append((term_index, atoms))
+        self._system.addForce(custom_force)
+        self._switchable_terms.append((custom_force, set_custom, terms, tables))
+
+    def _superpose_nonbonded_force(self, reference_force, ligand_forces):
+        """
+        Environment-environment interactions stay in a native NonbondedForce; ligand-environment
+        interactions go into CustomNonbondedForces restricted by an interaction group, and
+        intra-ligand interactions into a CustomBondForce over all ligand atom pairs.
+        """
+        if self.verbose: print("Superposing nonbonded interactions...")
+        native_force = copy.deepcopy(reference_force)
+        for index in range(self._system.getNumParticles()):
+            if index < native_force.getNumParticles():
+                if index in self._environment_atoms:
+                    continue
+                [charge, sigma, epsilon] = native_force.getParticleParameters(index)
+                native_force.setParticleParameters(index, 0.0, sigma, 0.0)
+            else:
+                native_force.addParticle(0.0, 1.0, 0.0)
+        for index in range(native_force.getNumExceptions()):
+            [atom_i, atom_j, chargeProd, sigma, epsilon] = native_force.getExceptionParameters(index)
+            if not set([atom_i, atom_j]).issubset(self._environment_atoms):
+                native_force.setExceptionParameters(index, atom_i, atom_j, 0.0, sigma, 0.0)
+        self._system.addForce(native_force)
+        ligand_atoms = sorted(self._all_ligand_atoms)
+
+        # Per-particle parameters of each ligand: (charge, sigma, epsilon) in the superposed indexing
+        particle_parameters = list()
+        owners = dict()
+        for (force, atom_map, atoms) in zip(ligand_forces, self._atom_maps, self._ligand_atoms):
+            parameters = dict()
+            for (index, superposed_index) in atom_map.items():
+                if superposed_index not in atoms:
+                    continue
+                [charge, sigma, epsilon] = force.getParticleParameters(index)
+                parameters[superposed_index] = (_strip_units(charge), _strip_units(sigma), _strip_units(epsilon))
+                if superposed_index not in owners:
+                    owners[superposed_index] = parameters[superposed_index]
+            particle_parameters.append(parameters)
+        for parameters in particle_parameters:
+            for atom in ligand_atoms:
+                if atom not in parameters:
+                    parameters[atom] = (0.0, owners[atom][1], 0.0)
+
+        [electrostatics_custom_nonbonded_force, sterics_custom_nonbonded_force, bond_custom_nonbonded_force] = self._nonbonded_custom_force(reference_force)
+
+        # Ligand-environment interactions.
+        if len(self._environment_atoms) > 0:
+            for custom_force in [electrostatics_custom_nonbonded_force, sterics_custom_nonbonded_force]:
+                self._nonbonded_custom_set_method(custom_force, reference_force)
+            for index in range(self._system.getNumParticles()):
+                if index in self._environment_atoms:
+                    [charge, sigma, epsilon] = [_strip_units(value) for value in reference_force.getParticleParameters(index)]
+                    electrostatics_custom_nonbonded_force.addParticle([charge, charge])
+                    sterics_custom_nonbonded_force.addParticle([sigma, epsilon, sigma, epsilon])
+                else:
+                    (charge, sigma, epsilon) = particle_parameters[0][index]
+                    electrostatics_custom_nonbonded_force.addParticle([charge, charge])
+                    sterics_custom_nonbonded_force.addParticle([sigma, epsilon, sigma, epsilon])
+            for custom_force in [electrostatics_custom_nonbonded_force, sterics_custom_nonbonded_force]:
+                custom_force.addInteractionGroup(sorted(self._all_ligand_atoms), sorted(self._environment_atoms))
+                self._system.addForce(custom_force)
+            terms = [(atom, []) for atom in ligand_atoms]
+            electrostatics_tables = [[(parameters[atom][0],) for atom in ligand_atoms] for parameters in particle_parameters]
+            sterics_tables = [[parameters[atom][1:] for atom in ligand_atoms] for parameters in particle_parameters]
+            self._switchable_terms.append((electrostatics_custom_nonbonded_force, mm.CustomNonbondedForce.setParticleParameters, terms, electrostatics_tables))
+            self._switchable_terms.append((sterics_custom_nonbonded_force, mm.CustomNonbondedForce.setParticleParameters, terms, sterics_tables))
+
+        # Intra-ligand interactions: exceptions where defined, mixing rules otherwise.
+        pair_tables = list()
+        for (force, atom_map, atoms, parameters) in zip(ligand_forces, self._atom_maps, self._ligand_atoms, particle_parameters):
+            exceptions = dict()
+            for index in range(force.getNumExceptions()):
+                [atom_i, atom_j, chargeProd, sigma, epsilon] = force.getExceptionParameters(index)
+                pair = unique([atom_map[atom_i], atom_map[atom_j]])
+                exceptions[pair] = (_strip_units(chargeProd), _strip_units(sigma), _strip_units(epsilon))
+            table = dict()
+            for (position, atom_i) in enumerate(ligand_atoms):
+                for atom_j in ligand_atoms[position+1:]:
+                    pair = (atom_i, atom_j)
+                    if (atom_i in atoms) and (atom_j in atoms):
+                        if pair in exceptions:
+                            table[pair] = exceptions[pair]
+                        else:
+                            (charge_i, sigma_i, epsilon_i) = parameters[atom_i]
+                            (charge_j, sigma_j, epsilon_j) = parameters[atom_j]
+                            table[pair] = (charge_i*charge_j, 0.5*(sigma_i + sigma_j), np.sqrt(epsilon_i*epsilon_j))
+                    else:
+                        table[pair] = (0.0, 0.5*(parameters[atom_i][1] + parameters[atom_j][1]), 0.0)
+            pair_tables.append(table)
+        # Only keep pairs that interact in at least one ligand.
+        pairs = [pair for pair in sorted(pair_tables[0].keys()) if any((table[pair][0] != 0.0) or (table[pair][2] != 0.0) for table in pair_tables)]
+        terms = list()
+        for pair in pairs:
+            term_index = bond_custom_nonbonded_force.addBond(pair[0], pair[1], list(pair_tables[0][pair] + pair_tables[0][pair]))
+            terms.append((term_index, list(pair)))
+        self._system.addForce(bond_custom_nonbonded_force)
+        tables = [[table[pair] for pair in pairs] for table in pair_tables]
+        self._switchable_terms.append((bond_custom_nonbonded_force, mm.CustomBondForce.setBondParameters, terms, tables))
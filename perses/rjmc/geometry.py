@@ -14,6 +14,7 @@ import openeye.oechem as oechem
 import openeye.oeomega as oeomega
 import simtk.openmm.app as app
 import time
+from perses.systems import copy_system
 
 class GeometryEngine(object):
     """
@@ -1748,19 +1749,12 @@ class GeometrySystemGeneratorFast(GeometrySystemGenerator):
         if use_sterics:
             forces_to_keep += ['NonbondedForce']
 
-        # Create reference system, removing forces we won't use
-        self._reference_system = copy.deepcopy(reference_system)
-        force_indices_to_remove = list()
-        for force_index in range(self._reference_system.getNumForces()):
-            force = self._reference_system.getForce(force_index)
-            force_name = force.__class__.__name__
-            if force_name not in forces_to_keep:
-                force_indices_to_remove.append(force_index)
-        for force_index in force_indices_to_remove[::-1]:
-            self._reference_system.removeForce(force_index)
+        # The reference system is only read, so it is shared; keep a reference so its forces stay valid.
+        self._reference_system = reference_system
+        self._reference_forces = [force for force in reference_system.getForces() if force.__class__.__name__ in forces_to_keep]
 
-        # Create new system, copying forces we will keep.
-        self._growth_system = copy.deepcopy(self._reference_system)
+        # Create new system, copying only the forces we will keep.
+        self._growth_system = copy_system(reference_system, reason='GeometrySystemGeneratorFast', force_names=forces_to_keep)
 
         #Extract the forces from the system to use for adding auxiliary angles and torsions
         reference_forces = {reference_system.getForce(index).__class__.__name__ : reference_system.getForce(index) for index in range(reference_system.getNumForces())}
@@ -1785,7 +1779,7 @@ class GeometrySystemGeneratorFast(GeometrySystemGenerator):
         Set the growth parameter index
         """
         self.current_growth_index = growth_index
-        for (growth_force, reference_force) in zip(self._growth_system.getForces(), self._reference_system.getForces()):
+        for (growth_force, reference_force) in zip(self._growth_system.getForces(), self._reference_forces):
             force_name = growth_force.__class__.__name__
             if (force_name == 'HarmonicBondForce'):
                 for bond in range(reference_force.getNumBonds()):
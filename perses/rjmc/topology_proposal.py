@@ -16,13 +16,19 @@ from openmoltools import forcefield_generators
 import openeye.oegraphsim as oegraphsim
 from perses.rjmc.geometry import FFAllAngleGeometryEngine
 from perses.storage import NetCDFStorageView
+from perses.systems import copy_system
 try:
     from StringIO import StringIO
 except ImportError:
     from io import StringIO
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
 import openmoltools
 import logging
 import time
+import hashlib
 try:
     from subprocess import getoutput  # If python 3
 except ImportError:
@@ -72,6 +78,155 @@ def deepcopy_topology(source_topology):
     append_topology(topology, source_topology)
     return topology
 
+class AtomMap(Mapping):
+    """
+    Compact, immutable map between atom indices of two systems, backed by int32 index arrays.
+
+    AtomMap supports the read-only dict interface (``atom_map[i]``, ``i in atom_map``, ``len``,
+    ``keys()``, ``values()``, ``items()``, ``get``) and compares equal to a dict with the same
+    contents, so it can be used wherever an atom map dict was used before. In addition, the
+    mapped indices are available as arrays so that coordinates can be transferred between
+    systems with a single fancy-indexing operation.
+
+    Parameters
+    ----------
+    atom_map : dict or AtomMap, optional, default=None
+        {source_atom_index : destination_atom_index} map to store
+
+    Examples
+    --------
+    >>> atom_map = AtomMap({0 : 2, 1 : 0})
+    >>> atom_map[0]
+    2
+    >>> atom_map.inverse() == {2 : 0, 0 : 1}
+    True
+    """
+    def __init__(self, atom_map=None):
+        if isinstance(atom_map, AtomMap):
+            self._set_arrays(atom_map._source, atom_map._destination)
+            return
+        if atom_map is None:
+            atom_map = dict()
+        source = np.fromiter(atom_map.keys(), dtype=np.int32, count=len(atom_map))
+        destination = np.fromiter((atom_map[key] for key in atom_map.keys()), dtype=np.int32, count=len(atom_map))
+        self._set_arrays(source, destination)
+
+    @classmethod
+    def from_arrays(cls, source_indices, destination_indices):
+        """
+        Create an AtomMap mapping source_indices[i] to destination_indices[i].
+
+        Parameters
+        ----------
+        source_indices : array-like of int
+            Atom indices in the source system; must be unique
+        destination_indices : array-like of int
+            Corresponding atom indices in the destination system
+
+        Returns
+        -------
+        atom_map : AtomMap
+        """
+        atom_map = cls.__new__(cls)
+        atom_map._set_arrays(np.asarray(source_indices, dtype=np.int32), np.asarray(destination_indices, dtype=np.int32))
+        return atom_map
+
+    def _set_arrays(self, source, destination):
+        if source.shape != destination.shape:
+            raise Exception("source and destination index arrays must have the same length")
+        order = np.argsort(source, kind='mergesort')
+        self._source = np.array(source[order], dtype=np.int32)
+        self._destination = np.array(destination[order], dtype=np.int32)
+        if len(self._source) > 0 and self._source[0] < 0:
+            raise Exception("Atom indices must be non-negative")
+        # Dense lookup table of destination indices, -1 for unmapped source atoms
+        self._lookup = -np.ones([self._source[-1] + 1 if len(self._source) > 0 else 0], np.int32)
+        self._lookup[self._source] = self._destination
+        if np.count_nonzero(self._lookup >= 0) != len(self._source):
+            raise Exception("Source atom indices must be unique")
+        for array in [self._source, self._destination, self._lookup]:
+            array.flags.writeable = False
+
+    @property
+    def source_indices(self):
+        """Sorted array of mapped source atom indices"""
+        return self._source
+
+    @property
+    def destination_indices(self):
+        """Array of destination atom indices, aligned with source_indices"""
+        return self._destination
+
+    def inverse(self):
+        """
+        Return the {destination_atom_index : source_atom_index} map.
+        """
+        return AtomMap.from_arrays(self._destination, self._source)
+
+    def unmapped_source_atoms(self, natoms):
+        """
+        Return the source atom indices in range(natoms) that are not mapped.
+        """
+        mapped = np.zeros([natoms], bool)
+        mapped[self._source[self._source < natoms]] = True
+        return np.where(~mapped)[0].tolist()
+
+    def unmapped_destination_atoms(self, natoms):
+        """
+        Return the destination atom indices in range(natoms) that are not mapped to.
+        """
+        mapped = np.zeros([natoms], bool)
+        mapped[self._destination[self._destination < natoms]] = True
+        return np.where(~mapped)[0].tolist()
+
+    def __getitem__(self, key):
+        try:
+            value = self._lookup[key] if 0 <= key < len(self._lookup) else -1
+        except (TypeError, IndexError):
+            raise KeyError(key)
+        if value < 0:
+            raise KeyError(key)
+        return int(value)
+
+    def __contains__(self, key):
+        try:
+            return bool(0 <= key < len(self._lookup) and self._lookup[key] >= 0)
+        except (TypeError, IndexError):
+            return False
+
+    def __iter__(self):
+        return iter(self._source.tolist())
+
+    def __len__(self):
+        return len(self._source)
+
+    def keys(self):
+        return self._source.tolist()
+
+    def values(self):
+        return self._destination.tolist()
+
+    def items(self):
+        return list(zip(self._source.tolist(), self._destination.tolist()))
+
+    def __eq__(self, other):
+        if isinstance(other, AtomMap):
+            return np.array_equal(self._source, other._source) and np.array_equal(self._destination, other._destination)
+        if isinstance(other, Mapping):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'AtomMap(%s)' % repr(dict(self.items()))
+
 from perses.rjmc.geometry import NoTorsionError
 class TopologyProposal(object):
     """
@@ -90,7 +245,7 @@ class TopologyProposal(object):
         openm System of the current state
     logp_proposal : float
         contribution from the chemical proposal to the log probability of acceptance (Eq. 36 for hybrid; Eq. 53 for two-stage)
-    new_to_old_atom_map : dict
+    new_to_old_atom_map : dict or AtomMap
         {new_atom_idx : old_atom_idx} map for the two systems
     chemical_state_key : str
         The current chemical state (unique)
@@ -111,9 +266,9 @@ class TopologyProposal(object):
         positions of the old system
     logp_proposal : float
         contribution from the chemical proposal to the log probability of acceptance (Eq. 36 for hybrid; Eq. 53 for two-stage)
-    new_to_old_atom_map : dict
+    new_to_old_atom_map : AtomMap
         {new_atom_idx : old_atom_idx} map for the two systems
-    old_to_new_atom_map : dict
+    old_to_new_atom_map : AtomMap
         {old_atom_idx : new_atom_idx} map for the two systems
     unique_new_atoms : list of int
         List of indices of the unique new atoms
@@ -143,10 +298,10 @@ class TopologyProposal(object):
         self._logp_proposal = logp_proposal
         self._new_chemical_state_key = new_chemical_state_key
         self._old_chemical_state_key = old_chemical_state_key
-        self._new_to_old_atom_map = new_to_old_atom_map
-        self._old_to_new_atom_map = {old_atom : new_atom for new_atom, old_atom in new_to_old_atom_map.items()}
-        self._unique_new_atoms = [atom for atom in range(self._new_topology._numAtoms) if atom not in self._new_to_old_atom_map.keys()]
-        self._unique_old_atoms = [atom for atom in range(self._old_topology._numAtoms) if atom not in self._new_to_old_atom_map.values()]
+        self._new_to_old_atom_map = AtomMap(new_to_old_atom_map)
+        self._old_to_new_atom_map = self._new_to_old_atom_map.inverse()
+        self._unique_new_atoms = self._new_to_old_atom_map.unmapped_source_atoms(self._new_topology._numAtoms)
+        self._unique_old_atoms = self._new_to_old_atom_map.unmapped_destination_atoms(self._old_topology._numAtoms)
         self._metadata = metadata
 
     @property
@@ -255,6 +410,40 @@ class ProposalEngine(object):
         """
         pass
 
+    def record_proposal_outcome(self, old_state_key, proposed_state_key, acceptance_probability):
+        """
+        Inform the proposal engine of the outcome of a proposal it made.
+
+        Engines that adapt their proposal probabilities override this; the default does nothing.
+
+        Parameters
+        ----------
+        old_state_key : str
+            The chemical state the proposal was made from
+        proposed_state_key : str
+            The proposed chemical state
+        acceptance_probability : float
+            The probability with which the proposal was accepted
+        """
+        pass
+
+    def get_checkpoint_state(self):
+        """
+        Return any state of the proposal engine that changes during sampling, for `set_checkpoint_state`.
+
+        Returns
+        -------
+        state : picklable object or None
+            The engine state, or None if the engine does not change during sampling
+        """
+        return None
+
+    def set_checkpoint_state(self, state):
+        """
+        Restore the state of the proposal engine from `get_checkpoint_state`.
+        """
+        pass
+
     @property
     def chemical_state_list(self):
         raise NotImplementedError("This ProposalEngine does not expose a list of possible chemical states.")
@@ -1215,6 +1404,34 @@ class SystemGenerator(object):
     def forcefield(self):
         return self._forcefield
 
+def _compute_mcss_atom_counts(chunk):
+    """
+    Compute the number of atoms in the MCSS of a chunk of pairs of molecules; module-level so that it can be run in a worker process.
+
+    Parameters
+    ----------
+    chunk : tuple
+        (molecule_smiles_list, pairs, atom_expr, bond_expr), where pairs is a list of (i, j) indices into molecule_smiles_list
+
+    Returns
+    -------
+    npairs : int
+        The number of pairs in the chunk, for progress reporting
+    atom_counts : list of (int, int, int)
+        (i, j, n) for each pair whose MCSS has n > 0 atoms
+    """
+    (molecule_smiles_list, pairs, atom_expr, bond_expr) = chunk
+    atom_counts = list()
+    for (i, j) in pairs:
+        current_mol = oechem.OEMol()
+        proposed_mol = oechem.OEMol()
+        oechem.OESmilesToMol(current_mol, molecule_smiles_list[i])
+        oechem.OESmilesToMol(proposed_mol, molecule_smiles_list[j])
+        atom_map = SmallMoleculeSetProposalEngine._get_mol_atom_map(current_mol, proposed_mol, atom_expr=atom_expr, bond_expr=bond_expr)
+        if atom_map:
+            atom_counts.append((i, j, len(atom_map.keys())))
+    return len(pairs), atom_counts
+
 class SmallMoleculeSetProposalEngine(ProposalEngine):
     """
     This class proposes new small molecules from a prespecified set. It uses
@@ -1234,9 +1451,22 @@ class SmallMoleculeSetProposalEngine(ProposalEngine):
         metadata for the proposal engine
     storage : NetCDFStorageView, optional, default=None
         If specified, write statistics to this storage layer.
+    adaptive_burn_in : int, optional, default=None
+        If specified, the outcomes of the first `adaptive_burn_in` proposals reported via `record_proposal_outcome`
+        are used to reweight the MCSS probability matrix toward pairs of molecules that are accepted often,
+        after which the matrix is frozen. Sampling during the burn-in should be discarded.
+    adaptive_floor : float, optional, default=0.05
+        Minimum acceptance rate used in reweighting, so that every pair with MCSS overlap keeps a nonzero proposal probability.
+    mcss_processes : int, optional, default=1
+        Number of worker processes among which the pairwise MCSS searches of the probability matrix are divided.
+        If None, one process per CPU is used.
+    mcss_progress : callable, optional, default=None
+        If specified, mcss_progress(ncompleted, npairs) is called as pairs of molecules are completed; if it returns
+        False, the computation is cancelled and an exception is raised.
     """
 
-    def __init__(self, list_of_smiles, system_generator, residue_name='MOL', atom_expr=None, bond_expr=None, proposal_metadata=None, storage=None, always_change=True):
+    def __init__(self, list_of_smiles, system_generator, residue_name='MOL', atom_expr=None, bond_expr=None, proposal_metadata=None, storage=None, always_change=True,
+                 adaptive_burn_in=None, adaptive_floor=0.05, mcss_processes=1, mcss_progress=None):
         if not atom_expr:
             self.atom_expr = oechem.OEExprOpts_AtomicNumber # | oechem.OEExprOpts_Aromaticity | oechem.OEExprOpts_RingMember
         else:
@@ -1246,7 +1476,8 @@ class SmallMoleculeSetProposalEngine(ProposalEngine):
             self.bond_expr = 0 #oechem.OEExprOpts_Aromaticity | oechem.OEExprOpts_RingMember
         else:
             self.bond_expr = bond_expr
-        list_of_smiles = list(set(list_of_smiles))
+        # Sort the unique SMILES so that the order of chemical states does not depend on string hashing.
+        list_of_smiles = sorted(set(list_of_smiles))
         self._smiles_list = list_of_smiles
         self._n_molecules = len(self._smiles_list)
 
@@ -1254,13 +1485,25 @@ class SmallMoleculeSetProposalEngine(ProposalEngine):
         self._generated_systems = dict()
         self._generated_topologies = dict()
         self._matches = dict()
+        self._receptor_keys = dict() # id(topology) : (topology, receptor key)
 
         self._storage = None
         if storage is not None:
             self._storage = NetCDFStorageView(storage, modname=self.__class__.__name__)
 
+        self._mcss_processes = mcss_processes
+        self._mcss_progress = mcss_progress
         self._probability_matrix = self._calculate_probability_matrix(self._smiles_list)
 
+        # Proposal statistics for adaptation of the probability matrix
+        self._adaptive_burn_in = adaptive_burn_in
+        self._adaptive_floor = adaptive_floor
+        self._mcss_probability_matrix = self._probability_matrix.copy()
+        self._proposal_counts = np.zeros([self._n_molecules, self._n_molecules], np.int64) # _proposal_counts[i,j] is the number of proposals from i to j
+        self._acceptance_sums = np.zeros([self._n_molecules, self._n_molecules], np.float64) # _acceptance_sums[i,j] is the sum of their acceptance probabilities
+        self._nrecorded = 0
+        self._adapted = False
+
         super(SmallMoleculeSetProposalEngine, self).__init__(system_generator, proposal_metadata=proposal_metadata, always_change=always_change)
 
     def propose(self, current_system, current_topology, current_metadata=None):
@@ -1283,74 +1526,121 @@ class SmallMoleculeSetProposalEngine(ProposalEngine):
         """
         current_mol_smiles, current_mol = self._topology_to_smiles(current_topology)
 
-        current_receptor_topology = self._remove_small_molecule(current_topology)
-        old_mol_start_index, len_old_mol = self._find_mol_start_index(current_topology)
-
         #choose the next molecule to simulate:
         proposed_mol_smiles, proposed_mol, logp_proposal = self._propose_molecule(current_system, current_topology,
                                                                                 current_mol_smiles)
 
-        # DEBUG
-        strict_stereo = False
-        if self.verbose: print('proposed SMILES string: %s' % proposed_mol_smiles)
-        from openmoltools.openeye import generate_conformers
-        if self.verbose: print('Generating conformers...')
-        timer_start = time.time()
-        moltemp = generate_conformers(current_mol, max_confs=1, strictStereo=strict_stereo)
-        #molecule_to_mol2(moltemp, tripos_mol2_filename='current.mol2', conformer=0, residue_name="MOL")
-        ofs = oechem.oemolostream('current.mol2')
-        oechem.OETriposAtomTypeNames(moltemp)
-        oechem.OEWriteMol2File(ofs, moltemp) # Preserve atom naming
-        ofs.close()
-        moltemp = generate_conformers(proposed_mol, max_confs=1, strictStereo=strict_stereo)
-        #molecule_to_mol2(moltemp, tripos_mol2_filename='proposed.mol2', conformer=0, residue_name="MOL")
-        ofs = oechem.oemolostream('proposed.mol2')
-        oechem.OETriposAtomTypeNames(moltemp)
-        oechem.OEWriteMol2File(ofs, moltemp) # Preserve atom naming
-        ofs.close()
-        if self.verbose: print('Conformer generation took %.3f s' % (time.time() - timer_start))
-
-        if self.verbose: print('Building new Topology object...')
-        timer_start = time.time()
-        new_topology = self._build_new_topology(current_receptor_topology, proposed_mol)
-        new_mol_start_index, len_new_mol = self._find_mol_start_index(new_topology)
-        if self.verbose: print('Topology generation took %.3f s' % (time.time() - timer_start))
-
-        # DEBUG: Write out Topology
-        #import cPickle as pickle
-        #outfile = open('topology.pkl', 'w')
-        #pickle.dump(new_topology, outfile)
-        #outfile.close()
-
-        if self.verbose: print('Generating System...')
-        timer_start = time.time()
-        new_system = self._system_generator.build_system(new_topology)
-        if self.verbose: print('System generation took %.3f s' % (time.time() - timer_start))
+        return self._propose_to_molecule(current_system, current_topology, current_mol_smiles, current_mol,
+                                         proposed_mol_smiles, proposed_mol, logp_proposal)
 
-        smiles_new, _ = self._topology_to_smiles(new_topology)
+    def enumerate_proposals(self, current_system, current_topology):
+        """
+        Build a TopologyProposal from the current state to every other molecule in the set.
 
-        #map the atoms between the new and old molecule only:
-        if self.verbose: print('Generating atom map...')
-        timer_start = time.time()
-        mol_atom_map = self._get_mol_atom_map(current_mol, proposed_mol, atom_expr=self.atom_expr, bond_expr=self.bond_expr)
-        if self.verbose: print('Atom map took %.3f s' % (time.time() - timer_start))
+        This is used to construct hybrid systems that contain all molecules at once,
+        so the proposals are not drawn from the probability matrix and carry logp_proposal=0.0.
 
-        #adjust the log proposal for the alignment:
-        total_logp = logp_proposal
+        Parameters
+        ----------
+        current_system : openmm.System object
+            the system of the current state
+        current_topology : app.Topology object
+            the topology of the current state
+
+        Returns
+        -------
+        proposals : list of TopologyProposal
+            One proposal per molecule in the set other than the current one, in the order of chemical_state_list
+        """
+        current_mol_smiles, current_mol = self._topology_to_smiles(current_topology)
+        from perses.tests.utils import smiles_to_oemol
+        proposals = list()
+        for proposed_mol_smiles in self._smiles_list:
+            if proposed_mol_smiles == current_mol_smiles:
+                continue
+            proposed_mol = smiles_to_oemol(proposed_mol_smiles)
+            proposal = self._propose_to_molecule(current_system, current_topology, current_mol_smiles, current_mol,
+                                                 proposed_mol_smiles, proposed_mol, 0.0)
+            proposals.append(proposal)
+        return proposals
 
-        #adjust the atom map for the presence of the receptor:
-        adjusted_atom_map = {}
-        for (key, value) in mol_atom_map.items():
-            adjusted_atom_map[key+new_mol_start_index] = value + old_mol_start_index
+    def _propose_to_molecule(self, current_system, current_topology, current_mol_smiles, current_mol, proposed_mol_smiles, proposed_mol, logp_proposal):
+        """
+        Build the TopologyProposal that replaces the current molecule by a chosen proposed molecule.
 
-        #all atoms until the molecule starts are the same
-        old_mol_offset = len_old_mol
-        for i in range(new_mol_start_index):
-            if i >= old_mol_start_index:
-                old_idx = i + old_mol_offset
-            else:
-                old_idx = i
-            adjusted_atom_map[i] = old_idx
+        Parameters
+        ----------
+        current_system : openmm.System object
+            the system of the current state
+        current_topology : app.Topology object
+            the topology of the current state
+        current_mol_smiles : str
+            SMILES of the current molecule
+        current_mol : oechem.OEMol
+            the current molecule
+        proposed_mol_smiles : str
+            SMILES of the proposed molecule
+        proposed_mol : oechem.OEMol
+            the proposed molecule
+        logp_proposal : float
+            contribution from the chemical proposal to the log probability of acceptance
+
+        Returns
+        -------
+        proposal : TopologyProposal object
+           topology proposal object
+        """
+        if self.verbose: print('proposed SMILES string: %s' % proposed_mol_smiles)
+        old_mol_start_index, len_old_mol = self._find_mol_start_index(current_topology)
+        # The new Topology, System and atom map only depend on the molecules and on the receptor.
+        receptor_key = self._receptor_key(current_topology, old_mol_start_index, len_old_mol)
+
+        system_key = (proposed_mol_smiles, receptor_key)
+        if system_key in self._generated_systems:
+            new_topology = self._generated_topologies[system_key]
+            new_system = self._generated_systems[system_key]
+        else:
+            if self.verbose: print('Building new Topology object...')
+            timer_start = time.time()
+            current_receptor_topology = self._remove_small_molecule(current_topology)
+            new_topology = self._build_new_topology(current_receptor_topology, proposed_mol)
+            if self.verbose: print('Topology generation took %.3f s' % (time.time() - timer_start))
+
+            if self.verbose: print('Generating System...')
+            timer_start = time.time()
+            new_system = self._system_generator.build_system(new_topology)
+            if self.verbose: print('System generation took %.3f s' % (time.time() - timer_start))
+            # Topologies and Systems are shared read-only by all proposals to this molecule.
+            self._generated_topologies[system_key] = new_topology
+            self._generated_systems[system_key] = new_system
+
+        map_key = (current_mol_smiles, proposed_mol_smiles, receptor_key)
+        if map_key in self._matches:
+            adjusted_atom_map = self._matches[map_key]
+        else:
+            new_mol_start_index, len_new_mol = self._find_mol_start_index(new_topology)
+
+            #map the atoms between the new and old molecule only:
+            if self.verbose: print('Generating atom map...')
+            timer_start = time.time()
+            mol_atom_map = self._get_mol_atom_map(current_mol, proposed_mol, atom_expr=self.atom_expr, bond_expr=self.bond_expr)
+            if self.verbose: print('Atom map took %.3f s' % (time.time() - timer_start))
+
+            #adjust the atom map for the presence of the receptor:
+            mol_atom_map = AtomMap(mol_atom_map)
+            new_indices = [mol_atom_map.source_indices + new_mol_start_index]
+            old_indices = [mol_atom_map.destination_indices + old_mol_start_index]
+
+            #all atoms until the molecule starts are the same
+            old_mol_offset = len_old_mol
+            receptor_indices = np.arange(new_mol_start_index, dtype=np.int32)
+            new_indices.append(receptor_indices)
+            old_indices.append(np.where(receptor_indices >= old_mol_start_index, receptor_indices + old_mol_offset, receptor_indices))
+            adjusted_atom_map = AtomMap.from_arrays(np.concatenate(new_indices), np.concatenate(old_indices))
+            self._matches[map_key] = adjusted_atom_map
+
+        # The proposal probability is not cached, since the probability matrix may be adapted.
+        total_logp = logp_proposal
 
         #Create the TopologyProposal and return it
         proposal = TopologyProposal(new_topology=new_topology, new_system=new_system, old_topology=current_topology, old_system=current_system, logp_proposal=total_logp,
@@ -1362,6 +1652,49 @@ class SmallMoleculeSetProposalEngine(ProposalEngine):
             print('Proposed transformation would delete %d atoms and create %d atoms.' % (ndelete, ncreate))
         return proposal
 
+    def _receptor_key(self, topology, mol_start_index, len_mol):
+        """
+        Return a key identifying the receptor of `topology`, that is all atoms other than the small molecule.
+
+        The key is a SHA-1 digest of the chains, residues and atoms (names and elements) of the receptor and of
+        the position of the molecule among them, so that different receptors or solvated systems with the same
+        number of atoms do not share cached Topologies, Systems and atom maps. Since Topologies are shared
+        read-only, keys are memoized per Topology.
+
+        Parameters
+        ----------
+        topology : app.Topology object
+            the topology of the current state
+        mol_start_index : int
+            index of the first atom of the small molecule
+        len_mol : int
+            number of atoms of the small molecule
+
+        Returns
+        -------
+        receptor_key : str
+            hexadecimal digest identifying the receptor
+        """
+        if id(topology) in self._receptor_keys:
+            (cached_topology, receptor_key) = self._receptor_keys[id(topology)]
+            if cached_topology is topology:
+                return receptor_key
+        fingerprint = hashlib.sha1()
+        fingerprint.update(('molecule %d\n' % mol_start_index).encode('utf-8'))
+        for chain in topology.chains():
+            fingerprint.update(b'chain\n')
+            for residue in chain.residues():
+                fingerprint.update(('residue %s\n' % residue.name).encode('utf-8'))
+                for atom in residue.atoms():
+                    if mol_start_index <= atom.index < mol_start_index + len_mol:
+                        continue
+                    element = atom.element.symbol if atom.element is not None else ''
+                    fingerprint.update(('%s %s\n' % (atom.name, element)).encode('utf-8'))
+        receptor_key = fingerprint.hexdigest()
+        # The Topology is held alongside its key so that its identity (id) is not reused while memoized.
+        self._receptor_keys[id(topology)] = (topology, receptor_key)
+        return receptor_key
+
     def _canonicalize_smiles(self, smiles):
         """
         Convert a SMILES string into canonical isomeric smiles
@@ -1567,18 +1900,116 @@ class SmallMoleculeSetProposalEngine(ProposalEngine):
             contribution from the chemical proposal to the log probability of acceptance (Eq. 36 for hybrid; Eq. 53 for two-stage)
             log [P(Mold | Mnew) / P(Mnew | Mold)]
         """
+        proposed_smiles, logp = self.propose_state_key(molecule_smiles)
+        from perses.tests.utils import smiles_to_oemol
+        proposed_mol = smiles_to_oemol(proposed_smiles)
+        return proposed_smiles, proposed_mol, logp
+
+    def propose_state_key(self, current_state_key):
+        """
+        Choose the next chemical state from the probability matrix without building any System.
+
+        Parameters
+        ----------
+        current_state_key : str
+            The SMILES of the current molecule
+
+        Returns
+        -------
+        proposed_state_key : str
+            The SMILES of the proposed molecule
+        logp_proposal : float
+            log [P(Mold | Mnew) / P(Mnew | Mold)]
+        """
         # Compute contribution from the chemical proposal to the log probability of acceptance (Eq. 36 for hybrid; Eq. 53 for two-stage)
         # log [P(Mold | Mnew) / P(Mnew | Mold)]
-        current_smiles_idx = self._smiles_list.index(molecule_smiles)
+        current_smiles_idx = self._smiles_list.index(current_state_key)
         molecule_probabilities = self._probability_matrix[current_smiles_idx, :]
         proposed_smiles_idx = np.random.choice(range(len(self._smiles_list)), p=molecule_probabilities)
         reverse_probability = self._probability_matrix[proposed_smiles_idx, current_smiles_idx]
         forward_probability = molecule_probabilities[proposed_smiles_idx]
         proposed_smiles = self._smiles_list[proposed_smiles_idx]
         logp = np.log(reverse_probability) - np.log(forward_probability)
-        from perses.tests.utils import smiles_to_oemol
-        proposed_mol = smiles_to_oemol(proposed_smiles)
-        return proposed_smiles, proposed_mol, logp
+        return proposed_smiles, logp
+
+    def record_proposal_outcome(self, old_state_key, proposed_state_key, acceptance_probability):
+        """
+        Accumulate the acceptance statistics of a proposal, adapting the probability matrix once the burn-in is complete.
+
+        The acceptance probability rather than the accept/reject outcome is accumulated, which gives lower-variance
+        estimates of the per-pair acceptance rates. Nothing is recorded if adaptation is disabled or complete.
+
+        Parameters
+        ----------
+        old_state_key : str
+            The SMILES of the molecule the proposal was made from
+        proposed_state_key : str
+            The SMILES of the proposed molecule
+        acceptance_probability : float
+            The probability with which the proposal was accepted
+        """
+        if (self._adaptive_burn_in is None) or self._adapted:
+            return
+        i = self._smiles_list.index(old_state_key)
+        j = self._smiles_list.index(proposed_state_key)
+        self._proposal_counts[i, j] += 1
+        self._acceptance_sums[i, j] += acceptance_probability
+        self._nrecorded += 1
+        if self._nrecorded >= self._adaptive_burn_in:
+            self._adapt_probability_matrix()
+
+    def _adapt_probability_matrix(self):
+        """
+        Reweight the MCSS probability matrix by the observed acceptance rates and freeze it.
+
+        Acceptance rates are pooled over both directions of each pair, so that the reweighting factor is symmetric,
+        and shrunk toward the overall acceptance rate with one pseudo-count, so that rarely proposed pairs keep
+        their MCSS weight. Since the factors are floored at `adaptive_floor`, the adapted matrix has the same
+        nonzero pattern as the MCSS matrix, and logp_proposal remains well defined for every proposal.
+        The matrix is not changed again, since adapting it during production sampling would break detailed balance.
+        """
+        counts = self._proposal_counts + self._proposal_counts.T
+        sums = self._acceptance_sums + self._acceptance_sums.T
+        overall_acceptance_rate = sums.sum() / max(counts.sum(), 1)
+        acceptance_rates = (sums + overall_acceptance_rate) / (counts + 1.0)
+        weights = self._mcss_probability_matrix * np.maximum(acceptance_rates, self._adaptive_floor)
+        self._probability_matrix = weights / weights.sum(axis=1)[:, np.newaxis]
+        self._adapted = True
+        if self.verbose: print("Adapted chemical proposal probability matrix after %d proposals (overall acceptance rate %.3f)" % (self._nrecorded, overall_acceptance_rate))
+
+        if self._storage:
+            self._storage.write_array('proposal_counts', self._proposal_counts)
+            self._storage.write_array('proposal_acceptance_sums', self._acceptance_sums)
+            self._storage.write_array('adapted_probability_matrix', self._probability_matrix)
+
+    def get_checkpoint_state(self):
+        """
+        Return the proposal statistics and probability matrix, for `set_checkpoint_state`.
+
+        Returns
+        -------
+        state : dict
+            Picklable engine state
+        """
+        return {
+            'proposal_counts' : self._proposal_counts.copy(),
+            'acceptance_sums' : self._acceptance_sums.copy(),
+            'nrecorded' : self._nrecorded,
+            'adapted' : self._adapted,
+            'probability_matrix' : self._probability_matrix.copy(),
+            }
+
+    def set_checkpoint_state(self, state):
+        """
+        Restore the proposal statistics and probability matrix from `get_checkpoint_state`.
+        """
+        if state is None:
+            return
+        self._proposal_counts = state['proposal_counts'].copy()
+        self._acceptance_sums = state['acceptance_sums'].copy()
+        self._nrecorded = state['nrecorded']
+        self._adapted = state['adapted']
+        self._probability_matrix = state['probability_matrix'].copy()
 
     def _calculate_probability_matrix(self, molecule_smiles_list):
         """
@@ -1597,19 +2028,9 @@ class SmallMoleculeSetProposalEngine(ProposalEngine):
         """
         n_smiles = len(molecule_smiles_list)
         probability_matrix = np.zeros([n_smiles, n_smiles])
-        for i in range(n_smiles):
-            for j in range(i):
-                current_mol = oechem.OEMol()
-                proposed_mol = oechem.OEMol()
-                oechem.OESmilesToMol(current_mol, molecule_smiles_list[i])
-                oechem.OESmilesToMol(proposed_mol, molecule_smiles_list[j])
-                atom_map = self._get_mol_atom_map(current_mol, proposed_mol, atom_expr=self.atom_expr, bond_expr=self.bond_expr)
-                if not atom_map:
-                    n_atoms_matching = 0
-                    continue
-                n_atoms_matching = len(atom_map.keys())
-                probability_matrix[i, j] = n_atoms_matching
-                probability_matrix[j, i] = n_atoms_matching
+        for (i, j, n_atoms_matching) in self._compute_mcss_atom_counts(molecule_smiles_list):
+            probability_matrix[i, j] = n_atoms_matching
+            probability_matrix[j, i] = n_atoms_matching
         #normalize the rows:
         for i in range(n_smiles):
             row_sum = np.sum(probability_matrix[i, :])
@@ -1625,10 +2046,68 @@ class SmallMoleculeSetProposalEngine(ProposalEngine):
 
         return probability_matrix
 
+    def _compute_mcss_atom_counts(self, molecule_smiles_list):
+        """
+        Compute the number of atoms in the MCSS of every pair of molecules, in `self._mcss_processes` processes.
+
+        Pairs are divided into chunks that worker processes take in turn. Every pair is computed exactly as in
+        a single process, so that the result does not depend on the number of processes.
+
+        Parameters
+        ----------
+        molecule_smiles_list : list of str
+            list of molecules to be potentially selected
+
+        Returns
+        -------
+        atom_counts : list of (int, int, int)
+            (i, j, n) for each pair i > j whose MCSS has n > 0 atoms
+        """
+        n_smiles = len(molecule_smiles_list)
+        pairs = [(i, j) for i in range(n_smiles) for j in range(i)]
+        nprocesses = self._mcss_processes
+        if nprocesses is None:
+            import multiprocessing
+            nprocesses = multiprocessing.cpu_count()
+        nprocesses = max(1, min(nprocesses, len(pairs)))
+        # Several chunks per process balance the load and give regular progress reports.
+        chunk_size = max(1, len(pairs) // (8 * nprocesses))
+        chunks = [(molecule_smiles_list, pairs[start:start+chunk_size], self.atom_expr, self.bond_expr) for start in range(0, len(pairs), chunk_size)]
+
+        atom_counts = list()
+        ncompleted = 0
+        pool = None
+        if nprocesses > 1:
+            import multiprocessing
+            try:
+                mp = multiprocessing.get_context('fork')
+            except AttributeError:
+                mp = multiprocessing # python 2 always forks on POSIX
+            pool = mp.Pool(nprocesses)
+            results = pool.imap_unordered(_compute_mcss_atom_counts, chunks)
+        else:
+            results = (_compute_mcss_atom_counts(chunk) for chunk in chunks)
+        try:
+            for (npairs, chunk_atom_counts) in results:
+                atom_counts.extend(chunk_atom_counts)
+                ncompleted += npairs
+                if (self._mcss_progress is not None) and (self._mcss_progress(ncompleted, len(pairs)) is False):
+                    raise Exception("MCSS computation cancelled after %d / %d pairs of molecules" % (ncompleted, len(pairs)))
+        finally:
+            if pool is not None:
+                # Stops the workers immediately if the computation was cancelled or interrupted.
+                pool.terminate()
+                pool.join()
+        return atom_counts
+
     @property
     def chemical_state_list(self):
          return self._smiles_list
 
+    @property
+    def residue_name(self):
+        return self._residue_name
+
     @staticmethod
     def clean_molecule_list(smiles_list, atom_opts, bond_opts):
         """
@@ -1730,7 +2209,7 @@ class NullProposalEngine(SmallMoleculeSetProposalEngine):
         new_topology = app.Topology()
         append_topology(new_topology, current_topology)
         new_topology._state_key = new_key
-        new_system = copy.deepcopy(current_system)
+        new_system = copy_system(current_system, reason='NullProposalEngine')
         atom_map = self._make_skewed_atom_map(current_topology)
         proposal = TopologyProposal(new_topology=new_topology, new_system=new_system, old_topology=current_topology, old_system=current_system, logp_proposal=0.0,
                                                  new_to_old_atom_map=atom_map, old_chemical_state_key=old_key, new_chemical_state_key=new_key)
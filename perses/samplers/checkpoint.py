@@ -0,0 +1,138 @@
+"""
+Checkpoint and restart of perses sampler hierarchies.
+
+A checkpoint holds the complete dynamical state of a sampler and of the samplers it drives (Systems,
+Topologies, positions, box vectors, OpenMM Context and integrator states, chemical state keys, logZ
+estimates, log weights and iteration counters), together with the state of numpy's global random number
+generator. Samplers are not pickled themselves: a run is resumed by constructing the sampler hierarchy
+exactly as for the original run and restoring the checkpoint into it, after which sampling continues
+as if it had not been interrupted (on the same OpenMM platform).
+
+Checkpoints are compressed pickles, written to a temporary file that atomically replaces the previous
+checkpoint, so that a job killed while writing leaves the previous checkpoint intact.
+
+Any object implementing `get_checkpoint_state()` and `set_checkpoint_state(state)` can be checkpointed;
+this includes MCMCSampler, ExpandedEnsembleSampler, SAMSSampler, MultiWalkerSAMSSampler, MultiTargetDesign,
+ProtonationStateSampler, ReplicaExchangeSampler and PersesTestSystem.
+
+When storage is used, it should be opened in append mode ('a') when resuming, so that the history
+recorded before the checkpoint is kept.
+
+"""
+
+################################################################################
+# IMPORTS
+################################################################################
+
+import os
+import pickle
+import zlib
+import numpy as np
+
+################################################################################
+# CONSTANTS
+################################################################################
+
+CHECKPOINT_VERSION = 1
+
+################################################################################
+# CHECKPOINTS
+################################################################################
+
+def write_checkpoint(sampler, filename):
+    """
+    Atomically write a checkpoint of a sampler hierarchy and of numpy's random number generator.
+
+    Parameters
+    ----------
+    sampler : object implementing get_checkpoint_state()
+        The top-level sampler
+    filename : str
+        The checkpoint file, which is replaced if it exists
+    """
+    checkpoint = {
+        'version' : CHECKPOINT_VERSION,
+        'class' : sampler.__class__.__name__,
+        'state' : sampler.get_checkpoint_state(),
+        'random_state' : np.random.get_state(),
+        }
+    data = zlib.compress(pickle.dumps(checkpoint, protocol=pickle.HIGHEST_PROTOCOL))
+    temporary_filename = filename + '.tmp'
+    with open(temporary_filename, 'wb') as outfile:
+        outfile.write(data)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+    # os.rename is atomic on POSIX; os.replace also overwrites an existing file on Windows.
+    replace = getattr(os, 'replace', os.rename)
+    replace(temporary_filename, filename)
+
+def read_checkpoint(filename):
+    """
+    Read a checkpoint written by `write_checkpoint`.
+
+    Parameters
+    ----------
+    filename : str
+        The checkpoint file
+
+    Returns
+    -------
+    checkpoint : dict
+        The checkpoint, with keys 'version', 'class', 'state' and 'random_state'
+    """
+    with open(filename, 'rb') as infile:
+        checkpoint = pickle.loads(zlib.decompress(infile.read()))
+    if checkpoint['version'] != CHECKPOINT_VERSION:
+        raise Exception("Checkpoint '%s' has version %s, but version %s is supported" % (filename, checkpoint['version'], CHECKPOINT_VERSION))
+    return checkpoint
+
+def resume(sampler, filename):
+    """
+    Restore a sampler hierarchy and numpy's random number generator from a checkpoint.
+
+    The sampler must have been constructed exactly as the one the checkpoint was written from.
+
+    Parameters
+    ----------
+    sampler : object implementing set_checkpoint_state()
+        The top-level sampler
+    filename : str
+        The checkpoint file
+
+    Returns
+    -------
+    sampler : object
+        The restored sampler
+    """
+    checkpoint = read_checkpoint(filename)
+    if checkpoint['class'] != sampler.__class__.__name__:
+        raise Exception("Checkpoint '%s' was written from a %s, not a %s" % (filename, checkpoint['class'], sampler.__class__.__name__))
+    sampler.set_checkpoint_state(checkpoint['state'])
+    # The random number generator is restored last, since restoring Contexts draws integrator seeds.
+    np.random.set_state(checkpoint['random_state'])
+    return sampler
+
+def run_with_checkpoints(sampler, niterations, filename, checkpoint_interval=10):
+    """
+    Run a sampler until it has completed `niterations` iterations, resuming from and periodically writing a checkpoint.
+
+    If the checkpoint file exists, the sampler is first restored from it, so that rerunning an interrupted
+    job continues where its last checkpoint left off.
+
+    Parameters
+    ----------
+    sampler : object implementing update(), get_checkpoint_state() and set_checkpoint_state(), with an `iteration` counter
+        The top-level sampler
+    niterations : int
+        Total number of iterations to complete
+    filename : str
+        The checkpoint file
+    checkpoint_interval : int, optional, default=10
+        A checkpoint is written every `checkpoint_interval` iterations and after the last iteration
+    """
+    if os.path.exists(filename):
+        resume(sampler, filename)
+    while sampler.iteration < niterations:
+        sampler.update()
+        if (sampler.iteration % checkpoint_interval == 0) or (sampler.iteration == niterations):
+            write_checkpoint(sampler, filename)
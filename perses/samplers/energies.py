@@ -0,0 +1,147 @@
+"""
+Potential energy evaluation for samplers.
+
+Provided classes include:
+
+* EnergyEvaluator - computes potential energies of configurations, reusing Contexts for recently used Systems
+
+"""
+
+################################################################################
+# IMPORTS
+################################################################################
+
+import collections
+import numpy as np
+from simtk import openmm, unit
+from perses.systems import system_fingerprint
+
+################################################################################
+# ENERGY EVALUATOR
+################################################################################
+
+class EnergyEvaluator(object):
+    """
+    Potential energy evaluation service that keeps one Context per System.
+
+    Contexts are keyed by System identity (or by an explicit key, such as a chemical state key, for
+    callers that hold different but equivalent Systems) and the least recently used ones are
+    evicted. A different System cached under the same key only reuses the Context if it has the same
+    `perses.systems.system_fingerprint`, so that Systems which differ only by their default box
+    vectors share a Context. Constraints are applied to every configuration before its energy is computed, and the
+    periodic box vectors are always set explicitly, so that results do not depend on which
+    configuration a cached Context was last used for.
+
+    Parameters
+    ----------
+    platform : simtk.openmm.Platform, optional, default=None
+        Platform to use for Context creation. If None, the default (fastest) platform is used.
+    max_contexts : int, optional, default=4
+        Maximum number of resident Contexts; if 0, a Context is created for every evaluation and not retained.
+
+    Examples
+    --------
+    >>> from openmmtools import testsystems
+    >>> testsystem = testsystems.AlanineDipeptideVacuum()
+    >>> evaluator = EnergyEvaluator()
+    >>> potential = evaluator.compute_potential(testsystem.system, testsystem.positions)
+
+    """
+    def __init__(self, platform=None, max_contexts=4):
+        self.platform = platform
+        self.max_contexts = max_contexts
+        self._contexts = collections.OrderedDict() # key : (system, fingerprint, context, integrator)
+        self.ncreated = 0 # number of Contexts created
+
+    def _get_context(self, system, key):
+        if key is None:
+            key = id(system)
+        if key in self._contexts:
+            (cached_system, fingerprint, context, integrator) = self._contexts.pop(key)
+            if cached_system is system:
+                self._contexts[key] = (cached_system, fingerprint, context, integrator)
+                return context, integrator
+            # Fingerprints are computed lazily, and at most once per System while it is cached.
+            if fingerprint is None:
+                fingerprint = system_fingerprint(cached_system)
+            if system_fingerprint(system) == fingerprint:
+                # Cache the new System so that it is recognized by identity next time.
+                self._contexts[key] = (system, fingerprint, context, integrator)
+                return context, integrator
+        integrator = openmm.VerletIntegrator(1.0 * unit.femtoseconds)
+        if self.platform is not None:
+            context = openmm.Context(system, integrator, self.platform)
+        else:
+            context = openmm.Context(system, integrator)
+        self.ncreated += 1
+        if self.max_contexts == 0:
+            return context, integrator
+        # The System is held alongside the Context so that its identity (id) is not reused while cached.
+        self._contexts[key] = (system, None, context, integrator)
+        while len(self._contexts) > self.max_contexts:
+            self._contexts.popitem(last=False)
+        return context, integrator
+
+    def compute_potentials(self, system, positions_list, box_vectors_list=None, key=None):
+        """
+        Compute the potential energies of a batch of configurations of the same System.
+
+        Parameters
+        ----------
+        system : simtk.openmm.System
+            The System; it is not modified
+        positions_list : list of simtk.unit.Quantity of dimension [natoms, 3] with units of distance
+            The configurations
+        box_vectors_list : list of 3x3 simtk.unit.Quantity, optional, default=None
+            Periodic box vectors of each configuration; if None, the default box vectors of `system` are used
+        key : hashable, optional, default=None
+            If specified, Contexts are cached under this key instead of the identity of `system`; an equivalent
+            System cached under the same key is reused
+
+        Returns
+        -------
+        potentials : simtk.unit.Quantity of dimension [nconfigurations] with units of energy
+            The potential energies
+        """
+        from perses.annihilation.ncmc_switching import NaNException
+        context, integrator = self._get_context(system, key)
+        if box_vectors_list is None:
+            box_vectors_list = [system.getDefaultPeriodicBoxVectors()] * len(positions_list)
+        potentials = np.zeros([len(positions_list)], np.float64)
+        for (index, (positions, box_vectors)) in enumerate(zip(positions_list, box_vectors_list)):
+            context.setPeriodicBoxVectors(*box_vectors)
+            context.setPositions(positions)
+            context.applyConstraints(integrator.getConstraintTolerance())
+            potential = context.getState(getEnergy=True).getPotentialEnergy()
+            potentials[index] = potential.value_in_unit(unit.kilojoules_per_mole)
+            if np.isnan(potentials[index]):
+                raise NaNException("Potential energy is NaN")
+        return unit.Quantity(potentials, unit.kilojoules_per_mole)
+
+    def compute_potential(self, system, positions, box_vectors=None, key=None):
+        """
+        Compute the potential energy of a configuration, raising an exception if it is not finite.
+
+        Parameters
+        ----------
+        system : simtk.openmm.System
+            The System; it is not modified
+        positions : simtk.unit.Quantity of dimension [natoms, 3] with units of distance
+            The configuration
+        box_vectors : 3x3 simtk.unit.Quantity, optional, default=None
+            Periodic box vectors; if None, the default box vectors of `system` are used
+        key : hashable, optional, default=None
+            If specified, the Context is cached under this key instead of the identity of `system`
+
+        Returns
+        -------
+        potential : simtk.unit.Quantity with units of energy
+            The potential energy
+        """
+        box_vectors_list = None if box_vectors is None else [box_vectors]
+        potentials = self.compute_potentials(system, [positions], box_vectors_list=box_vectors_list, key=key)
+        return potentials[0]
+
+    def clear(self):
+        """Discard all cached Contexts."""
+        self._contexts.clear()
@@ -23,10 +23,12 @@ import numpy as np
 from openmmtools import testsystems
 import copy
 import time
+import collections
 
 from perses.storage import NetCDFStorageView
 from perses.samplers import thermodynamics
 from perses.tests.utils import quantity_is_finite
+from perses.systems import copy_system
 
 ################################################################################
 # LOGGER
@@ -45,7 +47,9 @@ from perses.samplers.thermodynamics import kB
 # THERMODYNAMIC STATE
 ################################################################################
 
-from perses.samplers.thermodynamics import ThermodynamicState
+from perses.samplers.thermodynamics import ThermodynamicState, _with_barostat
+from perses.samplers.energies import EnergyEvaluator
+from perses.samplers.states import ChemicalStateRegistry, StateArray
 
 ################################################################################
 # UTILITY FUNCTIONS
@@ -57,10 +61,13 @@ def log_sum_exp(a_n):
 
     Parameters
     ----------
-    a_n : dict of objects : floats
+    a_n : dict of objects : floats, or StateArray
 
     """
-    a_n = np.array(list(a_n.values()))
+    if isinstance(a_n, StateArray):
+        a_n = a_n.values_array()
+    else:
+        a_n = np.array(list(a_n.values()))
     return np.log( np.sum( np.exp(a_n - a_n.max() ) ) )
 
 ################################################################################
@@ -134,12 +141,15 @@ class SamplerState(object):
         if velocities is not None:
             assert quantity_is_finite(self.velocities)
 
-        self.system = copy.deepcopy(system)
+        # Systems are shared read-only; a private copy is only made if forces need to be removed.
+        self.system = system
 
         # Remove CMMotionRemover, since it can cause problems with GHMC and NCMC.
         forces_to_remove = [ force_index for force_index in range(self.system.getNumForces()) if (self.system.getForce(force_index).__class__.__name__ == 'CMMotionRemover') ]
-        for force_index in reversed(forces_to_remove):
-            system.removeForce(force_index)
+        if len(forces_to_remove) > 0:
+            self.system = copy_system(system, reason='SamplerState CMMotionRemover removal')
+            for force_index in reversed(forces_to_remove):
+                self.system.removeForce(force_index)
 
         self.positions = positions
         self.velocities = velocities
@@ -164,7 +174,7 @@ class SamplerState(object):
         del context
 
     @classmethod
-    def createFromContext(cls, context):
+    def createFromContext(cls, context, system=None):
         """
         Create an SamplerState object from the information in a current OpenMM Context object.
 
@@ -172,6 +182,9 @@ class SamplerState(object):
         ----------
         context : simtk.openmm.Context
            The Context object from which to create a sampler state.
+        system : simtk.openmm.System, optional, default=None
+           The shared System the Context was created from (without any barostat added by createContext).
+           If specified, it is referenced by the sampler state; otherwise a copy of the Context's System is made.
 
         Returns
         -------
@@ -205,7 +218,10 @@ class SamplerState(object):
         self = SamplerState.__new__(cls)
 
         # Populate context.
-        self.system = copy.deepcopy(context.getSystem())
+        if system is not None:
+            self.system = system
+        else:
+            self.system = copy_system(context.getSystem(), reason='SamplerState.createFromContext')
         self.positions = openmm_state.getPositions(asNumpy=True)
         self.velocities = openmm_state.getVelocities(asNumpy=True)
         self.box_vectors = openmm_state.getPeriodicBoxVectors(asNumpy=True)
@@ -289,15 +305,14 @@ class SamplerState(object):
         if integrator is None:
             integrator = openmm.VerletIntegrator(1.0 * unit.femtoseconds)
 
-        # Create a copy of the system
-        system = copy.deepcopy(self.system)
+        # The Context is created from the shared System unless a barostat has to be added to a private copy.
+        system = self.system
 
-        # If thermodynamic state is specified with a pressure, add a barostat.
+        # If thermodynamic state is specified with a pressure, make sure a barostat is present.
         if (thermodynamic_state is not None) and (thermodynamic_state.pressure is not None):
             if not system.usesPeriodicBoundaryConditions():
                 raise Exception('Specified a pressure but system does not have periodic boundary conditions')
-            barostat = openmm.MonteCarloBarostat(thermodynamic_state.pressure, thermodynamic_state.temperature)
-            system.addForce(barostat)
+            system = _with_barostat(self.system, thermodynamic_state.temperature, thermodynamic_state.pressure, reason='SamplerState barostat')
 
         # Create a Context.
         if platform:
@@ -583,9 +598,9 @@ class MCMCSampler(object):
 
         """
         # Keep copies of initializing arguments.
-        # TODO: Make deep copies?
-        self.thermodynamic_state = copy.deepcopy(thermodynamic_state)
-        self.sampler_state = copy.deepcopy(sampler_state)
+        # The states are copied shallowly: their Systems are shared read-only and replaced (never modified) by the sampler.
+        self.thermodynamic_state = copy.copy(thermodynamic_state)
+        self.sampler_state = copy.copy(sampler_state)
         self.topology = topology
         self.integrator_name = integrator_name
 
@@ -601,32 +616,137 @@ class MCMCSampler(object):
         self.nsteps = 500 # number of steps per update
         self.verbose = True
 
-    def update(self):
+        # Live Context and integrator, reused across iterations until the System being simulated changes
+        self._context = None
+        self._integrator = None
+        self._context_parameters = None # parameters the live Context was created for
+        self._context_positions = None # positions read back from the live Context by the last update, or pushed into it since
+
+    def _create_integrator(self):
         """
-        Update the sampler with one step of sampling.
+        Create the integrator used for propagation.
         """
-        if self.verbose:
-            print("." * 80)
-            print("MCMC sampler iteration %d" % self.iteration)
-
-        # Create an integrator
         if self.integrator_name == 'GHMC':
             # TODO: Migrate GHMCIntegrator back to openmmtools
             #from openmmtools.integrators import GHMCIntegrator
             integrator = GHMCIntegrator(temperature=self.thermodynamic_state.temperature, collision_rate=self.collision_rate, timestep=self.timestep)
-            if self.verbose: print("Taking %d steps of GHMC..." % self.nsteps)
         elif self.integrator_name == 'Langevin':
             from simtk.openmm import LangevinIntegrator
             integrator = LangevinIntegrator(self.thermodynamic_state.temperature, self.collision_rate, self.timestep)
-            if self.verbose: print("Taking %d steps of Langevin dynamics..." % self.nsteps)
         else:
             raise Exception("integrator_name '%s' not valid." % (self.integrator_name))
+        # Draw the random number seed from numpy, so that seeding numpy makes sampling reproducible.
+        integrator.setRandomNumberSeed(np.random.randint(1, 2**30))
+        return integrator
+
+    def _current_context_parameters(self):
+        return [self.thermodynamic_state.system, self.sampler_state.system, self.thermodynamic_state.temperature,
+                self.thermodynamic_state.pressure, self.integrator_name, self.collision_rate, self.timestep]
+
+    def _context_is_valid(self):
+        """
+        Return True if the live Context was created for the current Systems and simulation parameters.
+        Systems are compared by identity, since they are shared read-only and replaced when they change.
+        """
+        if self._context is None:
+            return False
+        current = self._current_context_parameters()
+        live = self._context_parameters
+        return (current[0] is live[0]) and (current[1] is live[1]) and (current[2:] == live[2:])
+
+    def invalidate_context(self):
+        """
+        Discard the live Context and integrator, so that they are recreated on the next update.
+        """
+        del self._context, self._integrator
+        self._context = None
+        self._integrator = None
+        self._context_parameters = None
+        self._context_positions = None
+
+    def detach_context(self):
+        """
+        Remove the live Context from the sampler and return it, so that it can be kept for later reuse.
+
+        Returns
+        -------
+        live_context : tuple or None
+            Opaque object to pass to `attach_context`, or None if the sampler has no live Context
+        """
+        if self._context is None:
+            return None
+        live_context = (self._context, self._integrator, self._context_parameters)
+        self._context = None
+        self._integrator = None
+        self._context_parameters = None
+        self._context_positions = None
+        return live_context
+
+    def attach_context(self, live_context):
+        """
+        Install a Context previously returned by `detach_context`, pointing the thermodynamic and sampler
+        states at the Systems it was created from. The sampler state positions and box vectors are pushed
+        into the Context on the next update.
+
+        Parameters
+        ----------
+        live_context : tuple
+            Object returned by `detach_context`
+        """
+        self.invalidate_context()
+        (self._context, self._integrator, self._context_parameters) = live_context
+        self.thermodynamic_state.system = self._context_parameters[0]
+        self.sampler_state.system = self._context_parameters[1]
+
+    def _get_context(self):
+        """
+        Return the live Context and integrator, creating them if the System or simulation parameters have changed.
+
+        If the sampler state positions are the ones read back from the Context by the previous update (or pushed into
+        it by a previous call), the Context already holds the current configuration and its velocities are carried over.
+        Otherwise the positions and box vectors are pushed into the Context and velocities are drawn from the
+        Maxwell-Boltzmann distribution.
+
+        Returns
+        -------
+        context : simtk.openmm.Context
+            The live Context
+        integrator : simtk.openmm.Integrator
+            The integrator bound to the Context
+        """
+        if not self._context_is_valid():
+            self.invalidate_context()
+            self._integrator = self._create_integrator()
+            self._context = self.sampler_state.createContext(integrator=self._integrator, thermodynamic_state=self.thermodynamic_state)
+            self._context_parameters = self._current_context_parameters()
+            self._context.setVelocitiesToTemperature(self.thermodynamic_state.temperature, np.random.randint(1, 2**30))
+        elif self.sampler_state.positions is not self._context_positions:
+            box_vectors = self.sampler_state.box_vectors
+            if box_vectors is not None:
+                self._context.setPeriodicBoxVectors(box_vectors[0], box_vectors[1], box_vectors[2])
+            self._context.setPositions(self.sampler_state.positions)
+            self._context.setVelocitiesToTemperature(self.thermodynamic_state.temperature, np.random.randint(1, 2**30))
+        self._context_positions = self.sampler_state.positions
+        return self._context, self._integrator
+
+    def update(self):
+        """
+        Update the sampler with one step of sampling.
+        """
+        if self.verbose:
+            print("." * 80)
+            print("MCMC sampler iteration %d" % self.iteration)
 
         start_time = time.time()
 
-        # Create a Context
-        context = self.sampler_state.createContext(integrator=integrator, thermodynamic_state=self.thermodynamic_state)
-        context.setVelocitiesToTemperature(self.thermodynamic_state.temperature)
+        # Retrieve the live Context, recreating it only if the System has changed
+        context, integrator = self._get_context()
+        if self.integrator_name == 'GHMC':
+            integrator.setGlobalVariableByName('naccept', 0)
+            integrator.setGlobalVariableByName('ntrials', 0)
+            if self.verbose: print("Taking %d steps of GHMC..." % self.nsteps)
+        elif self.integrator_name == 'Langevin':
+            if self.verbose: print("Taking %d steps of Langevin dynamics..." % self.nsteps)
 
         if self.verbose:
             # Print platform
@@ -645,8 +765,9 @@ class MCMCSampler(object):
         integrator.step(self.nsteps)
 
         # Recover sampler state from Context
-        self.sampler_state = SamplerState.createFromContext(context)
-        self.sampler_state.velocities = None # erase velocities since we may change dimensionality next
+        self.sampler_state = SamplerState.createFromContext(context, system=self.sampler_state.system)
+        self.sampler_state.velocities = None # velocities are carried over in the live Context; erase them since we may change dimensionality next
+        self._context_positions = self.sampler_state.positions
 
         # Write positions and box vectors
         if self.storage:
@@ -668,14 +789,8 @@ class MCMCSampler(object):
             final_energy = context.getState(getEnergy=True).getPotentialEnergy() * self.thermodynamic_state.beta
             print('Final energy is %12.3f kT' % (final_energy))
 
-        del context, integrator
-
-        # TODO: We currently are forced to update the default box vectors in System because we don't propagate them elsewhere in the code
-        # so if they change during simulation, we're in trouble.  We should instead have the code use SamplerState throughout, and likely
-        # should generalize SamplerState to include additional dynamical variables (like chemical state key?)
-        if self.sampler_state.box_vectors is not None:
-            self.thermodynamic_state.system.setDefaultPeriodicBoxVectors(*self.sampler_state.box_vectors)
-            self.sampler_state.system.setDefaultPeriodicBoxVectors(*self.sampler_state.box_vectors)
+        # Box vectors are only kept in the sampler state and the Context; the default box vectors of the shared
+        # System are never updated, so users of the configuration must take the box vectors from the sampler state.
 
         if self.verbose:
             print("." * 80)
@@ -697,6 +812,264 @@ class MCMCSampler(object):
         for iteration in range(niterations):
             self.update()
 
+    def _checkpoint_live_context(self, live_context, include_systems=False):
+        """
+        Serialize a live Context (as held by the sampler or returned by `detach_context`), including the state of its integrator.
+
+        Parameters
+        ----------
+        live_context : tuple
+            (context, integrator, context_parameters)
+        include_systems : bool, optional, default=False
+            If True, the Systems of the thermodynamic and sampler states the Context was created for are included
+        """
+        (context, integrator, parameters) = live_context
+        checkpoint = {
+            'context_system' : openmm.XmlSerializer.serialize(context.getSystem()),
+            'context' : context.createCheckpoint(),
+            'parameters' : parameters[2:],
+            }
+        if include_systems:
+            checkpoint['systems'] = _serialize_systems(parameters[:2])
+        return checkpoint
+
+    def _restore_live_context(self, checkpoint, systems=None):
+        """
+        Recreate a live Context serialized by `_checkpoint_live_context`, in the form returned by `detach_context`.
+
+        Parameters
+        ----------
+        checkpoint : dict
+            The serialized live Context
+        systems : list of simtk.openmm.System, optional, default=None
+            The Systems of the thermodynamic and sampler states; if None, the serialized ones are used
+        """
+        if systems is None:
+            systems = _deserialize_systems(checkpoint['systems'])
+        integrator = self._create_integrator()
+        context = openmm.Context(openmm.XmlSerializer.deserialize(checkpoint['context_system']), integrator)
+        context.loadCheckpoint(checkpoint['context'])
+        return (context, integrator, list(systems) + list(checkpoint['parameters']))
+
+    def get_checkpoint_state(self):
+        """
+        Return the dynamical state of the sampler, including the live Context, for `set_checkpoint_state`.
+
+        Returns
+        -------
+        state : dict
+            Picklable sampler state
+        """
+        live_context = None
+        if self._context_is_valid():
+            live_context = self._checkpoint_live_context((self._context, self._integrator, self._context_parameters))
+        return {
+            'iteration' : self.iteration,
+            'systems' : _serialize_systems([self.thermodynamic_state.system, self.sampler_state.system]),
+            'positions' : self.sampler_state.positions,
+            'velocities' : self.sampler_state.velocities,
+            'box_vectors' : self.sampler_state.box_vectors,
+            'live_context' : live_context,
+            'context_is_current' : (live_context is not None) and (self.sampler_state.positions is self._context_positions),
+            }
+
+    def set_checkpoint_state(self, state, system=None):
+        """
+        Restore the dynamical state of the sampler from `get_checkpoint_state`.
+
+        Parameters
+        ----------
+        state : dict
+            Sampler state returned by `get_checkpoint_state`
+        system : simtk.openmm.System, optional, default=None
+            If specified, this System is used for the thermodynamic and sampler states instead of the serialized ones
+        """
+        if system is not None:
+            systems = [system, system]
+        else:
+            systems = _deserialize_systems(state['systems'])
+        self.invalidate_context()
+        (self.thermodynamic_state.system, self.sampler_state.system) = systems
+        self.sampler_state.positions = state['positions']
+        self.sampler_state.velocities = state['velocities']
+        self.sampler_state.box_vectors = state['box_vectors']
+        self.iteration = state['iteration']
+        if state['live_context'] is not None:
+            self.attach_context(self._restore_live_context(state['live_context'], systems=systems))
+            if state['context_is_current']:
+                self._context_positions = self.sampler_state.positions
+
+def _serialize_systems(systems):
+    """
+    Serialize a list of Systems to XML, storing Systems that appear more than once only once.
+    """
+    serialized = list()
+    for (index, system) in enumerate(systems):
+        for previous_index in range(index):
+            if systems[previous_index] is system:
+                serialized.append(previous_index)
+                break
+        else:
+            serialized.append(openmm.XmlSerializer.serialize(system))
+    return serialized
+
+def _deserialize_systems(serialized):
+    """
+    Deserialize a list of Systems serialized by `_serialize_systems`.
+    """
+    systems = list()
+    for item in serialized:
+        if isinstance(item, int):
+            systems.append(systems[item])
+        else:
+            systems.append(openmm.XmlSerializer.deserialize(item))
+    return systems
+
+################################################################################
+# CONTEXT CACHE
+################################################################################
+
+def _estimate_context_memory(system):
+    """
+    Rough estimate of the memory (in bytes) held by a Context for the given System.
+
+    Only per-particle state and per-term force parameters are counted; platform-specific storage
+    such as neighbor lists or PME grids is not included.
+
+    Parameters
+    ----------
+    system : simtk.openmm.System
+        The System the Context is created from
+
+    Returns
+    -------
+    nbytes : int
+        Estimated number of bytes
+    """
+    nbytes = system.getNumParticles() * 12 * 8 # positions, velocities, forces and masses
+    for force in system.getForces():
+        for method_name in ['getNumParticles', 'getNumBonds', 'getNumAngles', 'getNumTorsions', 'getNumExceptions']:
+            if hasattr(force, method_name):
+                nbytes += getattr(force, method_name)() * 8 * 8
+    return nbytes
+
+class ContextCache(object):
+    """
+    Least-recently-used cache of OpenMM Contexts keyed by chemical state.
+
+    Each chemical state can hold one Context of each kind (for example a parked MCMC Context),
+    together with the System it was created from. When the number of
+    resident Contexts or their estimated memory exceeds the limits, the Contexts of the least recently
+    used chemical states are evicted.
+
+    Parameters
+    ----------
+    max_contexts : int, optional, default=4
+        Maximum number of resident Contexts
+    max_memory : int, optional, default=None
+        If specified, maximum estimated memory (in bytes) of resident Contexts
+
+    """
+    def __init__(self, max_contexts=4, max_memory=None):
+        self.max_contexts = max_contexts
+        self.max_memory = max_memory
+        self._entries = collections.OrderedDict() # state_key : { kind : (item, system, nbytes) }
+        self.nhits = 0
+        self.nmisses = 0
+        self.nevicted = 0
+
+    @property
+    def ncontexts(self):
+        """Number of resident Contexts"""
+        return sum(len(entry) for entry in self._entries.values())
+
+    @property
+    def memory(self):
+        """Estimated memory (in bytes) of resident Contexts"""
+        return sum(nbytes for entry in self._entries.values() for (item, system, nbytes) in entry.values())
+
+    def get(self, state_key, kind):
+        """
+        Return the cached item of the given kind for a chemical state, marking the state as recently used.
+
+        Returns
+        -------
+        item : object or None
+            The cached item, or None if there is none
+        system : simtk.openmm.System or None
+            The System the item was created from
+        """
+        if (state_key in self._entries) and (kind in self._entries[state_key]):
+            self.nhits += 1
+            entry = self._entries.pop(state_key)
+            self._entries[state_key] = entry
+            (item, system, nbytes) = entry[kind]
+            return item, system
+        self.nmisses += 1
+        return None, None
+
+    def pop(self, state_key, kind):
+        """
+        Remove and return the cached item of the given kind for a chemical state.
+
+        Returns
+        -------
+        item : object or None
+            The cached item, or None if there is none
+        """
+        item, system = self.get(state_key, kind)
+        if item is not None:
+            del self._entries[state_key][kind]
+        return item
+
+    def put(self, state_key, kind, item, system):
+        """
+        Store an item of the given kind for a chemical state, evicting least recently used states if needed.
+
+        Parameters
+        ----------
+        state_key : hashable
+            Chemical state key
+        kind : str
+            Kind of Context, e.g. 'mcmc' for a parked MD Context
+        item : object
+            The Context, or an object holding it; None is ignored
+        system : simtk.openmm.System
+            The System the Context was created from
+        """
+        if (item is None) or (self.max_contexts == 0):
+            return
+        entry = self._entries.pop(state_key, dict())
+        entry[kind] = (item, system, _estimate_context_memory(system))
+        self._entries[state_key] = entry
+        self._evict(protect=state_key)
+
+    def _evict(self, protect=None):
+        for state_key in list(self._entries.keys()):
+            over_count = self.ncontexts > self.max_contexts
+            over_memory = (self.max_memory is not None) and (self.memory > self.max_memory)
+            if not (over_count or over_memory):
+                break
+            if state_key == protect:
+                continue
+            self.nevicted += len(self._entries[state_key])
+            del self._entries[state_key]
+
+    def items(self, kind):
+        """
+        Return the cached items of the given kind, from least to most recently used.
+
+        Returns
+        -------
+        items : list of (state_key, item, system)
+            The chemical state key, cached item and System of each cached item
+        """
+        return [(state_key, entry[kind][0], entry[kind][1]) for (state_key, entry) in self._entries.items() if kind in entry]
+
+    def clear(self):
+        """Discard all cached Contexts."""
+        self._entries.clear()
+
 ################################################################################
 # EXPANDED ENSEMBLE SAMPLER
 ################################################################################
@@ -725,7 +1098,11 @@ class ExpandedEnsembleSampler(object):
         Number of accepted thermodynamic/chemical state changes.
     nrejected : int
         Number of rejected thermodynamic/chemical state changes.
-    number_of_state_visits : dict of state_key
+    state_registry : ChemicalStateRegistry
+        Registry assigning array indices to chemical state keys, shared with SAMS samplers driving this sampler.
+    log_weights : StateArray of state_key : float
+        Log weights used for expanded ensemble biases; assigning any mapping converts it to a StateArray.
+    number_of_state_visits : StateArray of state_key : int
         Cumulative counts of visited states.
     verbose : bool
         If True, verbose output is printed.
@@ -786,9 +1163,15 @@ class ExpandedEnsembleSampler(object):
         log_weights : dict of object : float
             Log weights to use for expanded ensemble biases.
         scheme : str, optional, default='ncmc-geometry-ncmc'
-            Update scheme. One of ['ncmc-geometry-ncmc', 'geometry-ncmc-geometry']
+            Update scheme. One of ['ncmc-geometry-ncmc', 'geometry-ncmc-geometry', 'superposition']
+            'superposition' simulates a single hybrid System containing every ligand of a SmallMoleculeSetProposalEngine
+            and switches between ligands by changing Context parameters only.
         options : dict, optional, default=dict()
-            Options for initializing switching scheme, such as 'timestep', 'nsteps', 'functions' for NCMC
+            Options for initializing switching scheme, such as 'timestep', 'nsteps', 'functions', 'integrator_type' for NCMC,
+            and 'preserve_environment' and 'hybrid_cache_directory' for hybrid systems in the 'geometry-ncmc-geometry' scheme.
+            'context_cache_size' (default 4; 0 disables caching) and 'context_cache_memory' (estimated bytes, default 2**28)
+            limit the LRU cache of MD Contexts kept per chemical state, and 'energy_cache_size' (default 4; 0 creates a new Context
+            for every evaluation) the number of Contexts kept for evaluating endpoint energies.
         platform : simtk.openmm.Platform, optional, default=None
             Platform to use for NCMC switching.  If `None`, default (fastest) platform is used.
         storage : NetCDFStorageView, optional, default=None
@@ -801,6 +1184,10 @@ class ExpandedEnsembleSampler(object):
         self.topology = topology
         self.state_key = state_key
         self.proposal_engine = proposal_engine
+        try:
+            self.state_registry = ChemicalStateRegistry(proposal_engine.chemical_state_list)
+        except NotImplementedError:
+            self.state_registry = ChemicalStateRegistry()
         self.log_weights = log_weights
         self.scheme = scheme
         if self.log_weights is None: self.log_weights = dict()
@@ -811,38 +1198,86 @@ class ExpandedEnsembleSampler(object):
 
         # Initialize
         self.iteration = 0
-        option_names = ['timestep', 'nsteps', 'functions']
+        option_names = ['timestep', 'nsteps', 'functions', 'integrator_type', 'preserve_environment', 'hybrid_cache_directory', 'context_cache_size', 'context_cache_memory', 'energy_cache_size']
         if options is None:
             options = dict()
         for option_name in option_names:
             if option_name not in options:
                 options[option_name] = None
+        if options['integrator_type'] is None:
+            options['integrator_type'] = 'GHMC'
+        if options['preserve_environment'] is None:
+            options['preserve_environment'] = False
+        if options['context_cache_size'] is None:
+            options['context_cache_size'] = 4
+        if options['context_cache_memory'] is None:
+            options['context_cache_memory'] = 2**28
+        if options['energy_cache_size'] is None:
+            options['energy_cache_size'] = 4
+        # Sampler attributes are set before the switching engine is created, since building the superposition uses them.
+        self.geometry_engine = geometry_engine
+        self.naccepted = 0
+        self.nrejected = 0
+        self.number_of_state_visits = StateArray(self.state_registry, dtype=np.int64)
+        self.verbose = False
+        self.pdbfile = None # if not None, write PDB file
+        self.geometry_pdbfile = None # if not None, write PDB file of geometry proposals
+        self.accept_everything = False # if True, will accept anything that doesn't lead to NaNs
+        self.delayed_acceptance = False # if True, screen proposals by their instantaneous acceptance probability before running NCMC
+        self.nrejected_surrogate = 0 # number of proposals rejected by the surrogate stage of delayed acceptance
+        self.prefetch_proposals = False # if True, build the next chemical proposal in a worker process while MD runs
+        self._prefetched_proposal = None # (state key, topology, TopologyProposal) built during the last positions update
+        self.ntries = 1 # if greater than 1, draw this many candidate proposals and select one by multiple-try Metropolis before running NCMC
+        self.multiple_try_processes = None # number of processes drawing multiple-try candidates; if None, min(ntries, number of CPUs)
+        self._multiple_try_energy_evaluator = None # CPU energy evaluator for multiple-try weights drawn in this process
+        self._switching_endpoints = None # (old positions, new positions, logP_reverse) at the end of the last hybrid NCMC switching
+        # Moves available to the move schedule, by name; a move returns True or False if it was accepted or rejected, or None
+        self.moves = collections.OrderedDict([('positions', self._positions_move), ('state', self._state_move)])
+        self.move_schedule = [('positions', 1), ('state', 1)] # list of (move name, count) pairs making up one iteration
+        self.move_selection = 'ordered' # 'ordered' runs the schedule in order; 'weighted' draws moves with probabilities proportional to their counts
+        self.move_statistics = dict() # move_statistics[name] is a dict of 'nattempted', 'naccepted' and 'time' (wall clock seconds) of the move
+        self.last_transition = None # (old_state_key, proposed_state_key, acceptance probability or None) of the last chemical state move
+        self.logPs = list()
         if options['nsteps']:
             self._switching_nsteps = options['nsteps']
         else:
             self._switching_nsteps = 0
         if scheme in ['ncmc-geometry-ncmc']:
             from perses.annihilation.ncmc_switching import NCMCEngine
-            self.ncmc_engine = NCMCEngine(temperature=self.sampler.thermodynamic_state.temperature, timestep=options['timestep'], nsteps=options['nsteps'], functions=options['functions'], platform=platform, storage=self.storage)
+            self.ncmc_engine = NCMCEngine(temperature=self.sampler.thermodynamic_state.temperature, timestep=options['timestep'], nsteps=options['nsteps'], functions=options['functions'], integrator_type=options['integrator_type'], platform=platform, storage=self.storage)
         elif scheme=='geometry-ncmc-geometry':
             from perses.annihilation.ncmc_switching import NCMCHybridEngine
-            self.ncmc_engine = NCMCHybridEngine(temperature=self.sampler.thermodynamic_state.temperature, timestep=options['timestep'], nsteps=options['nsteps'], functions=options['functions'], platform=platform, storage=self.storage)
+            self.ncmc_engine = NCMCHybridEngine(temperature=self.sampler.thermodynamic_state.temperature, timestep=options['timestep'], nsteps=options['nsteps'], functions=options['functions'], integrator_type=options['integrator_type'], platform=platform, storage=self.storage, preserve_environment=options['preserve_environment'], hybrid_cache_directory=options['hybrid_cache_directory'])
+        elif scheme=='superposition':
+            self.superposition = self._create_superposition(geometry_engine)
+            from perses.annihilation.ncmc_switching import NCMCSuperposedLigandsEngine
+            self.ncmc_engine = NCMCSuperposedLigandsEngine(self.superposition, temperature=self.sampler.thermodynamic_state.temperature, timestep=options['timestep'], nsteps=options['nsteps'], functions=options['functions'], integrator_type=options['integrator_type'], platform=platform, storage=self.storage)
         else:
             raise Exception("Expanded ensemble state proposal scheme '%s' unsupported" % self.scheme)
-        self.geometry_engine = geometry_engine
-        self.naccepted = 0
-        self.nrejected = 0
-        self.number_of_state_visits = dict()
-        self.verbose = False
-        self.pdbfile = None # if not None, write PDB file
-        self.geometry_pdbfile = None # if not None, write PDB file of geometry proposals
-        self.accept_everything = False # if True, will accept anything that doesn't lead to NaNs
-        self.logPs = list()
+        # Contexts of recently visited chemical states, so that revisiting a state does not create new Contexts.
+        # The superposition scheme simulates a single System and does not need them.
+        self.context_cache = None
+        if (options['context_cache_size'] > 0) and (scheme != 'superposition'):
+            self.context_cache = ContextCache(max_contexts=options['context_cache_size'], max_memory=options['context_cache_memory'])
+        self.energy_evaluator = EnergyEvaluator(platform=self.ncmc_engine.platform, max_contexts=options['energy_cache_size'])
 
     @property
     def state_keys(self):
         return self.log_weights.keys()
 
+    @property
+    def log_weights(self):
+        return self._log_weights
+
+    @log_weights.setter
+    def log_weights(self, log_weights):
+        if log_weights is None:
+            self._log_weights = None
+        elif isinstance(log_weights, StateArray) and (log_weights.registry is self.state_registry):
+            self._log_weights = log_weights
+        else:
+            self._log_weights = StateArray(self.state_registry, log_weights)
+
     def get_log_weight(self, state_key):
         """
         Get the log weight of the specified state.
@@ -946,7 +1381,7 @@ class ExpandedEnsembleSampler(object):
         if self.verbose: print("Performing NCMC insertion")
         # Alchemically introduce new atoms.
         initial_time = time.time()
-        [ncmc_new_positions, logP_work, logP_energy] = self.ncmc_engine.integrate(topology_proposal, ncmc_old_positions, direction='insert', iteration=self.iteration)
+        [ncmc_new_positions, logP_work, logP_energy] = self.ncmc_engine.integrate(topology_proposal, ncmc_old_positions, direction='insert', iteration=self.iteration, box_vectors=self._get_box_vectors(topology_proposal.new_system))
         if self.verbose: print('NCMC took %.3f s' % (time.time() - initial_time))
         # Check that positions are not NaN
         if np.any(np.isnan(ncmc_new_positions)):
@@ -975,7 +1410,7 @@ class ExpandedEnsembleSampler(object):
         """
         if self.verbose: print("Performing NCMC annihilation")
         # Alchemically eliminate atoms being removed.
-        [ncmc_old_positions, logP_work, logP_energy] = self.ncmc_engine.integrate(topology_proposal, ncmc_old_positions, direction='delete', iteration=self.iteration)
+        [ncmc_old_positions, logP_work, logP_energy] = self.ncmc_engine.integrate(topology_proposal, ncmc_old_positions, direction='delete', iteration=self.iteration, box_vectors=self._get_box_vectors(topology_proposal.old_system))
         # Check that positions are not NaN
         if np.any(np.isnan(ncmc_old_positions)):
             raise Exception("Positions are NaN after NCMC delete with %d steps" % self._switching_nsteps)
@@ -1007,14 +1442,49 @@ class ExpandedEnsembleSampler(object):
         """
         if self.verbose: print("Performing NCMC switching")
         initial_time = time.time()
-        [ncmc_new_positions, ncmc_old_positions, logP_work, logP_energy] = self.ncmc_engine.integrate(topology_proposal, old_positions, new_positions, iteration=self.iteration)
+        [ncmc_new_positions, ncmc_old_positions, logP_work, logP_energy] = self.ncmc_engine.integrate(topology_proposal, old_positions, new_positions, iteration=self.iteration, box_vectors=self._get_box_vectors(topology_proposal.old_system))
         if self.verbose: print('NCMC took %.3f s' % (time.time() - initial_time))
         # Check that positions are not NaN
         if np.any(np.isnan(ncmc_new_positions)):
             raise Exception("Positions are NaN after NCMC insert with %d steps" % self._switching_nsteps)
         return ncmc_new_positions, ncmc_old_positions, logP_work, logP_energy
 
-    def _geometry_ncmc_geometry(self, topology_proposal, positions, old_log_weight, new_log_weight):
+    def _compute_reduced_potential(self, state_key, system, positions):
+        """
+        Compute the reduced potential of a configuration of the given chemical state.
+
+        Energy-evaluation Contexts are kept per chemical state by the energy evaluator, so that equivalent
+        Systems of a revisited chemical state reuse the same Context.
+
+        Parameters
+        ----------
+        state_key : hashable
+            Chemical state key of `system`
+        system : simtk.openmm.System
+            System of the chemical state
+        positions : simtk.unit.Quantity with dimension [natoms, 3] with units of distance.
+            Positions at which to evaluate the potential
+
+        Returns
+        -------
+        reduced_potential : float
+            Reduced potential energy, in kT
+        """
+        potential = self.energy_evaluator.compute_potential(system, positions, box_vectors=self._get_box_vectors(system), key=state_key)
+        return self.sampler.thermodynamic_state.beta * potential
+
+    def _get_box_vectors(self, system):
+        """
+        Return the current periodic box vectors if `system` is periodic, or None.
+
+        The default box vectors of shared Systems are not updated during isobaric simulations,
+        so the box vectors of the current configuration are taken from the sampler state.
+        """
+        if not system.usesPeriodicBoundaryConditions():
+            return None
+        return self.sampler.sampler_state.box_vectors
+
+    def _geometry_ncmc_geometry(self, topology_proposal, positions, old_log_weight, new_log_weight, geometry_proposal=None):
         """
         Use a hybrid NCMC protocol to switch from the old system to new system
         Will calculate new positions for the new system first, then give both
@@ -1032,6 +1502,9 @@ class ExpandedEnsembleSampler(object):
             Chemical state weight from SAMSSampler
         new_log_weight : float
             Chemical state weight from SAMSSampler
+        geometry_proposal : tuple of (simtk.unit.Quantity, float), optional, default=None
+            If specified, the new positions and their log forward probability already drawn by the geometry engine;
+            otherwise they are drawn here
 
         Returns
         -------
@@ -1042,23 +1515,24 @@ class ExpandedEnsembleSampler(object):
         """
         if self.verbose: print("Updating chemical state with geometry-ncmc-geometry scheme...")
 
-        from perses.tests.utils import compute_potential
-
         logP_chemical = topology_proposal.logp_proposal
 
         old_positions = positions
-        initial_reduced_potential = self.sampler.thermodynamic_state.beta * compute_potential(topology_proposal.old_system, old_positions, platform=self.ncmc_engine.platform)
+        initial_reduced_potential = self._compute_reduced_potential(topology_proposal.old_chemical_state_key, topology_proposal.old_system, old_positions)
         logP_initial = -initial_reduced_potential + old_log_weight
 
-        geometry_new_positions, logP_forward = self._geometry_forward(topology_proposal, old_positions)
+        if geometry_proposal is None:
+            geometry_proposal = self._geometry_forward(topology_proposal, old_positions)
+        geometry_new_positions, logP_forward = geometry_proposal
 
         ncmc_new_positions, ncmc_old_positions, logP_work, logP_energy = self._ncmc_hybrid(topology_proposal, old_positions, geometry_new_positions)
 
         new_positions = ncmc_new_positions
 
         logP_reverse = self._geometry_reverse(topology_proposal, ncmc_new_positions, ncmc_old_positions)
+        self._switching_endpoints = (ncmc_old_positions, ncmc_new_positions, logP_reverse)
 
-        final_reduced_potential = self.sampler.thermodynamic_state.beta * compute_potential(topology_proposal.new_system, new_positions, platform=self.ncmc_engine.platform)
+        final_reduced_potential = self._compute_reduced_potential(topology_proposal.new_chemical_state_key, topology_proposal.new_system, new_positions)
         logP_final = -final_reduced_potential + new_log_weight
 
         # Compute total log acceptance probability according to Eq. 46
@@ -1119,8 +1593,7 @@ class ExpandedEnsembleSampler(object):
         initial_time = time.time()
         old_positions = positions
 
-        from perses.tests.utils import compute_potential
-        initial_reduced_potential = self.sampler.thermodynamic_state.beta * compute_potential(topology_proposal.old_system, old_positions, platform=self.ncmc_engine.platform)
+        initial_reduced_potential = self._compute_reduced_potential(topology_proposal.old_chemical_state_key, topology_proposal.old_system, old_positions)
         logP_initial = -initial_reduced_potential + old_log_weight
 
         ncmc_old_positions, logP_delete_work, logP_delete_energy = self._ncmc_delete(topology_proposal, old_positions)
@@ -1133,7 +1606,7 @@ class ExpandedEnsembleSampler(object):
         ncmc_new_positions, logP_insert_work, logP_insert_energy = self._ncmc_insert(topology_proposal, geometry_new_positions)
         new_positions = ncmc_new_positions
 
-        final_reduced_potential = self.sampler.thermodynamic_state.beta * compute_potential(topology_proposal.new_system, new_positions, platform=self.ncmc_engine.platform)
+        final_reduced_potential = self._compute_reduced_potential(topology_proposal.new_chemical_state_key, topology_proposal.new_system, new_positions)
         logP_final = -final_reduced_potential + new_log_weight
 
         elapsed_time = time.time() - initial_time
@@ -1164,87 +1637,709 @@ class ExpandedEnsembleSampler(object):
 
         return logP_accept, new_positions
 
-    def update_positions(self):
-        """
-        Sample new positions.
+    def _instantaneous_log_acceptance(self, topology_proposal, old_positions, new_positions, logP_forward, logP_reverse, old_log_weight, new_log_weight):
         """
-        self.sampler.update()
+        Compute the log acceptance probability of an instantaneous switch between chemical states, without NCMC.
 
-    def update_state(self):
+        This is the cheap first-stage surrogate of delayed acceptance. It uses the reduced potentials of the old
+        positions and of the positions proposed by the geometry engine, computed through the energy evaluator.
+
+        Parameters
+        ----------
+        topology_proposal : TopologyProposal
+            Contains old/new Topology and System objects and atom mappings.
+        old_positions : simtk.unit.Quantity with dimension [natoms, 3] with units of distance.
+            Positions of the old system
+        new_positions : simtk.unit.Quantity with dimension [natoms, 3] with units of distance.
+            Positions of the new system proposed by the geometry engine
+        logP_forward : float
+            Log probability of the geometry proposal of `new_positions` given `old_positions`
+        logP_reverse : float
+            Log probability of the geometry proposal of `old_positions` given `new_positions`
+        old_log_weight : float
+            Chemical state weight from SAMSSampler
+        new_log_weight : float
+            Chemical state weight from SAMSSampler
+
+        Returns
+        -------
+        logP_instantaneous : float
+            Log of the instantaneous acceptance probability
         """
-        Sample the thermodynamic state.
+        from perses.annihilation.ncmc_switching import NaNException
+        initial_reduced_potential = self._compute_reduced_potential(topology_proposal.old_chemical_state_key, topology_proposal.old_system, old_positions)
+        try:
+            final_reduced_potential = self._compute_reduced_potential(topology_proposal.new_chemical_state_key, topology_proposal.new_system, new_positions)
+        except NaNException:
+            return -np.inf
+        logP_final = -final_reduced_potential + new_log_weight
+        logP_initial = -initial_reduced_potential + old_log_weight
+        return logP_final - logP_initial + topology_proposal.logp_proposal + logP_reverse - logP_forward
+
+    def _reverse_surrogate_log_acceptance(self, topology_proposal, old_log_weight, new_log_weight):
         """
+        Compute the first-stage log acceptance probability of the move reversing the last hybrid NCMC switching.
 
-        initial_time = time.time()
+        The reverse move starts from the new positions at the end of NCMC and proposes the old positions at the end of NCMC.
 
-        # Propose new chemical state.
-        if self.verbose: print("Proposing new topology...")
-        [system, topology, positions] = [self.sampler.thermodynamic_state.system, self.topology, self.sampler.sampler_state.positions]
-        topology_proposal = self.proposal_engine.propose(system, topology)
-        if self.verbose: print("Proposed transformation: %s => %s" % (topology_proposal.old_chemical_state_key, topology_proposal.new_chemical_state_key))
+        Parameters
+        ----------
+        topology_proposal : TopologyProposal
+            The forward proposal, after `_geometry_ncmc_geometry` has run for it
+        old_log_weight : float
+            Chemical state weight of the old state from SAMSSampler
+        new_log_weight : float
+            Chemical state weight of the new state from SAMSSampler
 
-        # Determine state keys
-        old_state_key = self.state_key
-        new_state_key = topology_proposal.new_chemical_state_key
+        Returns
+        -------
+        logp_surrogate_reverse : float
+            Log of the instantaneous acceptance probability of the reverse move
+        """
+        (ncmc_old_positions, ncmc_new_positions, logP_reverse) = self._switching_endpoints
+        reverse_proposal = _reverse_topology_proposal(topology_proposal)
+        # Probability of the forward geometry proposal of the final new positions from the final old positions
+        logP_forward = self._geometry_reverse(reverse_proposal, ncmc_old_positions, ncmc_new_positions)
+        return self._instantaneous_log_acceptance(reverse_proposal, ncmc_new_positions, ncmc_old_positions, logP_reverse, logP_forward, new_log_weight, old_log_weight)
 
-        # Determine log weight
-        old_log_weight = self.get_log_weight(old_state_key)
-        new_log_weight = self.get_log_weight(new_state_key)
+    def _multiple_try_log_weight(self, topology_proposal, new_positions, logp_geometry, energy_evaluator):
+        """
+        Compute the log multiple-try weight of a proposal to `new_positions` in the new chemical state of `topology_proposal`.
 
-        if self.scheme == 'ncmc-geometry-ncmc':
-            logp_accept, ncmc_new_positions = self._ncmc_geometry_ncmc(topology_proposal, positions, old_log_weight, new_log_weight)
-        elif self.scheme == 'geometry-ncmc-geometry':
-            logp_accept, ncmc_new_positions = self._geometry_ncmc_geometry(topology_proposal, positions, old_log_weight, new_log_weight)
-        else:
-            raise Exception("Expanded ensemble state proposal scheme '%s' unsupported" % self.scheme)
+        The weight is w(x,y) = pi(y) lambda(x,y) / T(x,y), where pi(y) = exp[-u_b(y) + g_b] is the target probability
+        of the instantaneous proposal, T(x,y) is the product of the chemical and geometry proposal probabilities, and
+        lambda(x,y) = [q(a->b) q(b->a)]^{1/2} is symmetric in the chemical states a and b, as required by multiple-try
+        Metropolis (Liu, Liang and Wong, JASA 95:121, 2000). Candidates that would be rejected outright by their
+        instantaneous energy therefore have small weights.
 
-        # Accept or reject.
-        if np.isnan(logp_accept):
-            accept = False
-            print('logp_accept = NaN')
-        else:
-            accept = ((logp_accept>=0.0) or (np.random.uniform() < np.exp(logp_accept)))
-            if self.accept_everything:
-                print('accept_everything option is turned on; accepting')
-                accept = True
+        Parameters
+        ----------
+        topology_proposal : TopologyProposal
+            The chemical proposal
+        new_positions : simtk.unit.Quantity with dimension [natoms, 3] with units of distance.
+            Positions of the new chemical state
+        logp_geometry : float
+            Log probability of the geometry proposal of `new_positions`
+        energy_evaluator : EnergyEvaluator
+            The energy evaluator used to compute the reduced potential of `new_positions`
 
-        if accept:
-            self.sampler.thermodynamic_state.system = topology_proposal.new_system
-            self.sampler.sampler_state.system = topology_proposal.new_system
-            self.topology = topology_proposal.new_topology
-            self.sampler.sampler_state.positions = ncmc_new_positions
-            self.sampler.topology = self.topology
-            self.state_key = topology_proposal.new_chemical_state_key
-            self.naccepted += 1
-            if self.verbose: print("    accepted")
-        else:
-            self.nrejected += 1
-            if self.verbose: print("    rejected")
+        Returns
+        -------
+        log_weight : float
+            The log multiple-try weight
+        """
+        from perses.annihilation.ncmc_switching import NaNException
+        state_key = topology_proposal.new_chemical_state_key
+        try:
+            potential = energy_evaluator.compute_potential(topology_proposal.new_system, new_positions, box_vectors=self._get_box_vectors(topology_proposal.new_system), key=state_key)
+        except NaNException:
+            return -np.inf
+        reduced_potential = self.sampler.thermodynamic_state.beta * potential
+        return -reduced_potential + self.get_log_weight(state_key) + 0.5 * topology_proposal.logp_proposal - logp_geometry
 
-        if self.storage:
-            self.storage.write_configuration('positions', self.sampler.sampler_state.positions, self.sampler.topology, iteration=self.iteration)
-            self.storage.write_object('state_key', self.state_key, iteration=self.iteration)
-            self.storage.write_object('proposed_state_key', topology_proposal.new_chemical_state_key, iteration=self.iteration)
-            self.storage.write_quantity('naccepted', self.naccepted, iteration=self.iteration)
-            self.storage.write_quantity('nrejected', self.nrejected, iteration=self.iteration)
-            self.storage.write_quantity('logp_accept', logp_accept, iteration=self.iteration)
-            self.storage.write_quantity('logp_topology_proposal', topology_proposal.logp_proposal, iteration=self.iteration)
+    def _get_multiple_try_energy_evaluator(self):
+        """
+        Return the energy evaluator for multiple-try weights in this process, which uses the same platform as worker processes.
+        """
+        if self._multiple_try_energy_evaluator is None:
+            self._multiple_try_energy_evaluator = EnergyEvaluator(platform=_multiple_try_platform())
+        return self._multiple_try_energy_evaluator
 
+    def _draw_multiple_try_candidate(self, system, topology, positions, seed, energy_evaluator):
+        """
+        Draw one multiple-try candidate: a chemical proposal, its geometry proposal and its weight.
 
-        # Update statistics.
-        self.update_statistics()
+        The candidate only depends on `seed`, so that it can be drawn again in another process; the state of the
+        global numpy random number generator is left unchanged.
 
-    def update(self):
+        Parameters
+        ----------
+        system : simtk.openmm.System
+            The System of the chemical state proposals are made from
+        topology : simtk.openmm.app.Topology
+            The Topology of the chemical state proposals are made from
+        positions : simtk.unit.Quantity with dimension [natoms, 3] with units of distance.
+            The positions proposals are made from
+        seed : int
+            Random number seed of the candidate
+        energy_evaluator : EnergyEvaluator
+            The energy evaluator used to compute the weight
+
+        Returns
+        -------
+        candidate : tuple of (TopologyProposal, simtk.unit.Quantity, float, float)
+            The topology proposal, the proposed positions, the log probability of their geometry proposal and the log weight
         """
-        Update the sampler with one step of sampling.
+        random_state = np.random.get_state()
+        np.random.seed(seed)
+        try:
+            topology_proposal = self.proposal_engine.propose(system, topology)
+            new_positions, logp_forward = self.geometry_engine.propose(topology_proposal, positions, self.sampler.thermodynamic_state.beta)
+        finally:
+            np.random.set_state(random_state)
+        log_weight = self._multiple_try_log_weight(topology_proposal, new_positions, logp_forward, energy_evaluator)
+        return (topology_proposal, new_positions, logp_forward, log_weight)
+
+    def _draw_multiple_try_candidates(self, system, topology, positions, ncandidates):
         """
-        if self.verbose:
-            print("-" * 80)
-            print("Expanded Ensemble sampler iteration %8d" % self.iteration)
+        Draw `ncandidates` multiple-try candidates, concurrently in `multiple_try_processes` processes if possible.
+
+        Worker processes are forked, build their proposals on the CPU platform and never use Contexts inherited from
+        this process. They only return the log weights; the candidate that is eventually selected is drawn again in
+        this process from its seed.
+
+        Returns
+        -------
+        seeds : list of int
+            The random number seeds of the candidates
+        candidates : list of tuple
+            Candidates as returned by `_draw_multiple_try_candidate`; candidates drawn in worker processes
+            are (None, None, None, log_weight)
+        """
+        global _multiple_try_task
+        seeds = [int(seed) for seed in np.random.randint(2**31 - 1, size=ncandidates)]
+        nprocesses = self.multiple_try_processes
+        if nprocesses is None:
+            import multiprocessing
+            nprocesses = multiprocessing.cpu_count()
+        nprocesses = max(1, min(nprocesses, ncandidates))
+        if nprocesses > 1:
+            import multiprocessing
+            try:
+                mp = multiprocessing.get_context('fork')
+            except AttributeError:
+                mp = multiprocessing # python 2 always forks on POSIX
+            except ValueError:
+                mp = None # fork is not available on this platform
+            if mp is not None:
+                _multiple_try_task = (self, system, topology, positions)
+                pool = mp.Pool(nprocesses)
+                try:
+                    log_weights = pool.map(_draw_multiple_try_log_weight, seeds)
+                finally:
+                    pool.terminate()
+                    pool.join()
+                    _multiple_try_task = None
+                return seeds, [(None, None, None, log_weight) for log_weight in log_weights]
+        energy_evaluator = self._get_multiple_try_energy_evaluator()
+        candidates = [self._draw_multiple_try_candidate(system, topology, positions, seed, energy_evaluator) for seed in seeds]
+        return seeds, candidates
+
+    def _propose_multiple_try(self, system, topology, positions):
+        """
+        Propose a new chemical state and geometry by multiple-try Metropolis.
+
+        `self.ntries` candidates, each a chemical proposal with a geometry proposal for the new atoms, are drawn
+        concurrently and weighted by the instantaneous reduced potential of their proposed geometry (see
+        `_multiple_try_log_weight`). One is selected with probability proportional to its weight, and NCMC is only
+        run for the selected candidate. `_multiple_try_correction` then completes the acceptance probability.
+
+        Parameters
+        ----------
+        system : simtk.openmm.System
+            The System of the current chemical state
+        topology : simtk.openmm.app.Topology
+            The Topology of the current chemical state
+        positions : simtk.unit.Quantity with dimension [natoms, 3] with units of distance.
+            The current positions
+
+        Returns
+        -------
+        topology_proposal : TopologyProposal
+            The selected proposal
+        geometry_proposal : tuple of (simtk.unit.Quantity, float)
+            The proposed positions of the selected candidate and the log probability of their geometry proposal
+        selected_log_weight : float
+            The log weight of the selected candidate
+        forward_log_weights : np.array of float
+            The log weights of all candidates
+        """
+        seeds, candidates = self._draw_multiple_try_candidates(system, topology, positions, self.ntries)
+        forward_log_weights = np.array([candidate[3] for candidate in candidates])
+        if not np.isfinite(forward_log_weights.max()):
+            raise Exception("All %d multiple-try candidates have vanishing weights" % self.ntries)
+        probabilities = np.exp(forward_log_weights - forward_log_weights.max())
+        probabilities /= probabilities.sum()
+        index = np.random.choice(range(self.ntries), p=probabilities)
+        (topology_proposal, new_positions, logp_forward, selected_log_weight) = candidates[index]
+        if topology_proposal is None:
+            # The candidate was drawn in a worker process; draw it again here from its seed.
+            (topology_proposal, new_positions, logp_forward, log_weight) = self._draw_multiple_try_candidate(system, topology, positions, seeds[index], self._get_multiple_try_energy_evaluator())
+        if self.verbose: print("Multiple-try proposal selected %s with log weight %+10.4e among log weights %s" % (topology_proposal.new_chemical_state_key, selected_log_weight, str(forward_log_weights)))
+        if self.geometry_pdbfile is not None:
+            from simtk.openmm.app import PDBFile
+            PDBFile.writeFile(topology_proposal.new_topology, new_positions, file=self.geometry_pdbfile)
+            self.geometry_pdbfile.flush()
+        return topology_proposal, (new_positions, logp_forward), selected_log_weight, forward_log_weights
+
+    def _multiple_try_correction(self, topology_proposal, selected_log_weight, forward_log_weights):
+        """
+        Compute the multiple-try correction to the log acceptance probability of the selected candidate after NCMC.
+
+        `self.ntries - 1` reference candidates are drawn from the new chemical state and the final NCMC positions,
+        completed by the reverse move to the final NCMC positions of the old state. With W the sums of the forward and
+        reverse weights, the correction is the log ratio of the probabilities of selecting the reverse and forward moves,
+
+        log [w_reverse / W_reverse] - log [w_selected / W_forward]
+
+        Parameters
+        ----------
+        topology_proposal : TopologyProposal
+            The selected proposal, after `_geometry_ncmc_geometry` has run for it
+        selected_log_weight : float
+            The log weight of the selected candidate
+        forward_log_weights : np.array of float
+            The log weights of all candidates
+
+        Returns
+        -------
+        logp_multiple_try : float
+            Correction to the log acceptance probability of the selected proposal
+        """
+        (ncmc_old_positions, ncmc_new_positions, logP_reverse) = self._switching_endpoints
+        seeds, references = self._draw_multiple_try_candidates(topology_proposal.new_system, topology_proposal.new_topology, ncmc_new_positions, self.ntries - 1)
+        reverse_log_weights = [reference[3] for reference in references]
+        # The reverse move proposes the old chemical state, with the inverse chemical proposal ratio, and the old
+        # positions at the end of NCMC, with the geometry probability computed by the reverse geometry calculation.
+        old_state_key = topology_proposal.old_chemical_state_key
+        potential = self._get_multiple_try_energy_evaluator().compute_potential(topology_proposal.old_system, ncmc_old_positions, box_vectors=self._get_box_vectors(topology_proposal.old_system), key=old_state_key)
+        reverse_log_weight = -self.sampler.thermodynamic_state.beta * potential + self.get_log_weight(old_state_key) - 0.5 * topology_proposal.logp_proposal - logP_reverse
+        reverse_log_weights.append(reverse_log_weight)
+        logp_multiple_try = (reverse_log_weight - np.logaddexp.reduce(reverse_log_weights)) - (selected_log_weight - np.logaddexp.reduce(forward_log_weights))
+        if self.verbose: print("logp_multiple_try = %+10.4e [reverse log weights %s]" % (logp_multiple_try, str(reverse_log_weights)))
+        return logp_multiple_try
+
+    def _create_superposition(self, geometry_engine):
+        """
+        Build the hybrid System containing every ligand of the proposal engine and make the
+        MCMC sampler simulate it from now on.
+
+        Parameters
+        ----------
+        geometry_engine : GeometryEngine
+            GeometryEngine used once to place the unique atoms of every ligand
+
+        Returns
+        -------
+        superposition : SuperposedLigandsFactory
+            Factory holding the superposed System, with the current ligand active
+        """
+        if not hasattr(self.proposal_engine, 'enumerate_proposals'):
+            raise Exception("The 'superposition' scheme requires a proposal engine that can enumerate all chemical states, such as SmallMoleculeSetProposalEngine")
+        from perses.annihilation.relative import SuperposedLigandsFactory
+        [system, topology, positions] = [self.sampler.thermodynamic_state.system, self.topology, self.sampler.sampler_state.positions]
+        if self.verbose: print("Building superposed system of all ligands...")
+        topology_proposals = self.proposal_engine.enumerate_proposals(system, topology)
+        new_positions = list()
+        for topology_proposal in topology_proposals:
+            proposed_positions, _ = geometry_engine.propose(topology_proposal, positions, self.sampler.thermodynamic_state.beta)
+            new_positions.append(proposed_positions)
+        superposition = SuperposedLigandsFactory(topology_proposals, positions, new_positions, residue_name=self.proposal_engine.residue_name)
+        superposition.set_ligand(self.state_key)
+
+        self.sampler.thermodynamic_state.system = superposition.system
+        self.sampler.sampler_state.system = superposition.system
+        self.sampler.sampler_state.positions = superposition.positions
+        self.topology = superposition.topology
+        self.sampler.topology = self.topology
+        return superposition
+
+    def _update_superposed_state(self):
+        """
+        Sample the chemical state of the superposed system by NCMC switching on a persistent Context.
+        """
+        old_state_key = self.state_key
+        new_state_key, logp_proposal = self.proposal_engine.propose_state_key(old_state_key)
+        if self.verbose: print("Proposed transformation: %s => %s" % (old_state_key, new_state_key))
+
+        old_log_weight = self.get_log_weight(old_state_key)
+        new_log_weight = self.get_log_weight(new_state_key)
+
+        # The superposed system with one active ligand is the sampled state, so only the NCMC work enters.
+        sampler_state = self.sampler.sampler_state
+        ncmc_new_positions, logP_work = self.ncmc_engine.integrate(old_state_key, new_state_key, sampler_state.positions, box_vectors=sampler_state.box_vectors, iteration=self.iteration)
+        logp_accept = logP_work + new_log_weight - old_log_weight + logp_proposal
+        if self.verbose: print("logp_accept = %+10.4e [logP_work %+10.4e, logP_chemical %+10.4e]" % (logp_accept, logP_work, logp_proposal))
+
+        if np.isnan(logp_accept):
+            accept = False
+            print('logp_accept = NaN')
+        else:
+            accept = ((logp_accept>=0.0) or (np.random.uniform() < np.exp(logp_accept)))
+            if self.accept_everything:
+                print('accept_everything option is turned on; accepting')
+                accept = True
+
+        if accept:
+            self.superposition.set_ligand(new_state_key)
+            # The live MCMC Context still holds the parameters of the previously active ligand.
+            self.sampler.invalidate_context()
+            sampler_state.positions = ncmc_new_positions
+            self.state_key = new_state_key
+            self.naccepted += 1
+            if self.verbose: print("    accepted")
+        else:
+            self.superposition.set_ligand(old_state_key)
+            self.nrejected += 1
+            if self.verbose: print("    rejected")
+        # Make sure the MCMC sampler states refer to the superposed System.
+        self.sampler.thermodynamic_state.system = self.superposition.system
+        sampler_state.system = self.superposition.system
+
+        if self.storage:
+            self.storage.write_configuration('positions', sampler_state.positions, self.sampler.topology, iteration=self.iteration)
+            self.storage.write_object('state_key', self.state_key, iteration=self.iteration)
+            self.storage.write_object('proposed_state_key', new_state_key, iteration=self.iteration)
+            self.storage.write_quantity('naccepted', self.naccepted, iteration=self.iteration)
+            self.storage.write_quantity('nrejected', self.nrejected, iteration=self.iteration)
+            self.storage.write_quantity('logP_ncmc_work', logP_work, iteration=self.iteration)
+            self.storage.write_quantity('logp_accept', logp_accept, iteration=self.iteration)
+            self.storage.write_quantity('logp_topology_proposal', logp_proposal, iteration=self.iteration)
+
+        self.last_transition = (old_state_key, new_state_key, self._acceptance_probability(logp_accept))
+        self.proposal_engine.record_proposal_outcome(*self.last_transition)
+
+        # Update statistics.
+        self.update_statistics()
+
+    def _enter_chemical_state(self, state_key, topology, system, positions, box_vectors=None):
+        """
+        Make the MCMC sampler simulate the given chemical state and configuration.
+
+        Parameters
+        ----------
+        state_key : hashable
+            The chemical state key
+        topology : simtk.openmm.app.Topology
+            The Topology of the chemical state
+        system : simtk.openmm.System
+            The System of the chemical state
+        positions : simtk.unit.Quantity with dimension [natoms, 3] with units of distance
+            The positions
+        box_vectors : 3x3 simtk.unit.Quantity, optional, default=None
+            If specified, the periodic box vectors; otherwise the current box vectors are kept
+        """
+        live_context = None
+        if self.context_cache is not None:
+            # Park the MD Context of the state being left, and resume the one of the state being entered if cached.
+            self.context_cache.put(self.state_key, 'mcmc', self.sampler.detach_context(), self.sampler.sampler_state.system)
+            live_context = self.context_cache.pop(state_key, 'mcmc')
+        self.sampler.thermodynamic_state.system = system
+        self.sampler.sampler_state.system = system
+        self.topology = topology
+        self.sampler.sampler_state.positions = positions
+        if box_vectors is not None:
+            self.sampler.sampler_state.box_vectors = box_vectors
+        self.sampler.topology = self.topology
+        if live_context is not None:
+            self.sampler.attach_context(live_context)
+        self.state_key = state_key
+
+    def get_exchange_energetics(self):
+        """
+        Return the current chemical state with the potential energy and volume of the current configuration, for replica exchange.
+
+        Returns
+        -------
+        energetics : dict
+            'state_key' is the chemical state key, 'potential' the potential energy in kJ/mol, and 'volume'
+            the box volume in nm**3 (or None if the System is not periodic)
+        """
+        sampler_state = self.sampler.sampler_state
+        box_vectors = self._get_box_vectors(sampler_state.system)
+        potential = self.energy_evaluator.compute_potential(sampler_state.system, sampler_state.positions, box_vectors=box_vectors, key=self.state_key)
+        volume = None
+        if box_vectors is not None:
+            volume = thermodynamics.volume(box_vectors) / unit.nanometers**3
+        return { 'state_key' : self.state_key, 'potential' : potential / unit.kilojoules_per_mole, 'volume' : volume }
+
+    def get_configuration(self, include_system=True):
+        """
+        Return the current chemical state and configuration, for exchange with another sampler via `set_configuration`.
+
+        Parameters
+        ----------
+        include_system : bool, optional, default=True
+            If False, the System is omitted; the configuration can then only be set in a sampler in the same chemical state
+
+        Returns
+        -------
+        configuration : dict
+            The chemical state key, Topology, System, positions and box vectors
+        """
+        if self.scheme == 'superposition':
+            raise Exception("Configurations cannot be exchanged with the 'superposition' scheme")
+        sampler_state = self.sampler.sampler_state
+        return {
+            'state_key' : self.state_key,
+            'topology' : self.topology,
+            'system' : sampler_state.system if include_system else None,
+            'positions' : copy.deepcopy(sampler_state.positions),
+            'box_vectors' : copy.deepcopy(sampler_state.box_vectors),
+            }
+
+    def set_configuration(self, configuration):
+        """
+        Replace the current chemical state and configuration by one returned by `get_configuration`.
+
+        Parameters
+        ----------
+        configuration : dict
+            Configuration returned by `get_configuration` of a sampler of the same chemical states
+        """
+        if self.scheme == 'superposition':
+            raise Exception("Configurations cannot be exchanged with the 'superposition' scheme")
+        system = configuration['system']
+        if system is None:
+            if configuration['state_key'] != self.state_key:
+                raise Exception("A configuration without System can only be set in the same chemical state")
+            system = self.sampler.sampler_state.system
+        self._enter_chemical_state(configuration['state_key'], configuration['topology'], system, configuration['positions'], box_vectors=configuration['box_vectors'])
+
+    def _acceptance_probability(self, logp_accept):
+        """
+        Return the probability with which a chemical state move with log acceptance probability `logp_accept` is accepted.
+        """
+        if np.isnan(logp_accept):
+            return 0.0
+        if self.accept_everything:
+            return 1.0
+        return float(np.exp(min(logp_accept, 0.0)))
+
+    def update_positions(self):
+        """
+        Sample new positions.
+
+        If `prefetch_proposals` is True, the next chemical proposal, which only depends on the current chemical state,
+        is built in a worker process that is started before MD and waited for after it, and used by the next chemical
+        state move unless the chemical state has changed by then. The Context is prepared before the worker starts, so
+        that random numbers are drawn in the same order as without prefetching. See `benchmark_proposal_prefetch` in
+        perses.tests.benchmark for a measurement of the time saved.
+        """
+        if self._prefetch_enabled() and (self._take_prefetched_proposal(discard=False) is None):
+            self.sampler._get_context()
+            prefetch = _ProposalPrefetch(self.proposal_engine, self.sampler.thermodynamic_state.system, self.topology)
+            self.sampler.update()
+            self._prefetched_proposal = (self.state_key, self.topology, prefetch.result())
+        else:
+            self.sampler.update()
+
+    def _prefetch_enabled(self):
+        return self.prefetch_proposals and (self.scheme != 'superposition') and (self.ntries == 1)
+
+    def _take_prefetched_proposal(self, discard=True):
+        """
+        Return the prefetched proposal if it was built from the current chemical state, or None.
+
+        The proposal built in the worker process holds copies of the current System and Topology, so it is rebound to
+        the current ones, which are what the chemical state move would have proposed from.
+
+        Parameters
+        ----------
+        discard : bool, optional, default=True
+            If True, the prefetched proposal is discarded, so that it is used at most once
+        """
+        topology_proposal = None
+        if self._prefetched_proposal is not None:
+            (state_key, topology, prefetched_proposal) = self._prefetched_proposal
+            if (state_key == self.state_key) and (topology is self.topology):
+                topology_proposal = prefetched_proposal
+                topology_proposal = copy.copy(topology_proposal)
+                topology_proposal._old_system = self.sampler.thermodynamic_state.system
+                topology_proposal._old_topology = self.topology
+            else:
+                # The chemical state changed since the proposal was built.
+                self._prefetched_proposal = None
+        if discard:
+            self._prefetched_proposal = None
+        return topology_proposal
+
+    def _positions_move(self):
         self.update_positions()
+        return None
+
+    def _state_move(self):
+        naccepted = self.naccepted
         self.update_state()
+        return (self.naccepted > naccepted)
+
+    def _scheduled_moves(self):
+        """
+        Return the names of the moves to run in this iteration, according to `move_schedule` and `move_selection`.
+        """
+        for (move_name, count) in self.move_schedule:
+            if move_name not in self.moves:
+                raise Exception("Unknown move '%s' in move schedule; available moves are %s" % (move_name, str(list(self.moves.keys()))))
+        if self.move_selection == 'ordered':
+            return [move_name for (move_name, count) in self.move_schedule for repetition in range(count)]
+        elif self.move_selection == 'weighted':
+            move_names = [move_name for (move_name, count) in self.move_schedule]
+            counts = np.array([count for (move_name, count) in self.move_schedule], np.float64)
+            selected = np.random.choice(range(len(move_names)), size=int(counts.sum()), p=counts/counts.sum())
+            return [move_names[index] for index in selected]
+        else:
+            raise Exception("move_selection '%s' unknown; must be 'ordered' or 'weighted'" % self.move_selection)
+
+    def run_move(self, move_name):
+        """
+        Run one move, recording its wall clock time and outcome in `move_statistics`.
+
+        Parameters
+        ----------
+        move_name : str
+            Name of the move in `moves`
+        """
+        if move_name not in self.move_statistics:
+            self.move_statistics[move_name] = { 'nattempted' : 0, 'naccepted' : 0, 'time' : 0.0 }
+        statistics = self.move_statistics[move_name]
+        initial_time = time.time()
+        accepted = self.moves[move_name]()
+        statistics['time'] += time.time() - initial_time
+        statistics['nattempted'] += 1
+        if accepted:
+            statistics['naccepted'] += 1
+
+    def update_state(self):
+        """
+        Sample the thermodynamic state.
+        """
+
+        if (self.ntries > 1) and ((self.scheme != 'geometry-ncmc-geometry') or self.delayed_acceptance):
+            # Candidates are weighted by their geometry proposal, which other schemes only make after NCMC deletion.
+            raise Exception("Multiple-try proposals require the 'geometry-ncmc-geometry' scheme and cannot be combined with delayed acceptance")
+        if self.delayed_acceptance and (self.scheme != 'geometry-ncmc-geometry'):
+            # Likewise, the surrogate needs the geometry proposal before NCMC.
+            raise Exception("Delayed acceptance requires the 'geometry-ncmc-geometry' scheme")
+
+        if self.scheme == 'superposition':
+            return self._update_superposed_state()
+
+        initial_time = time.time()
+
+        # Propose new chemical state.
+        if self.verbose: print("Proposing new topology...")
+        [system, topology, positions] = [self.sampler.thermodynamic_state.system, self.topology, self.sampler.sampler_state.positions]
+        geometry_proposal = None
+        if self.ntries > 1:
+            topology_proposal, geometry_proposal, selected_log_weight, forward_log_weights = self._propose_multiple_try(system, topology, positions)
+        else:
+            topology_proposal = self._take_prefetched_proposal()
+            if topology_proposal is None:
+                topology_proposal = self.proposal_engine.propose(system, topology)
+        if self.verbose: print("Proposed transformation: %s => %s" % (topology_proposal.old_chemical_state_key, topology_proposal.new_chemical_state_key))
+
+        # Determine state keys
+        old_state_key = self.state_key
+        new_state_key = topology_proposal.new_chemical_state_key
+
+        # Determine log weight
+        old_log_weight = self.get_log_weight(old_state_key)
+        new_log_weight = self.get_log_weight(new_state_key)
+
+        # With delayed acceptance, screen the proposal by its instantaneous acceptance probability before running NCMC
+        # (Christen and Fox, J Comput Graph Stat 14:795, 2005).
+        surrogate_accept = True
+        logp_accept = None
+        if self.delayed_acceptance:
+            geometry_proposal = self._geometry_forward(topology_proposal, positions)
+            (geometry_new_positions, logP_forward) = geometry_proposal
+            logP_reverse = self._geometry_reverse(topology_proposal, geometry_new_positions, positions)
+            logp_surrogate = self._instantaneous_log_acceptance(topology_proposal, positions, geometry_new_positions, logP_forward, logP_reverse, old_log_weight, new_log_weight)
+            surrogate_accept = ((logp_surrogate>=0.0) or (np.random.uniform() < np.exp(logp_surrogate)))
+            if self.verbose: print("Delayed acceptance: logp_surrogate = %+10.4e, %s" % (logp_surrogate, 'passed' if surrogate_accept else 'rejected'))
+            if self.storage:
+                self.storage.write_quantity('logp_surrogate', logp_surrogate, iteration=self.iteration)
+
+        if not surrogate_accept:
+            # Rejected by the surrogate; skip NCMC entirely
+            accept = False
+            self.nrejected_surrogate += 1
+            # The second-stage acceptance probability was not computed.
+            acceptance_probability = None
+        else:
+            if self.scheme == 'ncmc-geometry-ncmc':
+                logp_accept, ncmc_new_positions = self._ncmc_geometry_ncmc(topology_proposal, positions, old_log_weight, new_log_weight)
+            elif self.scheme == 'geometry-ncmc-geometry':
+                logp_accept, ncmc_new_positions = self._geometry_ncmc_geometry(topology_proposal, positions, old_log_weight, new_log_weight, geometry_proposal=geometry_proposal)
+            else:
+                raise Exception("Expanded ensemble state proposal scheme '%s' unsupported" % self.scheme)
+
+            # Delayed acceptance correction: the second stage multiplies the acceptance ratio by the ratio of the
+            # first-stage acceptance probabilities of the reverse and forward moves.
+            if self.delayed_acceptance:
+                logp_surrogate_reverse = self._reverse_surrogate_log_acceptance(topology_proposal, old_log_weight, new_log_weight)
+                if self.verbose: print("Delayed acceptance: logp_surrogate_reverse = %+10.4e" % logp_surrogate_reverse)
+                logp_accept += min(0.0, logp_surrogate_reverse) - min(0.0, logp_surrogate)
+                if self.storage:
+                    self.storage.write_quantity('logp_surrogate_reverse', logp_surrogate_reverse, iteration=self.iteration)
+            if self.ntries > 1:
+                logp_multiple_try = self._multiple_try_correction(topology_proposal, selected_log_weight, forward_log_weights)
+                logp_accept += logp_multiple_try
+
+            # Accept or reject.
+            if np.isnan(logp_accept):
+                accept = False
+                print('logp_accept = NaN')
+            else:
+                accept = ((logp_accept>=0.0) or (np.random.uniform() < np.exp(logp_accept)))
+                if self.accept_everything:
+                    print('accept_everything option is turned on; accepting')
+                    accept = True
+            acceptance_probability = self._acceptance_probability(logp_accept)
+
+        if accept:
+            self._enter_chemical_state(new_state_key, topology_proposal.new_topology, topology_proposal.new_system, ncmc_new_positions)
+            self.naccepted += 1
+            if self.verbose: print("    accepted")
+        else:
+            self.nrejected += 1
+            if self.verbose: print("    rejected")
+
+        if self.storage:
+            self.storage.write_configuration('positions', self.sampler.sampler_state.positions, self.sampler.topology, iteration=self.iteration)
+            self.storage.write_object('state_key', self.state_key, iteration=self.iteration)
+            self.storage.write_object('proposed_state_key', topology_proposal.new_chemical_state_key, iteration=self.iteration)
+            self.storage.write_quantity('naccepted', self.naccepted, iteration=self.iteration)
+            self.storage.write_quantity('nrejected', self.nrejected, iteration=self.iteration)
+            if self.delayed_acceptance:
+                self.storage.write_quantity('nrejected_surrogate', self.nrejected_surrogate, iteration=self.iteration)
+            if self.ntries > 1:
+                self.storage.write_quantity('logp_multiple_try', logp_multiple_try, iteration=self.iteration)
+            if logp_accept is not None:
+                # Proposals rejected by the surrogate have no second-stage acceptance probability; see 'logp_surrogate'.
+                self.storage.write_quantity('logp_accept', logp_accept, iteration=self.iteration)
+            self.storage.write_quantity('logp_topology_proposal', topology_proposal.logp_proposal, iteration=self.iteration)
+
+        self.last_transition = (old_state_key, new_state_key, acceptance_probability)
+        if acceptance_probability is not None:
+            # Proposals rejected by the surrogate stage have no acceptance probability, and are not reported.
+            self.proposal_engine.record_proposal_outcome(*self.last_transition)
+
+        # Update statistics.
+        self.update_statistics()
+
+    def update(self):
+        """
+        Update the sampler with one iteration of the move schedule.
+
+        By default, an iteration is one MCMC update of the positions followed by one chemical state move.
+        Other schedules are set with `move_schedule`, a list of (move name, count) pairs of moves in `moves`,
+        which are either run in order or, if `move_selection` is 'weighted', drawn at random with probabilities
+        proportional to their counts. Wall clock time and acceptance of each move are tracked in `move_statistics`.
+        """
+        if self.verbose:
+            print("-" * 80)
+            print("Expanded Ensemble sampler iteration %8d" % self.iteration)
+        for move_name in self._scheduled_moves():
+            self.run_move(move_name)
+        # A proposal prefetched but not used in this iteration is not carried over, so that checkpoints need not hold it.
+        self._prefetched_proposal = None
+        if self.storage:
+            self.storage.write_object('move_statistics', self.move_statistics, iteration=self.iteration)
         self.iteration += 1
         if self.verbose:
+            for (move_name, statistics) in self.move_statistics.items():
+                print("%-12s %8d moves, %8d accepted, %10.3f s per move" % (move_name, statistics['nattempted'], statistics['naccepted'], statistics['time'] / statistics['nattempted']))
             print("-" * 80)
 
         if self.pdbfile is not None:
@@ -1268,6 +2363,85 @@ class ExpandedEnsembleSampler(object):
         for iteration in range(niterations):
             self.update()
 
+    def release_contexts(self):
+        """
+        Discard all Contexts held by this sampler and its engines, so that they are recreated on demand.
+
+        This is needed when the sampler is moved to a new process, which cannot use Contexts created by its parent.
+        """
+        self.sampler.invalidate_context()
+        if self.context_cache is not None:
+            self.context_cache.clear()
+        self.energy_evaluator.clear()
+        if self.scheme == 'superposition':
+            self.ncmc_engine.release_context()
+
+    def get_checkpoint_state(self):
+        """
+        Return the state of the sampler, including its MCMC sampler and parked Contexts, for `set_checkpoint_state`.
+
+        Returns
+        -------
+        state : dict
+            Picklable sampler state
+        """
+        state = {
+            'iteration' : self.iteration,
+            'state_key' : self.state_key,
+            'topology' : self.topology,
+            'log_weights' : dict(self.log_weights.items()),
+            'number_of_state_visits' : dict(self.number_of_state_visits.items()),
+            'naccepted' : self.naccepted,
+            'nrejected' : self.nrejected,
+            'nrejected_surrogate' : self.nrejected_surrogate,
+            'last_transition' : self.last_transition,
+            'move_statistics' : copy.deepcopy(self.move_statistics),
+            'sampler' : self.sampler.get_checkpoint_state(),
+            'parked_contexts' : list(),
+            'ncmc_context' : None,
+            'proposal_engine' : self.proposal_engine.get_checkpoint_state(),
+            }
+        if self.context_cache is not None:
+            for (state_key, live_context, system) in self.context_cache.items('mcmc'):
+                state['parked_contexts'].append((state_key, self.sampler._checkpoint_live_context(live_context, include_systems=True)))
+        if self.scheme == 'superposition':
+            state['ncmc_context'] = self.ncmc_engine.get_checkpoint_state()
+        return state
+
+    def set_checkpoint_state(self, state):
+        """
+        Restore the state of the sampler from `get_checkpoint_state`.
+
+        Parameters
+        ----------
+        state : dict
+            Sampler state returned by `get_checkpoint_state`
+        """
+        self.release_contexts()
+        self.iteration = state['iteration']
+        self.state_key = state['state_key']
+        self.topology = state['topology']
+        self.sampler.topology = self.topology
+        self.log_weights = state['log_weights']
+        self.number_of_state_visits.assign(state['number_of_state_visits'])
+        self.naccepted = state['naccepted']
+        self.nrejected = state['nrejected']
+        self.nrejected_surrogate = state['nrejected_surrogate']
+        self.last_transition = state['last_transition']
+        self.move_statistics = copy.deepcopy(state['move_statistics'])
+        self.proposal_engine.set_checkpoint_state(state['proposal_engine'])
+        if self.scheme == 'superposition':
+            # The MCMC sampler simulates the superposed System the NCMC engine switches
+            self.superposition.set_ligand(self.state_key)
+            self.sampler.set_checkpoint_state(state['sampler'], system=self.superposition.system)
+            self.ncmc_engine.set_checkpoint_state(state['ncmc_context'], self.sampler.sampler_state.positions)
+        else:
+            self.sampler.set_checkpoint_state(state['sampler'])
+        if self.context_cache is not None:
+            for (state_key, checkpoint) in state['parked_contexts']:
+                live_context = self.sampler._restore_live_context(checkpoint)
+                self.context_cache.put(state_key, 'mcmc', live_context, live_context[2][1])
+
     def update_statistics(self):
         """
         Update sampler statistics.
@@ -1276,6 +2450,118 @@ class ExpandedEnsembleSampler(object):
             self.number_of_state_visits[self.state_key] = 0
         self.number_of_state_visits[self.state_key] += 1
 
+def _reverse_topology_proposal(topology_proposal):
+    """
+    Return the TopologyProposal of the reverse transformation, from the new chemical state of `topology_proposal` to its old one.
+    """
+    from perses.rjmc.topology_proposal import TopologyProposal
+    return TopologyProposal(new_topology=topology_proposal.old_topology, new_system=topology_proposal.old_system,
+                            old_topology=topology_proposal.new_topology, old_system=topology_proposal.new_system,
+                            logp_proposal=-topology_proposal.logp_proposal, new_to_old_atom_map=topology_proposal.old_to_new_atom_map,
+                            old_chemical_state_key=topology_proposal.new_chemical_state_key, new_chemical_state_key=topology_proposal.old_chemical_state_key,
+                            metadata=topology_proposal.metadata)
+
+_multiple_try_task = None # (sampler, system, topology, positions) of the multiple-try candidates being drawn, inherited by forked workers
+_multiple_try_energy_evaluator = None # energy evaluator of a multiple-try worker process
+
+def _multiple_try_platform():
+    """
+    Return the platform used to compute multiple-try weights, which must be usable in forked processes.
+    """
+    try:
+        return openmm.Platform.getPlatformByName('CPU')
+    except Exception:
+        return openmm.Platform.getPlatformByName('Reference')
+
+def _draw_multiple_try_log_weight(seed):
+    """
+    Draw one multiple-try candidate in a worker process and return its log weight.
+
+    See `ExpandedEnsembleSampler._draw_multiple_try_candidates`.
+    """
+    global _multiple_try_energy_evaluator
+    (exen_sampler, system, topology, positions) = _multiple_try_task
+    if _multiple_try_energy_evaluator is None:
+        _multiple_try_energy_evaluator = EnergyEvaluator(platform=_multiple_try_platform())
+    # Only the parent process writes debug output.
+    exen_sampler.geometry_engine.write_proposal_pdb = False
+    exen_sampler.verbose = False
+    (topology_proposal, new_positions, logp_forward, log_weight) = exen_sampler._draw_multiple_try_candidate(system, topology, positions, seed, _multiple_try_energy_evaluator)
+    return log_weight
+
+def _build_prefetched_proposal(connection, proposal_engine, system, topology):
+    """
+    Main function of a proposal prefetch worker process.
+
+    Sends ('ok', (topology_proposal, random_state)), where random_state is the final state of the numpy random number
+    generator, or ('error', traceback).
+    """
+    import traceback
+    try:
+        topology_proposal = proposal_engine.propose(system, topology)
+        connection.send(('ok', (topology_proposal, np.random.get_state())))
+    except Exception:
+        connection.send(('error', traceback.format_exc()))
+    finally:
+        connection.close()
+
+class _ProposalPrefetch(object):
+    """
+    Build a topology proposal in a worker process.
+
+    The worker is forked from this process, so that it starts from the same proposal engine and state of the numpy
+    random number generator. It only builds Topology and System objects, never uses an OpenMM Context, and does not
+    hold the GIL of this process, so that proposal building overlaps with MD. `result()` installs the final random
+    state of the worker in this process, so that random numbers are drawn as if the proposal had been built here.
+    State the proposal engine caches while building the proposal stays in the worker. If processes cannot be forked,
+    the proposal is built immediately in this process.
+
+    Parameters
+    ----------
+    proposal_engine : ProposalEngine
+        The proposal engine
+    system : simtk.openmm.System
+        The System of the current chemical state
+    topology : simtk.openmm.app.Topology
+        The Topology of the current chemical state
+    """
+    def __init__(self, proposal_engine, system, topology):
+        import multiprocessing
+        self._process = None
+        self._topology_proposal = None
+        try:
+            mp = multiprocessing.get_context('fork')
+        except AttributeError:
+            mp = multiprocessing # python 2 always forks on POSIX
+        except ValueError:
+            # fork is not available on this platform
+            self._topology_proposal = proposal_engine.propose(system, topology)
+            return
+        (self._connection, worker_connection) = mp.Pipe(duplex=False)
+        self._process = mp.Process(target=_build_prefetched_proposal, args=(worker_connection, proposal_engine, system, topology))
+        self._process.daemon = True
+        self._process.start()
+        worker_connection.close()
+
+    def result(self):
+        """
+        Wait for the proposal to be built and return it, raising an exception if the proposal engine failed.
+        """
+        if self._process is None:
+            return self._topology_proposal
+        try:
+            (status, result) = self._connection.recv()
+        except EOFError:
+            (status, result) = ('error', 'worker process exited unexpectedly')
+        finally:
+            self._connection.close()
+            self._process.join()
+        if status == 'error':
+            raise Exception("Proposal prefetch worker failed:\n%s" % result)
+        (topology_proposal, random_state) = result
+        np.random.set_state(random_state)
+        return topology_proposal
+
 ################################################################################
 # SAMS SAMPLER
 ################################################################################
@@ -1288,10 +2574,14 @@ class SAMSSampler(object):
     ----------
     state_keys : set of objects
         The names of states sampled by the sampler.
-    logZ : dict() of keys : float
+    logZ : StateArray of keys : float
         logZ[key] is the log partition function (up to an additive constant) estimate for chemical state `key`
+    state_registry : ChemicalStateRegistry
+        Registry assigning array indices to chemical state keys, shared with the expanded ensemble sampler.
     update_method : str
         Update method.  One of ['default']
+    update_type : str
+        How visits are credited in the logZ update; one of ['binary', 'rao-blackwellized']
     iteration : int
         Iterations completed.
     verbose : bool
@@ -1331,7 +2621,7 @@ class SAMSSampler(object):
     >>> sams_sampler.run() # doctest: +ELLIPSIS
     ...
     """
-    def __init__(self, sampler, logZ=None, log_target_probabilities=None, update_method='two-stage', storage=None, second_stage_start=None):
+    def __init__(self, sampler, logZ=None, log_target_probabilities=None, update_method='two-stage', storage=None, second_stage_start=None, update_type='binary'):
         """
         Create a SAMS Sampler.
 
@@ -1348,52 +2638,457 @@ class SAMSSampler(object):
         storage : NetCDFStorageView, optional, default=None
         second_state_start : int, optional, default None
             At what iteration number to switch to the optimal gain decay
+        update_type : str, optional, default='binary'
+            'binary' credits the visited state only. 'rao-blackwellized' credits the current and proposed states of the
+            last chemical state move with the rejection and acceptance probabilities of the move (Rao-Blackwellization
+            over the accept/reject decision), which lowers the variance of the logZ estimates per NCMC attempt.
+            The chemical proposal probabilities enter through the proposal ratio in the acceptance probability.
 
         """
-        from scipy.misc import logsumexp
         # Keep copies of initializing arguments.
         # TODO: Make deep copies?
         self.sampler = sampler
-        self.chemical_states = None
-        self._reference_state = None
+        self.state_registry = sampler.state_registry
+        chemical_states = None
         try:
-            self.chemical_states = self.sampler.proposal_engine.chemical_state_list
+            chemical_states = self.sampler.proposal_engine.chemical_state_list
         except NotImplementedError:
             logger.warn("The proposal engine has not properly implemented the chemical state property; SAMS will add states on the fly.")
+        self._initialize_estimates(chemical_states, logZ, log_target_probabilities)
+
+        self.update_method = update_method
+        self._set_update_type(update_type)
+
+        self.storage = None
+        if storage is not None:
+            self.storage = NetCDFStorageView(storage, modname=self.__class__.__name__)
+
+        # Initialize.
+        self.iteration = 0
+        self.verbose = False
+
+        self.second_stage_start = 0
+        if second_stage_start is not None:
+            self.second_stage_start = second_stage_start
+
+    def _set_update_type(self, update_type):
+        if update_type not in ['binary', 'rao-blackwellized']:
+            raise Exception("SAMS update type '%s' unknown." % update_type)
+        self.update_type = update_type
 
+    def _initialize_estimates(self, chemical_states, logZ, log_target_probabilities):
+        """
+        Initialize the logZ estimates and log target probabilities.
+
+        Parameters
+        ----------
+        chemical_states : list of str or None
+            The chemical states that can be proposed, or None if they are not known in advance
+        logZ : dict of key : float or None
+            Initial log partition functions, if specified
+        log_target_probabilities : dict of key : float or None
+            Unnormalized log target probabilities, if specified
+        """
+        from scipy.misc import logsumexp
+        self.chemical_states = chemical_states
+        self._reference_state = None
+        self._chemical_state_indices = None
         if self.chemical_states:
             #Select a reference state that will always be subtracted (ensure that dict ordering does not change)
             self._reference_state = self.chemical_states[0]
+            self._chemical_state_indices = self.state_registry.indices(self.chemical_states, add=True)
+
+            #initialize the logZ array with zeroes for each chemical state
+            self.logZ = StateArray.fromkeys(self.state_registry, self.chemical_states, 0.0)
+
+            #Initialize log target probabilities with log(1/n_states)
+            self.log_target_probabilities = StateArray.fromkeys(self.state_registry, self.chemical_states, np.log(len(self.chemical_states)))
+
+            #If initial weights are specified, override any weight with what is provided
+            #However, if the chemical state is not in the reachable chemical state list,throw an exception
+            if logZ is not None:
+                for (chemical_state, logZ_value) in logZ.items():
+                    if chemical_state not in self.chemical_states:
+                        raise ValueError("Provided a logZ initial value for an un-proposable chemical state")
+                    self.logZ[chemical_state] = logZ_value
+
+            if log_target_probabilities is not None:
+                for (chemical_state, log_target_probability) in log_target_probabilities.items():
+                    if chemical_state not in self.chemical_states:
+                        raise ValueError("Provided a log target probability for an un-proposable chemical state.")
+                    self.log_target_probabilities[chemical_state] = log_target_probability
+
+                #normalize target probabilities
+                #this is likely not necessary, but it is copying the algorithm in Ref 1
+                self.log_target_probabilities -= logsumexp(self.log_target_probabilities.values_array())
+        else:
+            self.logZ = StateArray(self.state_registry)
+            self.log_target_probabilities = StateArray(self.state_registry)
+
+    def _write_state_array(self, varname, state_array):
+        """
+        Write a StateArray to storage for the current iteration.
+
+        If the chemical states are known in advance, the values are written as a native array ordered like
+        `self.chemical_states`; otherwise, the set of states can grow and they are written as a dict.
+        """
+        if self._chemical_state_indices is not None:
+            self.storage.write_array(varname, state_array.to_array()[self._chemical_state_indices], iteration=self.iteration)
+        else:
+            self.storage.write_object(varname, dict(state_array.items()), iteration=self.iteration)
+
+    @property
+    def state_keys(self):
+        return self.logZ.keys()
+
+    def update_sampler(self):
+        """
+        Update the underlying expanded ensembles sampler.
+        """
+        self.sampler.update()
+
+    def update_logZ_estimates(self):
+        """
+        Update the logZ estimates according to self.update_method.
+        """
+        state_weights = self._compute_state_weights(self.sampler.state_key, self.sampler.last_transition)
+
+        # Update estimates of logZ.
+        gamma = self._compute_gain()
+
+        #get the (t-1/2) update from equation 9 in ref 1
+        for (state_key, weight) in state_weights.items():
+            self._add_state_key(state_key)
+            self.logZ[state_key] += gamma * weight / np.exp(self.log_target_probabilities[state_key])
+
+        if self._reference_state:
+            #the second step of the (t-1/2 update), subtracting the reference state from everything else.
+            #we can only do this for cases where all states have been enumerated
+            self.logZ -= self.logZ[self._reference_state]
+
+        # Update log weights for sampler.
+        self.sampler.log_weights = - self.logZ
+
+        if self.storage:
+            self._write_state_array('logZ', self.logZ)
+            self._write_state_array('log_weights', self.sampler.log_weights)
+
+    def _compute_state_weights(self, state_key, transition):
+        """
+        Compute the weights with which chemical states are credited in the logZ update.
+
+        Parameters
+        ----------
+        state_key : str
+            The chemical state after the last chemical state move
+        transition : tuple or None
+            (old_state_key, proposed_state_key, acceptance_probability) of the last move, as recorded by the
+            expanded ensemble sampler; the acceptance probability is None if it was not computed
+
+        Returns
+        -------
+        state_weights : dict of str : float
+            state_weights[key] is the weight of chemical state `key`; the weights sum to one
+        """
+        if (self.update_type == 'binary') or (transition is None) or (transition[2] is None):
+            return { state_key : 1.0 }
+        (old_state_key, proposed_state_key, acceptance_probability) = transition
+        if old_state_key == proposed_state_key:
+            return { old_state_key : 1.0 }
+        return { old_state_key : 1.0 - acceptance_probability, proposed_state_key : acceptance_probability }
+
+    def _add_state_key(self, state_key):
+        """
+        Add a state key to the logZ and target probability dictionaries if we haven't visited this state before.
+        """
+        if state_key not in self.logZ:
+            logger.warn("A new state key is being added to the logZ; note that this makes the resultant algorithm different from SAMS")
+            self.logZ[state_key] = 0.0
+        if state_key not in self.log_target_probabilities:
+            logger.warn("A new state key is being added to the target probabilities; note that this makes the resultant algorithm different from SAMS")
+            self.log_target_probabilities[state_key] = 0.0
+
+    def _compute_gain(self):
+        """
+        Compute the gain factor of the current iteration according to self.update_method.
+        """
+        if self.update_method == 'one-stage':
+            # Based on Eq. 9 of Ref. [1]
+            gamma = 1.0 / float(self.iteration+1)
+        elif self.update_method == 'two-stage':
+            # Keep gamma large until second stage is activated.
+            if self.iteration < self.second_stage_start:
+                # First stage.
+                gamma = 1.0
+                # TODO: Determine when to switch to second stage
+            else:
+                # Second stage.
+                gamma = 1.0 / float(self.iteration - self.second_stage_start + 1)
+        else:
+            raise Exception("SAMS update method '%s' unknown." % self.update_method)
+        return gamma
+
+    def update(self):
+        """
+        Update the sampler with one step of sampling.
+        """
+        if self.verbose:
+            print("=" * 80)
+            print("SAMS sampler iteration %5d" % self.iteration)
+        self.update_sampler()
+        self.update_logZ_estimates()
+        if self.storage: self.storage.sync()
+        self.iteration += 1
+        if self.verbose:
+            print("=" * 80)
+
+    def run(self, niterations=1):
+        """
+        Run the sampler for the specified number of iterations
+
+        Parameters
+        ----------
+        niterations : int, optional, default=1
+            Number of iterations to run the sampler for.
+        """
+        for iteration in range(niterations):
+            self.update()
+
+    def get_checkpoint_state(self):
+        """
+        Return the state of the sampler, including its expanded ensemble sampler, for `set_checkpoint_state`.
+
+        Returns
+        -------
+        state : dict
+            Picklable sampler state
+        """
+        return {
+            'iteration' : self.iteration,
+            'logZ' : dict(self.logZ.items()),
+            'log_target_probabilities' : dict(self.log_target_probabilities.items()),
+            'sampler' : self.sampler.get_checkpoint_state(),
+            }
+
+    def set_checkpoint_state(self, state):
+        """
+        Restore the state of the sampler from `get_checkpoint_state`.
+
+        Parameters
+        ----------
+        state : dict
+            Sampler state returned by `get_checkpoint_state`
+        """
+        self.iteration = state['iteration']
+        self.logZ.assign(state['logZ'])
+        self.log_target_probabilities.assign(state['log_target_probabilities'])
+        self.sampler.set_checkpoint_state(state['sampler'])
+
+################################################################################
+# MULTI-WALKER SAMS SAMPLER
+################################################################################
+
+class _SAMSWalker(object):
+    """
+    Walker end of the multi-walker SAMS protocol, driving one ExpandedEnsembleSampler.
+
+    Commands are (command, argument) tuples:
+    'update' : set the log weights to `argument`, run one expanded ensemble iteration, and return the new state key
+               and the last chemical state transition
+    'get_checkpoint_state' : return the state of the walker, including its random number generator
+    'set_checkpoint_state' : restore the walker state `argument` and return the restored state key
+    """
+    def __init__(self, walker_factory, walker_index, seed):
+        np.random.seed(seed)
+        self.sampler = walker_factory(walker_index)
+
+    def describe(self):
+        """
+        Return the initial state key and the chemical states that can be proposed (or None if unknown).
+        """
+        try:
+            chemical_states = self.sampler.proposal_engine.chemical_state_list
+        except NotImplementedError:
+            chemical_states = None
+        return (self.sampler.state_key, chemical_states)
+
+    def handle(self, command, argument):
+        if command == 'update':
+            self.sampler.log_weights = argument
+            self.sampler.update()
+            return (self.sampler.state_key, self.sampler.last_transition)
+        elif command == 'get_checkpoint_state':
+            return { 'sampler' : self.sampler.get_checkpoint_state(), 'random_state' : np.random.get_state() }
+        elif command == 'set_checkpoint_state':
+            self.sampler.set_checkpoint_state(argument['sampler'])
+            np.random.set_state(argument['random_state'])
+            return self.sampler.state_key
+        raise Exception("Unknown multi-walker SAMS command '%s'" % command)
+
+def _run_sams_walker(connection, walker_factory, walker_index, seed):
+    """
+    Main loop of a multi-walker SAMS walker process.
+
+    Replies are ('ready', description), ('ok', result) or ('error', traceback); the loop ends on 'stop' or after an error.
+    """
+    import traceback
+    try:
+        walker = _SAMSWalker(walker_factory, walker_index, seed)
+        connection.send(('ready', walker.describe()))
+        while True:
+            (command, argument) = connection.recv()
+            if command == 'stop':
+                break
+            connection.send(('ok', walker.handle(command, argument)))
+    except Exception:
+        connection.send(('error', traceback.format_exc()))
+    finally:
+        connection.close()
+
+class _InProcessWalkerConnection(object):
+    """
+    Serial stand-in for the Pipe connection to a walker process, running the walker in the calling process.
+
+    Each walker keeps its own numpy random state, so that a serial run reproduces a multiprocessing run with the same seed.
+    """
+    def __init__(self, walker_factory, walker_index, seed):
+        self._walker = None
+        self._random_state = None
+        self._reply = self._call(lambda : self._create_walker(walker_factory, walker_index, seed), 'ready')
+
+    def _create_walker(self, walker_factory, walker_index, seed):
+        self._walker = _SAMSWalker(walker_factory, walker_index, seed)
+        return self._walker.describe()
+
+    def _call(self, function, status):
+        import traceback
+        saved_random_state = np.random.get_state()
+        if self._random_state is not None:
+            np.random.set_state(self._random_state)
+        try:
+            reply = (status, function())
+        except Exception:
+            reply = ('error', traceback.format_exc())
+        finally:
+            self._random_state = np.random.get_state()
+            np.random.set_state(saved_random_state)
+        return reply
+
+    def send(self, message):
+        (command, argument) = message
+        if command == 'stop':
+            self._walker = None
+            return
+        self._reply = self._call(lambda : self._walker.handle(command, argument), 'ok')
+
+    def recv(self):
+        (reply, self._reply) = (self._reply, None)
+        return reply
+
+    def close(self):
+        self._walker = None
+
+class MultiWalkerSAMSSampler(SAMSSampler):
+    """
+    Self-adjusted mixture sampling with several expanded ensemble walkers sharing one set of logZ estimates.
+
+    Each walker is an ExpandedEnsembleSampler for the same environment, created by `walker_factory` in its own process.
+    Every iteration, all walkers run one expanded ensemble update concurrently with the current log weights and report
+    the chemical state they visited. The visits are combined into a single SAMS update of the logZ estimates, in
+    which each walker contributes 1/nwalkers of the gain, and the new log weights are sent to all walkers with the
+    next update.
+
+    Walker k seeds numpy with `seed + k` before it is created, and the visits are applied in walker order, so that
+    runs with the same seed (and a deterministic OpenMM platform, such as Reference) give the same results with either
+    transport.
 
-            #initialize the logZ dictionary with zeroes for each chemical state
-            self.logZ = {chemical_state : 0.0 for chemical_state in self.chemical_states}
+    Properties
+    ----------
+    nwalkers : int
+        The number of walkers.
+    walker_state_keys : list of str
+        walker_state_keys[k] is the chemical state currently occupied by walker k.
+    number_of_state_visits : StateArray of str : int
+        number_of_state_visits[key] is the number of visits of all walkers to chemical state `key`
+    log_weights : StateArray of str : float
+        The log weights sent to the walkers on the next update.
 
-            #Initialize log target probabilities with log(1/n_states)
-            self.log_target_probabilities = {chemical_state : np.log(len(self.chemical_states)) for chemical_state in self.chemical_states}
+    Examples
+    --------
+    The walker factory must be picklable (for example, a module-level function) on platforms that spawn processes.
 
-            #If initial weights are specified, override any weight with what is provided
-            #However, if the chemical state is not in the reachable chemical state list,throw an exception
-            if logZ is not None:
-                for (chemical_state, logZ_value) in logZ:
-                    if chemical_state not in self.chemical_states:
-                        raise ValueError("Provided a logZ initial value for an un-proposable chemical state")
-                    self.logZ[chemical_state] = logZ_value
+    >>> def create_walker(walker_index):
+    ...     from perses.tests.testsystems import AlkanesTestSystem
+    ...     return AlkanesTestSystem().exen_samplers['vacuum']
+    >>> sams_sampler = MultiWalkerSAMSSampler(create_walker, nwalkers=2, seed=0, transport='serial')
+    >>> sams_sampler.run(niterations=2) # doctest: +SKIP
+    >>> sams_sampler.close()
 
-            if log_target_probabilities is not None:
-                for (chemical_state, log_target_probability) in log_target_probabilities:
-                    if chemical_state not in self.chemical_states:
-                        raise ValueError("Provided a log target probability for an un-proposable chemical state.")
-                    self.log_target_probabilities[chemical_state] = log_target_probability
+    """
+    def __init__(self, walker_factory, nwalkers, logZ=None, log_target_probabilities=None, update_method='two-stage', storage=None, second_stage_start=None, seed=0, transport='multiprocessing', update_type='binary'):
+        """
+        Create a multi-walker SAMS sampler, starting one walker per process.
 
-                #normalize target probabilities
-                #this is likely not necessary, but it is copying the algorithm in Ref 1
-                log_sum_target_probabilities = logsumexp((list(self.log_target_probabilities.values())))
-                self.log_target_probabilities = {chemical_state : log_target_probability - log_sum_target_probabilities for chemical_state, log_target_probability in self.log_target_probabilities}
+        Parameters
+        ----------
+        walker_factory : callable
+            walker_factory(walker_index) returns the ExpandedEnsembleSampler of walker `walker_index`; it is called in the walker process
+        nwalkers : int
+            The number of walkers.
+        logZ : dict of key : float, optional, default=None
+            If specified, the log partition functions for each state will be initialized to the specified dictionary.
+        log_target_probabilities : dict of key : float, optional, default=None
+            If specified, unnormalized target probabilities; default is all 0.
+        update_method : str, optional, default='two-stage'
+            SAMS update algorithm
+        storage : NetCDFStorageView, optional, default=None
+        second_stage_start : int, optional, default None
+            At what iteration number to switch to the optimal gain decay
+        seed : int, optional, default=0
+            Walker k seeds numpy with `seed + k`.
+        transport : str, optional, default='multiprocessing'
+            'multiprocessing' runs each walker in a local process connected by a Pipe; 'serial' runs all walkers in this process.
+        update_type : str, optional, default='binary'
+            How walker visits are credited in the logZ update; one of ['binary', 'rao-blackwellized'] (see SAMSSampler)
+
+        """
+        if nwalkers < 1:
+            raise Exception("nwalkers must be at least 1 (got %d)" % nwalkers)
+        self.sampler = None
+        self.nwalkers = nwalkers
+        self.transport = transport
+        self._connections = list()
+        self._processes = list()
+
+        if transport == 'multiprocessing':
+            import multiprocessing
+            for walker_index in range(nwalkers):
+                (connection, walker_connection) = multiprocessing.Pipe()
+                process = multiprocessing.Process(target=_run_sams_walker, args=(walker_connection, walker_factory, walker_index, seed + walker_index))
+                process.daemon = True
+                process.start()
+                walker_connection.close()
+                self._connections.append(connection)
+                self._processes.append(process)
+        elif transport == 'serial':
+            for walker_index in range(nwalkers):
+                self._connections.append(_InProcessWalkerConnection(walker_factory, walker_index, seed + walker_index))
         else:
-            self.logZ = dict()
-            self.log_target_probabilities = dict()
+            raise Exception("Multi-walker SAMS transport '%s' unknown." % transport)
+
+        descriptions = self._receive_all()
+        self.walker_state_keys = [state_key for (state_key, chemical_states) in descriptions]
+        self.walker_transitions = [None for walker_index in range(nwalkers)]
+        chemical_states = descriptions[0][1]
+        if chemical_states is None:
+            logger.warn("The proposal engine has not properly implemented the chemical state property; SAMS will add states on the fly.")
+        self.state_registry = ChemicalStateRegistry(chemical_states)
+        self._initialize_estimates(chemical_states, logZ, log_target_probabilities)
+        self.log_weights = - self.logZ
+        self.number_of_state_visits = StateArray(self.state_registry, dtype=np.int64)
 
         self.update_method = update_method
+        self._set_update_type(update_type)
 
         self.storage = None
         if storage is not None:
@@ -1407,86 +3102,355 @@ class SAMSSampler(object):
         if second_stage_start is not None:
             self.second_stage_start = second_stage_start
 
-    @property
-    def state_keys(self):
-        return self.logZ.keys()
+    def _receive_all(self):
+        """
+        Collect one reply from every walker, in walker order.
+        """
+        results = list()
+        errors = list()
+        for (walker_index, connection) in enumerate(self._connections):
+            try:
+                (status, result) = connection.recv()
+            except EOFError:
+                (status, result) = ('error', 'walker process exited unexpectedly')
+            if status == 'error':
+                errors.append("walker %d:\n%s" % (walker_index, result))
+            results.append(result)
+        if errors:
+            self.close()
+            raise Exception("Multi-walker SAMS walker failed:\n%s" % '\n'.join(errors))
+        return results
 
     def update_sampler(self):
         """
-        Update the underlying expanded ensembles sampler.
+        Run one expanded ensemble update on every walker concurrently, with the current log weights.
         """
-        self.sampler.update()
+        for connection in self._connections:
+            connection.send(('update', self.log_weights))
+        results = self._receive_all()
+        self.walker_state_keys = [state_key for (state_key, transition) in results]
+        self.walker_transitions = [transition for (state_key, transition) in results]
+        if self.verbose:
+            print("Walker chemical states: %s" % str(self.walker_state_keys))
 
     def update_logZ_estimates(self):
         """
-        Update the logZ estimates according to self.update_method.
+        Apply the combined SAMS update of all walker visits to the logZ estimates.
         """
-        state_key = self.sampler.state_key
-
-        # Add state key to dictionaries if we haven't visited this state before.
-        if state_key not in self.logZ:
-            logger.warn("A new state key is being added to the logZ; note that this makes the resultant algorithm different from SAMS")
-            self.logZ[state_key] = 0.0
-        if state_key not in self.log_target_probabilities:
-            logger.warn("A new state key is being added to the target probabilities; note that this makes the resultant algorithm different from SAMS")
-            self.log_target_probabilities[state_key] = 0.0
-
-        # Update estimates of logZ.
-        if self.update_method == 'one-stage':
-            # Based on Eq. 9 of Ref. [1]
-            gamma = 1.0 / float(self.iteration+1)
-        elif self.update_method == 'two-stage':
-            # Keep gamma large until second stage is activated.
-            if self.iteration < self.second_stage_start:
-                # First stage.
-                gamma = 1.0
-                # TODO: Determine when to switch to second stage
-            else:
-                # Second stage.
-                gamma = 1.0 / float(self.iteration - self.second_stage_start + 1)
-        else:
-            raise Exception("SAMS update method '%s' unknown." % self.update_method)
-
-        #get the (t-1/2) update from equation 9 in ref 1
-        self.logZ[state_key] += gamma / np.exp(self.log_target_probabilities[state_key])
+        gamma = self._compute_gain()
+        for (state_key, transition) in zip(self.walker_state_keys, self.walker_transitions):
+            if state_key not in self.number_of_state_visits:
+                self.number_of_state_visits[state_key] = 0
+            self.number_of_state_visits[state_key] += 1
+            # Each walker contributes 1/nwalkers of the (t-1/2) update from equation 9 in ref 1
+            for (credited_state_key, weight) in self._compute_state_weights(state_key, transition).items():
+                self._add_state_key(credited_state_key)
+                self.logZ[credited_state_key] += gamma * weight / (self.nwalkers * np.exp(self.log_target_probabilities[credited_state_key]))
 
         if self._reference_state:
-            #the second step of the (t-1/2 update), subtracting the reference state from everything else.
-            #we can only do this for cases where all states have been enumerated
-            self.logZ = {state_key : logZ_estimate - self.logZ[self._reference_state] for state_key, logZ_estimate in self.logZ.items()}
+            self.logZ -= self.logZ[self._reference_state]
 
-        # Update log weights for sampler.
-        self.sampler.log_weights = { state_key : - self.logZ[state_key] for state_key in self.logZ.keys()}
+        # Log weights are sent to the walkers with the next update.
+        self.log_weights = - self.logZ
 
         if self.storage:
-            self.storage.write_object('logZ', self.logZ, iteration=self.iteration)
-            self.storage.write_object('log_weights', self.sampler.log_weights, iteration=self.iteration)
+            self._write_state_array('logZ', self.logZ)
+            self._write_state_array('log_weights', self.log_weights)
+            self.storage.write_object('walker_state_keys', self.walker_state_keys, iteration=self.iteration)
 
-    def update(self):
+    def get_checkpoint_state(self):
         """
-        Update the sampler with one step of sampling.
+        Return the state of the sampler and of all walkers, for `set_checkpoint_state`.
+
+        Returns
+        -------
+        state : dict
+            Picklable sampler state
         """
-        if self.verbose:
-            print("=" * 80)
-            print("SAMS sampler iteration %5d" % self.iteration)
-        self.update_sampler()
-        self.update_logZ_estimates()
-        if self.storage: self.storage.sync()
-        self.iteration += 1
-        if self.verbose:
-            print("=" * 80)
+        for connection in self._connections:
+            connection.send(('get_checkpoint_state', None))
+        return {
+            'iteration' : self.iteration,
+            'logZ' : dict(self.logZ.items()),
+            'log_target_probabilities' : dict(self.log_target_probabilities.items()),
+            'number_of_state_visits' : dict(self.number_of_state_visits.items()),
+            'walker_transitions' : self.walker_transitions,
+            'walkers' : self._receive_all(),
+            }
 
-    def run(self, niterations=1):
+    def set_checkpoint_state(self, state):
         """
-        Run the sampler for the specified number of iterations
+        Restore the state of the sampler and of all walkers from `get_checkpoint_state`.
 
         Parameters
         ----------
-        niterations : int, optional, default=1
-            Number of iterations to run the sampler for.
+        state : dict
+            Sampler state returned by `get_checkpoint_state`
+        """
+        if len(state['walkers']) != self.nwalkers:
+            raise Exception("Checkpoint has %d walkers, but the sampler has %d" % (len(state['walkers']), self.nwalkers))
+        for (connection, walker_state) in zip(self._connections, state['walkers']):
+            connection.send(('set_checkpoint_state', walker_state))
+        self.walker_state_keys = self._receive_all()
+        self.walker_transitions = state['walker_transitions']
+        self.iteration = state['iteration']
+        self.logZ.assign(state['logZ'])
+        self.log_target_probabilities.assign(state['log_target_probabilities'])
+        self.number_of_state_visits.assign(state['number_of_state_visits'])
+        self.log_weights = - self.logZ
+
+    def close(self):
+        """
+        Stop all walkers.
+        """
+        for connection in self._connections:
+            try:
+                connection.send(('stop', None))
+                connection.close()
+            except (IOError, OSError):
+                pass
+        for process in self._processes:
+            process.join()
+        self._connections = list()
+        self._processes = list()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+################################################################################
+# ENVIRONMENT WORKER PROCESSES
+################################################################################
+
+_FORK_UNSAFE_PLATFORMS = ['CUDA', 'OpenCL'] # platforms that cannot be used in a process forked after they were initialized
+
+def _get_platform_name(platform):
+    """
+    Return the name of `platform`, or of the platform OpenMM uses for new Contexts if `platform` is None.
+    """
+    if platform is not None:
+        return platform.getName()
+    if 'OPENMM_DEFAULT_PLATFORM' in os.environ:
+        return os.environ['OPENMM_DEFAULT_PLATFORM']
+    platforms = [openmm.Platform.getPlatform(index) for index in range(openmm.Platform.getNumPlatforms())]
+    return max(platforms, key=lambda platform : platform.getSpeed()).getName()
+
+class _EnvironmentProcess(object):
+    """
+    Worker process that owns the sampler of one environment and updates it on request.
+
+    The process is forked from the current one, so that it inherits the sampler as constructed; it then discards
+    the inherited OpenMM Contexts and creates its own. CUDA and OpenCL cannot be used in a forked process once the
+    parent has created Contexts on them, which constructing a sampler already does, so samplers whose Contexts use
+    these platforms are refused; only CPU and Reference platforms are supported. The sampler object in this process is kept as a mirror that
+    is synchronized after each update with the quantities exchanged between environments: the current chemical
+    state, the log weights, the logZ estimates (for SAMS samplers) and the iteration counters. Configurations
+    remain in the worker process.
+
+    Parameters
+    ----------
+    sampler : SAMSSampler or ExpandedEnsembleSampler
+        The environment sampler; it must not write to storage, which cannot be shared between processes.
+    """
+    def __init__(self, sampler):
+        import multiprocessing
+        self.sampler = sampler
+        if isinstance(sampler, SAMSSampler):
+            self.exen_sampler = sampler.sampler
+        else:
+            self.exen_sampler = sampler
+        for owner in [sampler, self.exen_sampler, self.exen_sampler.sampler]:
+            if getattr(owner, 'storage', None) is not None:
+                raise Exception("%s writes to storage, which cannot be shared with a worker process" % owner.__class__.__name__)
+        # MCMC Contexts are always created on the default platform, and NCMC Contexts on the engine platform if specified.
+        for platform in [None, self.exen_sampler.ncmc_engine.platform]:
+            platform_name = _get_platform_name(platform)
+            if platform_name in _FORK_UNSAFE_PLATFORMS:
+                raise Exception("Samplers using the %s platform cannot be run in forked worker processes; use parallel=False, or make CPU the default platform (for example with the OPENMM_DEFAULT_PLATFORM environment variable)" % platform_name)
+
+        try:
+            mp = multiprocessing.get_context('fork')
+        except AttributeError:
+            mp = multiprocessing # python 2 always forks on POSIX
+        (self._connection, worker_connection) = mp.Pipe()
+        self._process = mp.Process(target=self._run, args=(worker_connection,))
+        self._process.daemon = True
+        self._process.start()
+        worker_connection.close()
+
+    def _snapshot(self):
+        snapshot = {
+            'state_key' : self.exen_sampler.state_key,
+            'log_weights' : self.exen_sampler.log_weights,
+            'exen_iteration' : self.exen_sampler.iteration,
+            'naccepted' : self.exen_sampler.naccepted,
+            'nrejected' : self.exen_sampler.nrejected,
+            'number_of_state_visits' : self.exen_sampler.number_of_state_visits,
+            'last_transition' : self.exen_sampler.last_transition,
+            }
+        if self.sampler is not self.exen_sampler:
+            snapshot['logZ'] = self.sampler.logZ
+            snapshot['log_target_probabilities'] = self.sampler.log_target_probabilities
+            snapshot['iteration'] = self.sampler.iteration
+        return snapshot
+
+    def _apply(self, snapshot):
+        self.exen_sampler.state_key = snapshot['state_key']
+        self.exen_sampler.log_weights = snapshot['log_weights']
+        self.exen_sampler.iteration = snapshot['exen_iteration']
+        self.exen_sampler.naccepted = snapshot['naccepted']
+        self.exen_sampler.nrejected = snapshot['nrejected']
+        self.exen_sampler.number_of_state_visits.assign(snapshot['number_of_state_visits'])
+        self.exen_sampler.last_transition = snapshot['last_transition']
+        if self.sampler is not self.exen_sampler:
+            self.sampler.logZ.assign(snapshot['logZ'])
+            self.sampler.log_target_probabilities.assign(snapshot['log_target_probabilities'])
+            self.sampler.iteration = snapshot['iteration']
+
+    def _run(self, connection):
+        """
+        Main loop of the worker process.
+        """
+        import traceback
+        try:
+            self._connection.close()
+            self.exen_sampler.release_contexts()
+            while True:
+                (command, argument) = connection.recv()
+                if command == 'stop':
+                    break
+                elif command == 'update':
+                    self.exen_sampler.log_weights = argument
+                    self.sampler.update()
+                    connection.send(('ok', self._snapshot()))
+                elif command == 'get_checkpoint_state':
+                    connection.send(('ok', { 'sampler' : self.sampler.get_checkpoint_state(), 'random_state' : np.random.get_state() }))
+                elif command == 'set_checkpoint_state':
+                    self.sampler.set_checkpoint_state(argument['sampler'])
+                    if 'random_state' in argument:
+                        np.random.set_state(argument['random_state'])
+                    connection.send(('ok', self._snapshot()))
+                elif command == 'get_exchange_energetics':
+                    connection.send(('ok', self.exen_sampler.get_exchange_energetics()))
+                elif command == 'get_configuration':
+                    configuration = self.exen_sampler.get_configuration(include_system=argument)
+                    if configuration['system'] is not None:
+                        configuration['system'] = openmm.XmlSerializer.serialize(configuration['system'])
+                    connection.send(('ok', configuration))
+                elif command == 'set_configuration':
+                    if argument['system'] is not None:
+                        argument['system'] = openmm.XmlSerializer.deserialize(argument['system'])
+                    self.exen_sampler.set_configuration(argument)
+                    connection.send(('ok', self._snapshot()))
+                else:
+                    raise Exception("Unknown environment worker command '%s'" % command)
+        except Exception:
+            connection.send(('error', traceback.format_exc()))
+        finally:
+            connection.close()
+
+    def start_update(self):
+        """
+        Start one update of the worker's sampler with the current log weights of the mirror.
+        """
+        self._connection.send(('update', self.exen_sampler.log_weights))
+
+    def _receive(self):
+        try:
+            (status, result) = self._connection.recv()
+        except EOFError:
+            (status, result) = ('error', 'worker process exited unexpectedly')
+        if status == 'error':
+            raise Exception("%s worker failed:\n%s" % (self.sampler.__class__.__name__, result))
+        return result
+
+    def finish_update(self):
         """
-        for iteration in range(niterations):
-            self.update()
+        Wait for the update started by `start_update` to complete and synchronize the mirror.
+        """
+        self._apply(self._receive())
+
+    def start_command(self, command, argument=None):
+        """
+        Send a command that returns a result to the worker, without waiting for the result.
+        """
+        self._connection.send((command, argument))
+
+    def finish_command(self):
+        """
+        Wait for the result of the command sent by `start_command`.
+        """
+        return self._receive()
+
+    def set_configuration(self, configuration):
+        """
+        Replace the configuration of the worker's sampler, with its System serialized if present, and synchronize the mirror.
+        """
+        self._connection.send(('set_configuration', configuration))
+        self._apply(self._receive())
+
+    def get_checkpoint_state(self):
+        """
+        Return the state of the worker's sampler, including its random number generator.
+        """
+        self._connection.send(('get_checkpoint_state', None))
+        return self._receive()
+
+    def set_checkpoint_state(self, state):
+        """
+        Restore the state of the worker's sampler and synchronize the mirror.
+        """
+        self._connection.send(('set_checkpoint_state', state))
+        self._apply(self._receive())
+
+    def close(self):
+        """
+        Stop the worker process.
+        """
+        try:
+            self._connection.send(('stop', None))
+            self._connection.close()
+        except (IOError, OSError):
+            pass
+        self._process.join()
+
+def _get_environment_checkpoint_states(samplers, processes):
+    """
+    Return the checkpoint states of environment samplers, from their worker processes if they run in parallel.
+    """
+    if processes is not None:
+        return [process.get_checkpoint_state() for process in processes]
+    return [{ 'sampler' : sampler.get_checkpoint_state() } for sampler in samplers]
+
+def _set_environment_checkpoint_states(samplers, processes, states):
+    """
+    Restore the checkpoint states of environment samplers, in their worker processes if they run in parallel.
+    """
+    if len(states) != len(samplers):
+        raise Exception("Checkpoint has %d samplers, but there are %d" % (len(states), len(samplers)))
+    if processes is not None:
+        for (process, state) in zip(processes, states):
+            process.set_checkpoint_state(state)
+    else:
+        for (sampler, state) in zip(samplers, states):
+            sampler.set_checkpoint_state(state['sampler'])
+
+def _update_environments(processes):
+    """
+    Update the samplers of all environment worker processes concurrently.
+    """
+    for process in processes:
+        process.start_update()
+    errors = list()
+    for process in processes:
+        try:
+            process.finish_update()
+        except Exception as e:
+            errors.append(str(e))
+    if errors:
+        raise Exception('\n'.join(errors))
 
 ################################################################################
 # MULTITARGET OPTIMIZATION SAMPLER
@@ -1503,13 +3467,13 @@ class MultiTargetDesign(object):
         The SAMS samplers whose relative partition functions go into the design objective computation.
     sampler_exponents : dict of SAMSSampler : float
         samplers.keys() are the samplers, and samplers[key]
-    log_target_probabilities : dict of hashable object : float
+    log_target_probabilities : StateArray of hashable object : float
         log_target_probabilities[key] is the computed log objective function (target probability) for chemical state `key`
     verbose : bool
         If True, verbose output is printed.
 
     """
-    def __init__(self, target_samplers, storage=None, verbose=False):
+    def __init__(self, target_samplers, storage=None, verbose=False, parallel=False):
         """
         Initialize a multi-objective design sampler with the specified target sampler powers.
 
@@ -1521,6 +3485,10 @@ class MultiTargetDesign(object):
             If specified, will use the storage layer to write trajectory data.
         verbose : bool, optional, default=False
             If true, will print verbose output
+        parallel : bool, optional, default=False
+            If True, each target sampler is updated concurrently in its own worker process, which owns its Contexts;
+            only logZ estimates, log weights and chemical states are synchronized with this process after each update.
+            Call `close()` to stop the workers. Worker processes are forked, so only CPU and Reference platforms are supported.
 
         The target sampler weights for N samplers with specified exponents \alpha_n are given by
 
@@ -1548,11 +3516,16 @@ class MultiTargetDesign(object):
         if storage is not None:
             self.storage = NetCDFStorageView(storage, modname=self.__class__.__name__)
 
-        # Initialize storage for target probabilities.
-        self.log_target_probabilities = dict()
+        # Initialize storage for target probabilities, indexed like the logZ estimates of the first sampler.
+        self.state_registry = self.samplers[0].state_registry
+        self.log_target_probabilities = StateArray(self.state_registry)
         self.verbose = verbose
         self.iteration = 0
 
+        self._processes = None
+        if parallel:
+            self._processes = [_EnvironmentProcess(sampler) for sampler in self.samplers]
+
     @property
     def state_keys(self):
         return self.log_target_probabilities.keys()
@@ -1561,29 +3534,60 @@ class MultiTargetDesign(object):
         """
         Update all samplers.
         """
+        if self._processes is not None:
+            _update_environments(self._processes)
+            return
         for sampler in self.samplers:
             sampler.update()
 
+    def close(self):
+        """
+        Stop the worker processes, if samplers are updated in parallel.
+        """
+        if self._processes is not None:
+            for process in self._processes:
+                process.close()
+            self._processes = None
+
+    def get_checkpoint_state(self):
+        """
+        Return the state of the design sampler and of all target samplers, for `set_checkpoint_state`.
+
+        Returns
+        -------
+        state : dict
+            Picklable sampler state
+        """
+        return {
+            'iteration' : self.iteration,
+            'log_target_probabilities' : dict(self.log_target_probabilities.items()),
+            'samplers' : _get_environment_checkpoint_states(self.samplers, self._processes),
+            }
+
+    def set_checkpoint_state(self, state):
+        """
+        Restore the state of the design sampler and of all target samplers from `get_checkpoint_state`.
+
+        Parameters
+        ----------
+        state : dict
+            Sampler state returned by `get_checkpoint_state`
+        """
+        _set_environment_checkpoint_states(self.samplers, self._processes, state['samplers'])
+        self.iteration = state['iteration']
+        self.log_target_probabilities.assign(state['log_target_probabilities'])
+
     def update_target_probabilities(self):
         """
         Update all target probabilities.
         """
-        # Gather list of all keys.
-        state_keys = set()
-        for sampler in self.samplers:
-            for key in sampler.state_keys:
-                state_keys.add(key)
-
-        # Compute unnormalized log target probabilities.
-        log_target_probabilities = { key : 0.0 for key in state_keys }
+        # Compute unnormalized log target probabilities over the union of all keys.
+        log_target_probabilities = StateArray(self.state_registry)
         for (sampler, log_weight) in self.sampler_exponents.items():
-            for key in sampler.state_keys:
-                log_target_probabilities[key] += log_weight * sampler.logZ[key]
+            log_target_probabilities.add_scaled(sampler.logZ, log_weight)
 
         # Normalize
-        log_sum = log_sum_exp(log_target_probabilities)
-        for key in log_target_probabilities:
-            log_target_probabilities[key] -= log_sum
+        log_target_probabilities -= log_sum_exp(log_target_probabilities)
 
         # Store.
         self.log_target_probabilities = log_target_probabilities
@@ -1592,7 +3596,7 @@ class MultiTargetDesign(object):
             print("log_target_probabilities = %s" % str(self.log_target_probabilities))
 
         if self.storage:
-            self.storage.write_object('log_target_probabilities', self.log_target_probabilities, iteration=self.iteration)
+            self.storage.write_object('log_target_probabilities', dict(self.log_target_probabilities.items()), iteration=self.iteration)
 
     def update(self):
         """
@@ -1642,7 +3646,7 @@ class ProtonationStateSampler(object):
         If True, verbose output is printed.
 
     """
-    def __init__(self, complex_sampler, solvent_sampler, log_state_penalties, storage=None, verbose=False):
+    def __init__(self, complex_sampler, solvent_sampler, log_state_penalties, storage=None, verbose=False, parallel=False):
         """
         Initialize a protonation state sampler with fixed target probabilities for ligand in solvent.
 
@@ -1658,6 +3662,10 @@ class ProtonationStateSampler(object):
             If specified, will use the storage layer to write trajectory data.
         verbose : bool, optional, default=False
             If true, will print verbose output
+        parallel : bool, optional, default=False
+            If True, the complex and solvent samplers are updated concurrently in their own worker processes, which own
+            their Contexts; only logZ estimates, log weights and chemical states are synchronized with this process
+            after each update. Call `close()` to stop the workers. Worker processes are forked, so only CPU and Reference platforms are supported.
 
         """
         # Store target samplers.
@@ -1675,6 +3683,10 @@ class ProtonationStateSampler(object):
         self.verbose = verbose
         self.iteration = 0
 
+        self._processes = None
+        if parallel:
+            self._processes = [_EnvironmentProcess(sampler) for sampler in self.samplers]
+
     @property
     def state_keys(self):
         return self.log_target_probabilities.keys()
@@ -1683,9 +3695,37 @@ class ProtonationStateSampler(object):
         """
         Update all samplers.
         """
+        if self._processes is not None:
+            _update_environments(self._processes)
+            return
         for sampler in self.samplers:
             sampler.update()
 
+    def close(self):
+        """
+        Stop the worker processes, if samplers are updated in parallel.
+        """
+        if self._processes is not None:
+            for process in self._processes:
+                process.close()
+            self._processes = None
+
+    def get_checkpoint_state(self):
+        """
+        Return the state of the sampler and of the complex and solvent samplers, for `set_checkpoint_state`.
+        """
+        return {
+            'iteration' : self.iteration,
+            'samplers' : _get_environment_checkpoint_states(self.samplers, self._processes),
+            }
+
+    def set_checkpoint_state(self, state):
+        """
+        Restore the state of the sampler and of the complex and solvent samplers from `get_checkpoint_state`.
+        """
+        _set_environment_checkpoint_states(self.samplers, self._processes, state['samplers'])
+        self.iteration = state['iteration']
+
     def update_target_probabilities(self):
         """
         Update all target probabilities.
@@ -1724,3 +3764,237 @@ class ProtonationStateSampler(object):
         # Update all samplers.
         for iteration in range(niterations):
             self.update()
+
+################################################################################
+# REPLICA EXCHANGE SAMPLER
+################################################################################
+
+class ReplicaExchangeSampler(object):
+    """
+    Replica exchange among expanded ensemble samplers of the same chemical states.
+
+    Each replica is an ExpandedEnsembleSampler, or a SAMSSampler driving one, with its own thermodynamic state
+    (typically a temperature ladder) and log weights (e.g. scaled copies of those of the replica of interest).
+    After every `exchange_interval` iterations, swaps of configuration and chemical state are attempted between
+    neighboring replicas, alternating between even and odd pairs. A swap of configurations X_i and X_j between
+    replicas i and j is accepted with probability
+
+    min(1, exp[u_i(X_i) + u_j(X_j) - u_i(X_j) - u_j(X_i)])
+
+    where u_k(X) = beta_k [U(X) + p_k V(X)] - g_k(c(X)) is the reduced potential of configuration X, with chemical
+    state c(X), in replica k with inverse temperature beta_k, pressure p_k and log weights g_k. Since the potential
+    energy of a configuration does not depend on the replica, it is computed once per replica and exchange, and the
+    reduced potentials of all configurations in all replicas are computed from it.
+
+    Swapping configurations rather than thermodynamic states keeps each replica's integrators and NCMC engines at
+    their own temperature. The 'superposition' scheme is not supported.
+
+    Parameters
+    ----------
+    samplers : list of ExpandedEnsembleSampler or SAMSSampler
+        The replicas, ordered so that neighbors have overlapping distributions (e.g. by increasing temperature)
+    exchange_interval : int, optional, default=1
+        Number of iterations between exchange attempts
+    storage : NetCDFStorage, optional, default=None
+        If specified, will use the storage layer to write trajectory data.
+    verbose : bool, optional, default=False
+        If true, will print verbose output
+    parallel : bool, optional, default=False
+        If True, each replica is updated concurrently in its own worker process, which owns its Contexts;
+        configurations are only transferred between processes for accepted swaps. Call `close()` to stop the workers.
+        Worker processes are forked, so only CPU and Reference platforms are supported.
+
+    Attributes
+    ----------
+    nattempted : np.array of int64
+        nattempted[i] is the number of swaps attempted between replicas i and i+1
+    naccepted : np.array of int64
+        naccepted[i] is the number of swaps accepted between replicas i and i+1
+
+    """
+    def __init__(self, samplers, exchange_interval=1, storage=None, verbose=False, parallel=False):
+        if len(samplers) < 2:
+            raise Exception("Replica exchange requires at least two replicas")
+        self.samplers = list(samplers)
+        self._exen_samplers = [sampler.sampler if isinstance(sampler, SAMSSampler) else sampler for sampler in self.samplers]
+        for exen_sampler in self._exen_samplers:
+            if exen_sampler.scheme == 'superposition':
+                raise Exception("Replica exchange does not support the 'superposition' scheme")
+        self.exchange_interval = exchange_interval
+
+        self.storage = None
+        if storage is not None:
+            self.storage = NetCDFStorageView(storage, modname=self.__class__.__name__)
+
+        self.verbose = verbose
+        self.iteration = 0
+        self.nexchanges = 0 # number of exchange rounds, which determines whether even or odd pairs are attempted
+        self.nattempted = np.zeros([len(self.samplers) - 1], np.int64)
+        self.naccepted = np.zeros([len(self.samplers) - 1], np.int64)
+
+        self._processes = None
+        if parallel:
+            self._processes = [_EnvironmentProcess(sampler) for sampler in self.samplers]
+
+    @property
+    def state_keys(self):
+        """The current chemical state key of each replica."""
+        return [exen_sampler.state_key for exen_sampler in self._exen_samplers]
+
+    def update_samplers(self):
+        """
+        Update all replicas.
+        """
+        if self._processes is not None:
+            _update_environments(self._processes)
+            return
+        for sampler in self.samplers:
+            sampler.update()
+
+    def close(self):
+        """
+        Stop the worker processes, if replicas are updated in parallel.
+        """
+        if self._processes is not None:
+            for process in self._processes:
+                process.close()
+            self._processes = None
+
+    def _get_exchange_energetics(self):
+        if self._processes is not None:
+            for process in self._processes:
+                process.start_command('get_exchange_energetics')
+            return [process.finish_command() for process in self._processes]
+        return [exen_sampler.get_exchange_energetics() for exen_sampler in self._exen_samplers]
+
+    def _get_configuration(self, index, include_system):
+        if self._processes is not None:
+            self._processes[index].start_command('get_configuration', include_system)
+            return self._processes[index].finish_command()
+        return self._exen_samplers[index].get_configuration(include_system=include_system)
+
+    def _set_configuration(self, index, configuration):
+        if self._processes is not None:
+            self._processes[index].set_configuration(configuration)
+        else:
+            self._exen_samplers[index].set_configuration(configuration)
+
+    def _compute_reduced_potentials(self, energetics):
+        """
+        Compute the reduced potential of the configuration of each replica in every replica.
+
+        Parameters
+        ----------
+        energetics : list of dict
+            energetics[l] is returned by `ExpandedEnsembleSampler.get_exchange_energetics()` for replica l
+
+        Returns
+        -------
+        u_kl : np.array of shape [nreplicas, nreplicas]
+            u_kl[k,l] is the reduced potential of the configuration of replica l in replica k
+        """
+        nreplicas = len(self.samplers)
+        potentials = np.array([item['potential'] for item in energetics], np.float64)
+        volumes = np.array([np.nan if item['volume'] is None else item['volume'] for item in energetics], np.float64)
+        betas = np.zeros([nreplicas], np.float64)
+        pressure_volume_factors = np.zeros([nreplicas], np.float64) # p_k in kJ/mol/nm**3
+        log_weights = np.zeros([nreplicas, nreplicas], np.float64)
+        for (k, exen_sampler) in enumerate(self._exen_samplers):
+            thermodynamic_state = exen_sampler.sampler.thermodynamic_state
+            betas[k] = 1.0 / (kB * thermodynamic_state.temperature).value_in_unit(unit.kilojoules_per_mole)
+            if thermodynamic_state.pressure is not None:
+                pressure_volume_factors[k] = (thermodynamic_state.pressure * unit.nanometers**3 * unit.AVOGADRO_CONSTANT_NA).value_in_unit(unit.kilojoules_per_mole)
+            log_weights[k, :] = [exen_sampler.log_weights.get(item['state_key'], 0.0) for item in energetics]
+        if np.any(pressure_volume_factors != 0.0) and np.any(np.isnan(volumes)):
+            raise Exception("Replicas at constant pressure require periodic Systems")
+        pressure_volume = pressure_volume_factors[:, np.newaxis] * np.nan_to_num(volumes)[np.newaxis, :]
+        return betas[:, np.newaxis] * (potentials[np.newaxis, :] + pressure_volume) - log_weights
+
+    def exchange_replicas(self):
+        """
+        Attempt swaps of configuration and chemical state between neighboring replicas.
+        """
+        energetics = self._get_exchange_energetics()
+        u_kl = self._compute_reduced_potentials(energetics)
+        for i in range(self.nexchanges % 2, len(self.samplers) - 1, 2):
+            j = i + 1
+            logp_accept = (u_kl[i, i] + u_kl[j, j]) - (u_kl[i, j] + u_kl[j, i])
+            self.nattempted[i] += 1
+            if np.isnan(logp_accept) or not ((logp_accept >= 0.0) or (np.random.uniform() < np.exp(logp_accept))):
+                continue
+            # Systems are only transferred if the replicas are in different chemical states.
+            include_system = (energetics[i]['state_key'] != energetics[j]['state_key'])
+            configuration_i = self._get_configuration(i, include_system)
+            configuration_j = self._get_configuration(j, include_system)
+            self._set_configuration(i, configuration_j)
+            self._set_configuration(j, configuration_i)
+            self.naccepted[i] += 1
+            if self.verbose: print("Swapped replicas %d (%s) and %d (%s)" % (i, energetics[i]['state_key'], j, energetics[j]['state_key']))
+        self.nexchanges += 1
+
+        if self.verbose:
+            print("Replica state keys: %s" % str(self.state_keys))
+        if self.storage:
+            self.storage.write_object('state_keys', self.state_keys, iteration=self.iteration)
+            self.storage.write_array('nattempted', self.nattempted, iteration=self.iteration)
+            self.storage.write_array('naccepted', self.naccepted, iteration=self.iteration)
+
+    def get_checkpoint_state(self):
+        """
+        Return the state of the replica exchange sampler and of all replicas, for `set_checkpoint_state`.
+
+        Returns
+        -------
+        state : dict
+            Picklable sampler state
+        """
+        return {
+            'iteration' : self.iteration,
+            'nexchanges' : self.nexchanges,
+            'nattempted' : self.nattempted.copy(),
+            'naccepted' : self.naccepted.copy(),
+            'samplers' : _get_environment_checkpoint_states(self.samplers, self._processes),
+            }
+
+    def set_checkpoint_state(self, state):
+        """
+        Restore the state of the replica exchange sampler and of all replicas from `get_checkpoint_state`.
+
+        Parameters
+        ----------
+        state : dict
+            Sampler state returned by `get_checkpoint_state`
+        """
+        _set_environment_checkpoint_states(self.samplers, self._processes, state['samplers'])
+        self.iteration = state['iteration']
+        self.nexchanges = state['nexchanges']
+        self.nattempted = state['nattempted'].copy()
+        self.naccepted = state['naccepted'].copy()
+
+    def update(self):
+        """
+        Run one iteration of the sampler.
+        """
+        if self.verbose:
+            print("*" * 80)
+            print("ReplicaExchangeSampler iteration %8d" % self.iteration)
+        self.update_samplers()
+        self.iteration += 1
+        if self.iteration % self.exchange_interval == 0:
+            self.exchange_replicas()
+        if self.storage: self.storage.sync()
+        if self.verbose:
+            print("*" * 80)
+
+    def run(self, niterations=1):
+        """
+        Run the replica exchange sampler for the specified number of iterations.
+
+        Parameters
+        ----------
+        niterations : int
+            The number of iterations to run the sampler for.
+
+        """
+        for iteration in range(niterations):
+            self.update()
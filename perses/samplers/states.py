@@ -0,0 +1,307 @@
+"""
+Array-backed containers for quantities indexed by chemical state.
+
+Provided classes include:
+
+* ChemicalStateRegistry - assigns consecutive integer indices to chemical state keys (e.g. SMILES strings)
+* StateArray - dict-compatible mapping from chemical state keys to numbers, stored in a numpy array indexed by a registry
+
+Samplers that share a registry can combine their StateArrays with vectorized operations instead of
+per-key dictionary manipulation.
+
+"""
+
+################################################################################
+# IMPORTS
+################################################################################
+
+import numpy as np
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+
+################################################################################
+# CHEMICAL STATE REGISTRY
+################################################################################
+
+class ChemicalStateRegistry(object):
+    """
+    Registry that assigns consecutive integer indices to chemical state keys.
+
+    Indices are assigned in order of registration and never change, so that arrays indexed by the
+    registry only need to grow when new states are registered.
+
+    Parameters
+    ----------
+    state_keys : list of hashable objects, optional, default=None
+        Chemical state keys to register initially, in order.
+
+    Examples
+    --------
+    >>> registry = ChemicalStateRegistry(['CC', 'CCC'])
+    >>> registry.add('CCCC')
+    2
+    >>> registry.index('CCC')
+    1
+
+    """
+    def __init__(self, state_keys=None):
+        self._keys = list()
+        self._indices = dict()
+        if state_keys is not None:
+            for state_key in state_keys:
+                self.add(state_key)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, state_key):
+        return state_key in self._indices
+
+    @property
+    def keys(self):
+        """The registered chemical state keys, in order of their indices."""
+        return list(self._keys)
+
+    def key(self, index):
+        """Return the chemical state key with the given index."""
+        return self._keys[index]
+
+    def add(self, state_key):
+        """
+        Register a chemical state key if it is not registered yet.
+
+        Parameters
+        ----------
+        state_key : hashable object
+            The chemical state key
+
+        Returns
+        -------
+        index : int
+            The index of the chemical state
+        """
+        index = self._indices.get(state_key)
+        if index is None:
+            index = len(self._keys)
+            self._keys.append(state_key)
+            self._indices[state_key] = index
+        return index
+
+    def index(self, state_key):
+        """
+        Return the index of a registered chemical state key, raising KeyError if it is not registered.
+        """
+        return self._indices[state_key]
+
+    def indices(self, state_keys, add=False):
+        """
+        Return the indices of several chemical state keys.
+
+        Parameters
+        ----------
+        state_keys : iterable of hashable objects
+            The chemical state keys
+        add : bool, optional, default=False
+            If True, keys that are not registered yet are registered; otherwise they raise KeyError
+
+        Returns
+        -------
+        indices : np.array of int64
+            The indices of the chemical states
+        """
+        if add:
+            return np.array([self.add(state_key) for state_key in state_keys], np.int64)
+        return np.array([self._indices[state_key] for state_key in state_keys], np.int64)
+
+################################################################################
+# STATE ARRAY
+################################################################################
+
+class StateArray(MutableMapping):
+    """
+    Dict-compatible mapping from chemical state keys to numbers, backed by a numpy array indexed by a ChemicalStateRegistry.
+
+    A StateArray holds values for a subset of the registered states; setting the value of an unregistered key
+    registers it. In addition to the mapping interface, in-place arithmetic with scalars and with StateArrays
+    of the same registry is vectorized.
+
+    Parameters
+    ----------
+    registry : ChemicalStateRegistry
+        The registry that assigns indices to chemical state keys.
+    values : mapping of hashable object : number, optional, default=None
+        Initial values.
+    dtype : numpy dtype, optional, default=np.float64
+        The type of the values.
+
+    Examples
+    --------
+    >>> registry = ChemicalStateRegistry(['CC', 'CCC'])
+    >>> logZ = StateArray(registry, {'CC' : 1.0, 'CCC' : 3.0})
+    >>> logZ -= logZ['CC']
+    >>> logZ['CCC']
+    2.0
+
+    """
+    def __init__(self, registry, values=None, dtype=np.float64):
+        self.registry = registry
+        self._values = np.zeros([len(registry)], dtype)
+        self._present = np.zeros([len(registry)], bool)
+        if values is not None:
+            self.assign(values)
+
+    @classmethod
+    def fromkeys(cls, registry, state_keys, value=0.0, dtype=np.float64):
+        """
+        Create a StateArray holding the same value for each of the specified chemical state keys.
+        """
+        state_array = cls(registry, dtype=dtype)
+        indices = registry.indices(state_keys, add=True)
+        state_array._resize()
+        state_array._values[indices] = value
+        state_array._present[indices] = True
+        return state_array
+
+    def _resize(self):
+        """
+        Grow the arrays to cover states registered since they were allocated.
+        """
+        nstates = len(self.registry)
+        if nstates > len(self._values):
+            nadded = nstates - len(self._values)
+            self._values = np.concatenate([self._values, np.zeros([nadded], self._values.dtype)])
+            self._present = np.concatenate([self._present, np.zeros([nadded], bool)])
+
+    def _index(self, state_key):
+        index = self.registry._indices.get(state_key)
+        if (index is None) or (index >= len(self._present)) or (not self._present[index]):
+            return None
+        return index
+
+    def __getitem__(self, state_key):
+        index = self._index(state_key)
+        if index is None:
+            raise KeyError(state_key)
+        return self._values[index].item()
+
+    def __setitem__(self, state_key, value):
+        index = self.registry.add(state_key)
+        self._resize()
+        self._values[index] = value
+        self._present[index] = True
+
+    def __delitem__(self, state_key):
+        index = self._index(state_key)
+        if index is None:
+            raise KeyError(state_key)
+        self._present[index] = False
+        self._values[index] = 0
+
+    def __contains__(self, state_key):
+        return self._index(state_key) is not None
+
+    def __iter__(self):
+        keys = self.registry._keys
+        for index in np.flatnonzero(self._present):
+            yield keys[index]
+
+    def __len__(self):
+        return int(np.count_nonzero(self._present))
+
+    def __repr__(self):
+        return "StateArray(%s)" % repr(dict(self.items()))
+
+    @property
+    def indices(self):
+        """Registry indices of the states held, in increasing order."""
+        return np.flatnonzero(self._present)
+
+    def values_array(self):
+        """Return the values of the states held as a numpy array, ordered like `indices`."""
+        return self._values[self._present]
+
+    def to_array(self, fill_value=np.nan):
+        """
+        Return the values as a numpy array indexed by registry index, with `fill_value` for states not held.
+        """
+        self._resize()
+        array = np.array(self._values, np.float64) if fill_value is np.nan else np.array(self._values)
+        array[~self._present] = fill_value
+        return array
+
+    def copy(self):
+        state_array = StateArray(self.registry, dtype=self._values.dtype)
+        state_array._values = self._values.copy()
+        state_array._present = self._present.copy()
+        return state_array
+
+    def _aligned(self, other):
+        """
+        Return the values and presence of another StateArray over the indices of this registry.
+        """
+        self._resize()
+        values = np.zeros(self._values.shape, other._values.dtype)
+        present = np.zeros(self._present.shape, bool)
+        if other.registry is self.registry:
+            nstates = len(other._values)
+            values[:nstates] = other._values
+            present[:nstates] = other._present
+        else:
+            other_keys = other.registry._keys
+            other_indices = other.indices
+            indices = self.registry.indices([other_keys[index] for index in other_indices], add=True)
+            self._resize()
+            values = np.zeros(self._values.shape, other._values.dtype)
+            present = np.zeros(self._present.shape, bool)
+            values[indices] = other._values[other_indices]
+            present[indices] = True
+        return values, present
+
+    def assign(self, values):
+        """
+        Replace the contents with the specified values.
+
+        Parameters
+        ----------
+        values : StateArray or mapping of hashable object : number
+            The new values
+        """
+        if values is self:
+            return
+        if isinstance(values, StateArray):
+            (self._values[...], self._present[...]) = (0, False)
+            (other_values, other_present) = self._aligned(values)
+            self._values[other_present] = other_values[other_present]
+            self._present[...] = other_present
+        else:
+            values = dict(values)
+            indices = self.registry.indices(values.keys(), add=True)
+            self._resize()
+            self._values[...] = 0
+            self._present[...] = False
+            self._values[indices] = list(values.values())
+            self._present[indices] = True
+
+    def add_scaled(self, other, scale=1.0):
+        """
+        Add `scale` times the values of another StateArray, starting from zero for states not held yet.
+        """
+        (other_values, other_present) = self._aligned(other)
+        self._values[other_present] += scale * other_values[other_present]
+        self._present |= other_present
+
+    def __iadd__(self, value):
+        self._values[self._present] += value
+        return self
+
+    def __isub__(self, value):
+        self._values[self._present] -= value
+        return self
+
+    def __neg__(self):
+        state_array = self.copy()
+        state_array._values = -state_array._values
+        return state_array
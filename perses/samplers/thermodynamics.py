@@ -33,6 +33,7 @@ import numpy as np
 import simtk.openmm as mm
 import simtk.unit as units
 from openmmtools import testsystems
+from perses.systems import copy_system
 
 import logging
 logger = logging.getLogger(__name__)
@@ -49,6 +50,77 @@ __version__ = "$Revision: $"
 
 kB = units.BOLTZMANN_CONSTANT_kB * units.AVOGADRO_CONSTANT_NA # Boltzmann constant
 
+#=============================================================================================
+# Barostat utilities
+#=============================================================================================
+
+def _get_barostat_temperature(barostat):
+    if hasattr(barostat, 'getDefaultTemperature'):
+        return barostat.getDefaultTemperature()
+    elif hasattr(barostat, 'getTemperature'):
+        return barostat.getTemperature()
+    else:
+        raise Exception("barostat does not have 'getTemperature' or 'getDefaultTemperature' interfaces!")
+
+def _quantities_equal(a, b, unit):
+    """
+    Return True if the Quantities `a` and `b` are equal to rounding error in `unit`, whatever units they are expressed in.
+    """
+    return np.isclose(a.value_in_unit(unit), b.value_in_unit(unit), rtol=1.0e-10, atol=0.0)
+
+def _with_barostat(system, temperature, pressure, reason='barostat'):
+    """
+    Return a System with a MonteCarloBarostat at the specified temperature and pressure, copying the shared System only if needed.
+
+    Parameters
+    ----------
+    system : simtk.openmm.System
+        Shared System, which is not modified
+    temperature : simtk.unit.Quantity compatible with kelvin
+        The barostat temperature
+    pressure : simtk.unit.Quantity compatible with atmospheres
+        The barostat pressure
+    reason : str, optional, default='barostat'
+        Label under which a System copy is counted
+
+    Returns
+    -------
+    system : simtk.openmm.System
+        `system` itself if it already contains a MonteCarloBarostat with this temperature and pressure, or a copy
+        with the barostat added or updated otherwise
+    """
+    for force in system.getForces():
+        if isinstance(force, mm.MonteCarloBarostat):
+            # The barostat stores its pressure in bar, which may have been specified in other units.
+            if _quantities_equal(force.getDefaultPressure(), pressure, units.atmospheres) and _quantities_equal(_get_barostat_temperature(force), temperature, units.kelvin):
+                return system
+            break
+
+    system = copy_system(system, reason=reason)
+    # Try to find barostat.
+    barostat = False
+    for force_index in range(system.getNumForces()):
+        force = system.getForce(force_index)
+        # Dispatch forces
+        if isinstance(force, mm.MonteCarloBarostat):
+            barostat = force
+            break
+    if barostat:
+        # Set temperature.
+        if hasattr(barostat, 'setDefaultTemperature'):
+            barostat.setDefaultTemperature(temperature)
+        elif hasattr(barostat, 'setTemperature'):
+            barostat.setTemperature(temperature)
+        else:
+            raise Exception("barostat does not have 'setTemperature' or 'setDefaultTemperature' interfaces!")
+        # Set pressure
+        barostat.setDefaultPressure(pressure)
+    else:
+        # Create barostat.
+        barostat = mm.MonteCarloBarostat(pressure, temperature)
+        system.addForce(barostat)
+    return system
+
 #=============================================================================================
 # Thermodynamic state description
 #=============================================================================================
@@ -120,8 +192,8 @@ class ThermodynamicState(object):
         if system is not None:
             if type(system) is not mm.System:
                 raise(TypeError("system must be an OpenMM System; instead found %s" % type(system)))
-            self.system = copy.deepcopy(system) # TODO: Do this when deep copy works.
-            # self.system = system # we make a shallow copy for now, which can cause trouble later
+            # Systems are shared read-only; a private copy is only made if a barostat must be attached or updated below.
+            self.system = system
         if temperature is not None:
             self.temperature = temperature
         if pressure is not None:
@@ -129,28 +201,7 @@ class ThermodynamicState(object):
 
         # If temperature and pressure are specified, make sure MonteCarloBarostat is attached.
         if temperature and pressure:
-            # Try to find barostat.
-            barostat = False
-            for force_index in range(self.system.getNumForces()):
-                force = self.system.getForce(force_index)
-                # Dispatch forces
-                if isinstance(force, mm.MonteCarloBarostat):
-                    barostat = force
-                    break
-            if barostat:
-                # Set temperature.
-                if hasattr(barostat, 'setDefaultTemperature'):
-                    barostat.setDefaultTemperature(temperature)
-                elif hasattr(barostat, 'setTemperature'):
-                    barostat.setTemperature(temperature)
-                else:
-                    raise Exception("barostat does not have 'setTemperature' or 'setDefaultTemperature' interfaces!")
-                # Set pressure
-                barostat.setDefaultPressure(pressure)
-            else:
-                # Create barostat.
-                barostat = mm.MonteCarloBarostat(pressure, temperature)
-                self.system.addForce(barostat)
+            self.system = _with_barostat(self.system, temperature, pressure, reason='ThermodynamicState barostat')
 
         return
 
@@ -26,6 +26,11 @@ import json
 import mdtraj
 from simtk import unit
 import codecs
+import threading
+if sys.version_info >= (3, 0):
+    import queue
+else:
+    import Queue as queue
 
 ################################################################################
 # LOGGER
@@ -314,3 +319,97 @@ class NetCDFStorageView(NetCDFStorage):
 
         if envname: self._envname = envname
         if modname: self._modname = modname
+
+################################################################################
+# ASYNCHRONOUS CONFIGURATION WRITER
+################################################################################
+
+class AsyncConfigurationWriter(object):
+    """Write configurations to a storage layer from a background thread.
+
+    Frames are copied into a bounded buffer and written by a single writer thread, so the
+    caller does not wait for the mdtraj Topology conversion or NetCDF writes. When the buffer is
+    full, `write_configuration` blocks until the writer has caught up (back-pressure), which bounds
+    the memory held by pending frames.
+
+    The underlying NetCDF file is not thread-safe, so the caller must call `flush()` before writing
+    anything else to the same storage.
+
+    Examples
+    --------
+
+    >>> storage = NetCDFStorage('output.nc', mode='w') # doctest: +SKIP
+    >>> view = NetCDFStorageView(storage, 'envname', 'modname') # doctest: +SKIP
+    >>> writer = AsyncConfigurationWriter(view, maxsize=16) # doctest: +SKIP
+    >>> writer.write_configuration('positions', positions, topology, iteration=0, frame=0, nframes=1) # doctest: +SKIP
+    >>> writer.flush() # doctest: +SKIP
+
+    """
+    def __init__(self, storage, maxsize=16):
+        """
+        Parameters
+        ----------
+        storage : NetCDFStorage or NetCDFStorageView
+            The storage layer to write configurations to
+        maxsize : int, optional, default=16
+            Maximum number of frames held in the buffer before `write_configuration` blocks
+
+        """
+        self._storage = storage
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._exception = None
+        self._thread = threading.Thread(target=self._write_frames)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _write_frames(self):
+        """Writer thread: write buffered frames to storage until the shutdown sentinel is received.
+        """
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                if self._exception is None:
+                    (varname, positions, topology, kwargs) = item
+                    self._storage.write_configuration(varname, positions, topology, **kwargs)
+            except Exception as e:
+                logger.error("Asynchronous write of configuration failed: %s" % str(e))
+                self._exception = e
+            finally:
+                self._queue.task_done()
+
+    def _raise_pending_exception(self):
+        if self._exception is not None:
+            e = self._exception
+            self._exception = None
+            raise e
+
+    def write_configuration(self, varname, positions, topology, iteration=None, frame=None, nframes=None):
+        """Queue a configuration to be written; arguments are as for `NetCDFStorage.write_configuration`.
+
+        The positions are copied, so the caller is free to modify them after this call returns.
+        Blocks if the buffer is full. Raises any exception encountered by the writer thread since the
+        last call.
+
+        """
+        self._raise_pending_exception()
+        if not self._thread.is_alive():
+            raise Exception("AsyncConfigurationWriter has been closed.")
+        positions = unit.Quantity(np.array(positions.value_in_unit(unit.angstroms), np.float32), unit.angstroms)
+        kwargs = { 'iteration' : iteration, 'frame' : frame, 'nframes' : nframes }
+        self._queue.put((varname, positions, topology, kwargs))
+
+    def flush(self):
+        """Block until all queued configurations have been written, raising any exception from the writer thread.
+        """
+        self._queue.join()
+        self._raise_pending_exception()
+
+    def close(self):
+        """Write all queued configurations and stop the writer thread.
+        """
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._raise_pending_exception()
@@ -0,0 +1,126 @@
+"""
+Ownership rules and copy instrumentation for OpenMM System objects.
+
+OpenMM Systems are passed between proposal engines, NCMC engines and samplers as shared,
+read-only objects: a component that receives a System may keep a reference to it and create
+Contexts from it, but must not modify it. A component that needs a modified System (for example
+to add a barostat, remove forces, or change the default box vectors) first obtains a private copy
+with `copy_system` (copy-on-write) and modifies that copy instead.
+
+All System copies made by perses go through `copy_system`, which counts them by reason so that
+the copy overhead of a simulation can be monitored with `get_system_copy_counts`.
+
+Components that cache objects derived from a System (Contexts, hybrid Systems) and need to decide
+whether a different System object is equivalent compare `system_fingerprint` values.
+
+"""
+
+################################################################################
+# IMPORTS
+################################################################################
+
+import copy
+import re
+import hashlib
+import threading
+from collections import defaultdict
+
+################################################################################
+# COPY INSTRUMENTATION
+################################################################################
+
+_system_copy_counts = defaultdict(int)
+_system_copy_lock = threading.Lock()
+
+def copy_system(system, reason='unspecified', force_names=None):
+    """
+    Make a private copy of an OpenMM System that the caller is free to modify.
+
+    Parameters
+    ----------
+    system : simtk.openmm.System
+        The shared System to copy; it is not modified.
+    reason : str, optional, default='unspecified'
+        Label under which the copy is counted.
+    force_names : list of str, optional, default=None
+        If specified, only forces whose class names are in this list are copied; particles,
+        constraints, virtual sites and default box vectors are always copied.
+
+    Returns
+    -------
+    system_copy : simtk.openmm.System
+        The private copy.
+
+    """
+    with _system_copy_lock:
+        _system_copy_counts[reason] += 1
+
+    has_virtual_sites = any(system.isVirtualSite(index) for index in range(system.getNumParticles()))
+    if (force_names is None) or has_virtual_sites:
+        system_copy = copy.deepcopy(system)
+        if force_names is not None:
+            for force_index in reversed(range(system_copy.getNumForces())):
+                if system_copy.getForce(force_index).__class__.__name__ not in force_names:
+                    system_copy.removeForce(force_index)
+        return system_copy
+
+    # Build the copy directly so that forces which are not requested are never cloned.
+    from simtk import openmm
+    system_copy = openmm.System()
+    system_copy.setDefaultPeriodicBoxVectors(*system.getDefaultPeriodicBoxVectors())
+    for index in range(system.getNumParticles()):
+        system_copy.addParticle(system.getParticleMass(index))
+    for index in range(system.getNumConstraints()):
+        system_copy.addConstraint(*system.getConstraintParameters(index))
+    for force in system.getForces():
+        if force.__class__.__name__ in force_names:
+            system_copy.addForce(copy.deepcopy(force))
+    return system_copy
+
+################################################################################
+# FINGERPRINTS
+################################################################################
+
+def system_fingerprint(system):
+    """
+    Return a fingerprint of an OpenMM System that identifies its particles, constraints and forces.
+
+    The fingerprint is a hash of the XML serialization of the System with the default periodic box
+    vectors removed, so that Systems which only differ by their default box vectors (such as the
+    copies made when a barostat changes the box) have the same fingerprint. Serialization is not
+    cheap for large Systems, so callers should compute the fingerprint once per System and keep it.
+
+    Parameters
+    ----------
+    system : simtk.openmm.System
+        The System; it is not modified.
+
+    Returns
+    -------
+    fingerprint : str
+        Hexadecimal SHA-1 digest.
+
+    """
+    from simtk import openmm
+    xml = openmm.XmlSerializer.serialize(system)
+    xml = re.sub(r'<PeriodicBoxVectors>.*?</PeriodicBoxVectors>', '', xml, flags=re.DOTALL)
+    return hashlib.sha1(xml.encode('utf-8')).hexdigest()
+
+def get_system_copy_counts():
+    """
+    Return the number of System copies made through `copy_system` since the last reset.
+
+    Returns
+    -------
+    counts : dict of str : int
+        counts[reason] is the number of copies made for that reason
+    """
+    with _system_copy_lock:
+        return dict(_system_copy_counts)
+
+def reset_system_copy_counts():
+    """
+    Reset the System copy counters.
+    """
+    with _system_copy_lock:
+        _system_copy_counts.clear()
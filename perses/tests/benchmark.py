@@ -1,23 +1,21 @@
+"""
+Benchmark driver for NCMC null-transformation protocols.
+
+Independent switching trials are farmed out over a process pool, and the raw
+logP samples, NCMC work trajectories and timings for each configuration are written
+to a compact results file so that reruns with unchanged configurations are skipped. Plotting is an
+optional post-processing step on the results file.
+
+"""
+
 from simtk import openmm, unit
 from simtk.openmm import app
 import os, os.path
 import sys, math
-from unittest import skipIf
+import time
+import pickle
 import numpy as np
 from functools import partial
-from pkg_resources import resource_filename
-from openeye import oechem
-if sys.version_info >= (3, 0):
-    from io import StringIO
-    from subprocess import getstatusoutput
-else:
-    from cStringIO import StringIO
-    from commands import getstatusoutput
-import matplotlib as mpl
-mpl.use('Agg')
-import seaborn as sns
-
-import matplotlib.pyplot as plt
 
 ################################################################################
 # NUMBER OF ATTEMPTS
@@ -50,6 +48,238 @@ functions_twostage = {
     'lambda_torsions' : '1.0'
 }
 
+methods = {
+    'hybrid' : ['geometry-ncmc-geometry', functions_hybrid],
+    'two-stage' : ['ncmc-geometry-ncmc', functions_twostage],
+}
+
+# Molecules featured in NullTestSystems, as supported by `run_configuration`
+molecule_names_all = ['propane', 'butane', 'naphthalene']
+
+################################################################################
+# BENCHMARK DRIVER
+################################################################################
+
+def benchmark_configurations(molecule_names=None, method_names=None, ncmc_nsteps_list=None, integrator_types=None, niterations=niterations, nreplicates=1):
+    """
+    Enumerate benchmark configurations.
+
+    Arguments:
+    ----------
+        molecule_names : list of str, optional, default=None
+            Molecules featured in NullTestSystems, in ['naphthalene','butane','propane']; if None, ['butane']
+        method_names : list of str, optional, default=None
+            NCMC schemes, keys of `methods`; if None, ['hybrid', 'two-stage']
+        ncmc_nsteps_list : list of int, optional, default=None
+            Numbers of NCMC switching steps; if None, [0, 1, 10, 100, 1000]
+        integrator_types : list of str, optional, default=None
+            NCMC integrator types; if None, ['GHMC']
+        niterations : int, optional, default=niterations
+            Number of ExpandedEnsembleSampler iterations per replicate
+        nreplicates : int, optional, default=1
+            Number of independent replicates per configuration; each replicate is run as a separate task
+
+    Returns:
+    --------
+        configurations : list of dict
+            Each configuration has keys 'molecule_name', 'method', 'ncmc_nsteps', 'integrator_type', 'niterations', 'replicate'
+    """
+    if molecule_names is None:
+        molecule_names = ['butane']
+    if method_names is None:
+        method_names = ['hybrid', 'two-stage']
+    if ncmc_nsteps_list is None:
+        ncmc_nsteps_list = [0, 1, 10, 100, 1000]
+    if integrator_types is None:
+        integrator_types = ['GHMC']
+    configurations = list()
+    for molecule_name in molecule_names:
+        for method in method_names:
+            for ncmc_nsteps in ncmc_nsteps_list:
+                for integrator_type in integrator_types:
+                    for replicate in range(nreplicates):
+                        configurations.append({'molecule_name' : molecule_name, 'method' : method, 'ncmc_nsteps' : ncmc_nsteps,
+                            'integrator_type' : integrator_type, 'niterations' : niterations, 'replicate' : replicate})
+    return configurations
+
+def configuration_key(configuration):
+    """
+    Return a unique, hashable key identifying a benchmark configuration.
+    """
+    return tuple(sorted(configuration.items()))
+
+def run_configuration(configuration):
+    """
+    Run a single null-transformation benchmark configuration.
+
+    This is the unit of work farmed out to worker processes, so it must be importable at module level.
+
+    Arguments:
+    ----------
+        configuration : dict
+            Configuration as generated by `benchmark_configurations`
+
+    Returns:
+    --------
+        configuration : dict
+            The configuration that was run
+        result : dict
+            'time' : wall-clock time (in seconds) spent in ExpandedEnsembleSampler.run
+            'logPs' : dict { str : np.ndarray } of the logP_* components stored at each iteration
+            'works' : dict { str : np.ndarray } of the total_work_*, shadow_work_* and protocol_work_* arrays
+                      (accumulated work at each NCMC step of each iteration) stored by the NCMC engine;
+                      empty for integrators that only compute the work at the end of the protocol (BAOAB)
+    """
+    from perses.tests.testsystems import NaphthaleneTestSystem, ButaneTestSystem, PropaneTestSystem
+    import netCDF4 as netcdf
+    testsystems = {
+        'propane' : PropaneTestSystem,
+        'butane' : ButaneTestSystem,
+        'naphthalene' : NaphthaleneTestSystem,
+    }
+
+    # Make each replicate independent but reproducible
+    np.random.seed(configuration['replicate'])
+
+    molecule_name = configuration['molecule_name']
+    name = configuration['method']
+    ncmc_nsteps = configuration['ncmc_nsteps']
+    integrator_type = configuration['integrator_type']
+    [scheme, functions] = methods[name]
+    storage_filename = '{0}_{1}-{2}steps-{3}-{4}.nc'.format(molecule_name, name, ncmc_nsteps, integrator_type, configuration['replicate'])
+
+    testsystem = testsystems[molecule_name](storage_filename=storage_filename, scheme=scheme, options={'functions' : functions, 'nsteps' : ncmc_nsteps, 'integrator_type' : integrator_type})
+    testsystem.exen_samplers[ENV].geometry_engine.use_sterics = use_sterics
+    testsystem.mcmc_samplers[ENV].verbose = False
+    testsystem.exen_samplers[ENV].verbose = False
+    testsystem.mcmc_samplers[ENV].timestep = 1.0 * unit.femtoseconds
+
+    # Collect data on switching
+    # WARNING: We can't equilibrate because it messes up the iteration counters and storage iterations for exen samplers
+    initial_time = time.time()
+    testsystem.exen_samplers[ENV].run(niterations=configuration['niterations'])
+    elapsed_time = time.time() - initial_time
+    testsystem.storage.close()
+
+    # Extract raw logP samples
+    logPs = dict()
+    ncfile = netcdf.Dataset(storage_filename, 'r')
+    ee_sam = ncfile.groups[ENV].groups['ExpandedEnsembleSampler']
+    for component in ee_sam.variables.keys():
+        if component.startswith('logP_'):
+            logPs[component] = np.array(ee_sam.variables[component][:], np.float32)
+
+    # Extract NCMC work trajectories, which the NCMC engine stores in a group named after its class
+    works = dict()
+    for (group_name, group) in ncfile.groups[ENV].groups.items():
+        if not group_name.startswith('NCMC'):
+            continue
+        for component in group.variables.keys():
+            if component.startswith(('total_work_', 'shadow_work_', 'protocol_work_')):
+                works[component] = np.array(group.variables[component][:], np.float32)
+    ncfile.close()
+
+    return configuration, {'time' : elapsed_time, 'logPs' : logPs, 'works' : works}
+
+def load_results(results_filename):
+    """
+    Load benchmark results, returning an empty dict if the results file does not exist.
+
+    Returns:
+    --------
+        results : dict { tuple : (dict, dict) }
+            key : configuration key
+            value : (configuration, result) as returned by `run_configuration`
+    """
+    if not os.path.exists(results_filename):
+        return dict()
+    with open(results_filename, 'rb') as infile:
+        return pickle.load(infile)
+
+def save_results(results, results_filename):
+    """
+    Atomically write benchmark results, so that an interrupted run never leaves a corrupt results file.
+    """
+    temporary_filename = results_filename + '.tmp'
+    with open(temporary_filename, 'wb') as outfile:
+        pickle.dump(results, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+    os.rename(temporary_filename, results_filename)
+
+def run_benchmarks(configurations, results_filename='benchmark_results.pkl', nprocesses=None, verbose=True):
+    """
+    Run benchmark configurations over a process pool, skipping those already present in the results file.
+
+    Results are written to `results_filename` as each configuration completes.
+
+    Arguments:
+    ----------
+        configurations : list of dict
+            Configurations as generated by `benchmark_configurations`
+        results_filename : str, optional, default='benchmark_results.pkl'
+            Compact results file containing raw logP samples and timings
+        nprocesses : int, optional, default=None
+            Number of worker processes; if None, use all available cores. If 1, run serially in this process.
+        verbose : bool, optional, default=True
+            If True, report progress.
+
+    Returns:
+    --------
+        results : dict { tuple : (dict, dict) }
+            All results, including those loaded from `results_filename`
+    """
+    results = load_results(results_filename)
+    pending = [configuration for configuration in configurations if configuration_key(configuration) not in results]
+    if verbose: print('%d configurations requested, %d already complete, %d to run' % (len(configurations), len(configurations) - len(pending), len(pending)))
+    if len(pending) == 0:
+        return results
+
+    if nprocesses == 1:
+        completed = map(run_configuration, pending)
+        pool = None
+    else:
+        import multiprocessing
+        pool = multiprocessing.Pool(processes=nprocesses)
+        completed = pool.imap_unordered(run_configuration, pending)
+
+    try:
+        for (configuration, result) in completed:
+            results[configuration_key(configuration)] = (configuration, result)
+            save_results(results, results_filename)
+            if verbose: print('{molecule_name} {method} {ncmc_nsteps} steps {integrator_type} (replicate {replicate}): '.format(**configuration) + '%.3f s' % result['time'])
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return results
+
+def collect_logPs(results, molecule_name, method, component, integrator_type='GHMC'):
+    """
+    Gather the samples of a logP component for all numbers of NCMC steps, pooling replicates.
+
+    Returns:
+    --------
+        logps: dict { int : np.ndarray }
+            key : number of total NCMC steps
+            value : array of logP values
+    """
+    logps = dict()
+    for (configuration, result) in results.values():
+        if (configuration['molecule_name'], configuration['method'], configuration['integrator_type']) != (molecule_name, method, integrator_type):
+            continue
+        if component not in result['logPs']:
+            continue
+        nsteps = configuration['ncmc_nsteps']
+        if nsteps in logps:
+            logps[nsteps] = np.concatenate([logps[nsteps], result['logPs'][component]])
+        else:
+            logps[nsteps] = result['logPs'][component]
+    return logps
+
+################################################################################
+# ANALYSIS
+################################################################################
+
 def plot_logPs(logps, molecule_name, scheme, component):
     """
     Create line plot of mean and standard deviation of given logPs.
@@ -69,6 +299,11 @@ def plot_logPs(logps, molecule_name, scheme, component):
             Which logP is being plotted
             in ['NCMC','EXEN']
     """
+    import matplotlib as mpl
+    mpl.use('Agg')
+    import seaborn as sns
+    import matplotlib.pyplot as plt
+
     x = list(logps.keys())
     x.sort()
     y = [logps[steps].mean() for steps in x]
@@ -85,123 +320,226 @@ def plot_logPs(logps, molecule_name, scheme, component):
     print('Saved plot to {0}_{1}_{2}{3}_logP.png'.format(ENV, molecule_name, scheme, component))
     plt.clf()
 
-def benchmark_exen_ncmc_protocol(analyses, molecule_name, scheme):
+def benchmark_exen_ncmc_protocol(results, molecule_name, scheme, integrator_type='GHMC'):
     """
     For each combination of system and scheme, results are analyzed for
     the following:
     * Over the whole range of total steps:
-        * Plot mean and standard deviation of NCMC logP as a function of
-          total steps
-        * Plot mean and standard deviation of EXEN logP as a function of
-          total steps
+        * Plot mean and standard deviation of each logP component as a
+          function of total steps
 
     Arguments:
     ----------
-        analyses : dict { int : perses.Analysis }
-            key : number of total NCMC steps
-            value : analysis object contained stored information
+        results : dict
+            Benchmark results as returned by `run_benchmarks` or `load_results`
         molecule_name : str
             The molecule featured in the NullTestSystem being analyzed
             in ['naphthalene','butane','propane']
         scheme : str
             Which NCMC scheme is being used
             in ['hybrid','two-stage']
+        integrator_type : str, optional, default='GHMC'
+            Which NCMC integrator was used
 
-    Creates 2 plots every time it is called
+    Creates one plot per logP component every time it is called
     """
 
     # Build a list of all logP components:
-    components = dict()
-    for nsteps, analysis in analyses.items():
-        ee_sam = analysis._ncfile.groups['ExpandedEnsembleSampler']
-        for name in ee_sam.variables.keys():
-            if name.startswith('logP_'):
-                components[name] = name
-
-    for component in components.keys():
+    components = set()
+    for (configuration, result) in results.values():
+        components.update(result['logPs'].keys())
+
+    for component in sorted(components):
         try:
             print('Finding {0} over nsteps for {1} with {2} NCMC'.format(component, molecule_name, scheme))
-            logps = dict()
-            for nsteps, analysis in analyses.items():
-                ee_sam = analysis._ncfile.groups['ExpandedEnsembleSampler']
-                niterations = ee_sam.variables[component].shape[0]
-                logps[nsteps] = np.zeros(niterations, np.float64)
-                for n in range(niterations):
-                    logps[nsteps][n] = ee_sam.variables[component][n]
-            plot_logPs(logps, molecule_name, scheme, components[component])
+            logps = collect_logPs(results, molecule_name, scheme, component, integrator_type=integrator_type)
+            if len(logps) > 0:
+                plot_logPs(logps, molecule_name, scheme, component)
         except Exception as e:
             print(e)
 
-def benchmark_ncmc_work_during_protocol():
+################################################################################
+# BENCHMARKS
+################################################################################
+
+def benchmark_ncmc_work_during_protocol(results_filename='benchmark_results.pkl', nprocesses=None, plot=True):
     """
-    Run 50 iterations of ExpandedEnsembleSampler for NullTestSystems
-    over a range of total NCMC steps [0, 1, 10, 100, 1000, 10000].
+    Run 200 iterations of ExpandedEnsembleSampler for NullTestSystems
+    over a range of total NCMC steps [0, 1, 10, 100, 1000].
 
-    Benchmark is repeated for Naphthalene, Butane, and Propane test
-    systems, using two-stage and hybrid NCMC.
+    Benchmark is run for the Butane test system, using two-stage and
+    hybrid NCMC, with independent configurations run in parallel.
+    Configurations already present in `results_filename` are skipped.
 
-    For each combination of system and scheme, results are analyzed for
-    the following:
-    * For a given total number of steps:
-        * For NCMC steps 100 and above, plot work done by ncmc integrator
-          over the course of the protocol
-        * Plot histograms of the contributions of each component to the
-          overall log acceptance probability
-    * Over the whole range of total steps:
-        * Plot mean and standard deviation of NCMC logP as a function of
-          total steps
-        * Plot mean and standard deviation of EXEN logP as a function of
-          total steps
+    If `plot` is True, for each combination of system and scheme, plot
+    the mean and standard deviation of each logP component as a function
+    of total steps.
     """
-    from perses.tests.testsystems import NaphthaleneTestSystem, ButaneTestSystem, PropaneTestSystem
-    from perses.analysis import Analysis
-    import netCDF4 as netcdf
-    import pickle
-    import codecs
-    molecule_names = {
-        #'propane' : PropaneTestSystem,
-        'butane' : ButaneTestSystem,
-        #'naphthalene' : NaphthaleneTestSystem,
-    }
-    methods = {
-        'hybrid' : ['geometry-ncmc-geometry', functions_hybrid],
-        'two-stage' : ['ncmc-geometry-ncmc', functions_twostage],
-    }
+    configurations = benchmark_configurations(molecule_names=['butane'])
+    results = run_benchmarks(configurations, results_filename=results_filename, nprocesses=nprocesses)
+    if plot:
+        for molecule_name in set(configuration['molecule_name'] for configuration in configurations):
+            for name in methods.keys():
+                benchmark_exen_ncmc_protocol(results, molecule_name, name)
+    return results
+
+def benchmark_ncmc_integrators(molecule_names=None, integrator_types=None, ncmc_nsteps_list=None, niterations=niterations, results_filename='benchmark_results.pkl', nprocesses=None):
+    """
+    Compare NCMC integrators on null transformations by wall-clock time per unit of acceptance.
+
+    For each NullTestSystem, scheme, and number of NCMC steps, an ExpandedEnsembleSampler is run
+    with each `integrator_type`, and the mean acceptance probability min(1, exp(logP_accept)) is
+    computed. Since null transformations should always be accepted in the limit of slow switching,
+    the wall time spent per unit of acceptance measures the integrator efficiency.
+
+    Arguments:
+    ----------
+        molecule_names : list of str, optional, default=None
+            Molecules featured in NullTestSystems; if None, all of `molecule_names_all`
+        integrator_types : list of str, optional, default=None
+            NCMC integrator types to compare; if None, ['GHMC', 'VV', 'BAOAB']
+        ncmc_nsteps_list : list of int, optional, default=None
+            Numbers of NCMC switching steps to benchmark; if None, [10, 100]
+        niterations : int, optional, default=niterations
+            Number of ExpandedEnsembleSampler iterations per benchmark
+        results_filename : str, optional, default='benchmark_results.pkl'
+            Compact results file; configurations already present are not rerun
+        nprocesses : int, optional, default=None
+            Number of worker processes; if None, use all available cores
+
+    Returns:
+    --------
+        summary : dict { (str, str, int, str) : dict }
+            key : (molecule_name, scheme name, ncmc_nsteps, integrator_type)
+            value : dict with 'time', 'mean_acceptance', and 'time_per_acceptance'
+    """
+    if molecule_names is None:
+        molecule_names = molecule_names_all
+    if integrator_types is None:
+        integrator_types = ['GHMC', 'VV', 'BAOAB']
+    if ncmc_nsteps_list is None:
+        ncmc_nsteps_list = [10, 100]
+    configurations = benchmark_configurations(molecule_names=molecule_names, ncmc_nsteps_list=ncmc_nsteps_list, integrator_types=integrator_types, niterations=niterations)
+    results = run_benchmarks(configurations, results_filename=results_filename, nprocesses=nprocesses)
+
+    summary = dict()
+    for configuration in configurations:
+        (configuration, result) = results[configuration_key(configuration)]
+        elapsed_time = result['time']
+        logP_accept = result['logPs']['logP_accept']
+        mean_acceptance = np.exp(np.minimum(logP_accept, 0.0)).mean()
+        time_per_acceptance = elapsed_time / mean_acceptance if mean_acceptance > 0.0 else np.inf
+
+        key = (configuration['molecule_name'], configuration['method'], configuration['ncmc_nsteps'], configuration['integrator_type'])
+        summary[key] = {'time' : elapsed_time, 'mean_acceptance' : mean_acceptance, 'time_per_acceptance' : time_per_acceptance}
+        print('{0} {1} {2:5d} steps {3:>6s}: {4:10.3f} s, mean acceptance {5:8.5f}, {6:12.3f} s per unit acceptance'.format(key[0], key[1], key[2], key[3], elapsed_time, mean_acceptance, time_per_acceptance))
+
+    return summary
+
+################################################################################
+# HYBRID TOPOLOGY CONSTRUCTION SCALING
+################################################################################
+
+hybrid_scaling_systems = [
+    ('AlanineDipeptideTestSystem', ['vacuum', 'explicit']),
+    ('T4LysozymeMutationTestSystem', ['vacuum-complex', 'explicit-complex']),
+    ('AblImatinibResistanceTestSystem', ['vacuum-complex', 'explicit-complex']),
+]
+
+def benchmark_hybrid_factory_scaling(systems=hybrid_scaling_systems, nproposals=3):
+    """
+    Time HybridTopologyFactory construction as a function of system size.
+
+    For each test system and environment, `nproposals` topology proposals are generated
+    with the test system's proposal and geometry engines, and the time to build the
+    hybrid System with HybridTopologyFactory.createPerturbedSystem is recorded.
+
+    Arguments:
+    ----------
+        systems : list of (str, list of str), optional, default=hybrid_scaling_systems
+            Names of classes in perses.tests.testsystems and the environments to benchmark
+        nproposals : int, optional, default=3
+            Number of proposals to time for each environment
+
+    Returns:
+    --------
+        timings : list of (str, str, int, float)
+            (test system name, environment, number of hybrid atoms, mean construction time in seconds)
+    """
+    from perses.tests import testsystems
+    from perses.annihilation.relative import HybridTopologyFactory
+
+    timings = list()
+    for (testsystem_name, environments) in systems:
+        testsystem = getattr(testsystems, testsystem_name)()
+        for environment in environments:
+            exen_sampler = testsystem.exen_samplers[environment]
+            system = exen_sampler.sampler.thermodynamic_state.system
+            positions = exen_sampler.sampler.sampler_state.positions
+            elapsed_times = list()
+            for proposal_index in range(nproposals):
+                topology_proposal = exen_sampler.proposal_engine.propose(system, exen_sampler.topology)
+                new_positions, _ = testsystem.geometry_engine.propose(topology_proposal, positions, exen_sampler.sampler.thermodynamic_state.beta)
+                initial_time = time.time()
+                factory = HybridTopologyFactory(topology_proposal.old_system, topology_proposal.new_system, topology_proposal.old_topology, topology_proposal.new_topology, positions, new_positions, topology_proposal.old_to_new_atom_map)
+                [hybrid_system, hybrid_topology, hybrid_positions, final_atom_map, initial_atom_map] = factory.createPerturbedSystem()
+                elapsed_times.append(time.time() - initial_time)
+            natoms = hybrid_system.getNumParticles()
+            mean_time = np.mean(elapsed_times)
+            timings.append((testsystem_name, environment, natoms, mean_time))
+            print('{0:>32s} {1:>18s}: {2:8d} atoms {3:10.3f} s'.format(testsystem_name, environment, natoms, mean_time))
+
+    return timings
+
+################################################################################
+# PROPOSAL PREFETCH
+################################################################################
+
+def benchmark_proposal_prefetch(testsystem_name='KinaseInhibitorsTestSystem', environment='vacuum', niterations=10, nsteps=500):
+    """
+    Measure the wall clock time saved by building chemical proposals in a worker process during MD.
+
+    ExpandedEnsembleSampler iterations of the test system are timed with and without `prefetch_proposals`,
+    from the same random number seed. If proposal building overlaps with MD, the time of the chemical state
+    moves drops by the proposal time while the time of the positions moves stays the same.
+
+    Arguments:
+    ----------
+        testsystem_name : str, optional, default='KinaseInhibitorsTestSystem'
+            Name of a class in perses.tests.testsystems
+        environment : str, optional, default='vacuum'
+            Environment of the test system to run
+        niterations : int, optional, default=10
+            Number of iterations to time, after one iteration to create the Contexts
+        nsteps : int, optional, default=500
+            Number of MD steps per positions move
+
+    Returns:
+    --------
+        timings : dict of bool : dict
+            timings[prefetch_proposals] has the mean wall clock times in seconds per 'iteration', 'positions' move and 'state' move
+    """
+    from perses.tests import testsystems
 
-    for molecule_name, NullProposal in molecule_names.items():
-        print('\nNow testing {0} null transformations'.format(molecule_name))
-        for name, [scheme, functions] in methods.items():
-            analyses = dict()
-            #for ncmc_nsteps in [0, 1, 10, 100, 1000, 10000]:
-            for ncmc_nsteps in [0, 1, 10, 100, 1000]:
-                print('Running {0} {2} ExpandedEnsemble steps for {1} iterations'.format(ncmc_nsteps, niterations, name))
-                testsystem = NullProposal(storage_filename='{0}_{1}-{2}steps.nc'.format(molecule_name, name, ncmc_nsteps), scheme=scheme, options={'functions' : functions, 'nsteps' : ncmc_nsteps})
-                testsystem.exen_samplers[ENV].geometry_engine.use_sterics = use_sterics
-                testsystem.mcmc_samplers[ENV].verbose = True
-                testsystem.exen_samplers[ENV].verbose = True
-                testsystem.mcmc_samplers[ENV].timestep = 1.0 * unit.femtoseconds
-
-                # DEBUG
-                #testsystem.exen_samplers[ENV].geometry_engine.write_proposal_pdb = True
-                #testsystem.exen_samplers[ENV].geometry_engine.pdb_filename_prefix = '{0}_{1}-{2}steps'.format(molecule_name, name, ncmc_nsteps)
-
-                # Equilibrate
-                # WARNING: We can't equilibrate because it messes up the iteration counters and storage iterations for exen samplers
-                #print('Equilibration...')
-                #testsystem.mcmc_samplers[ENV].run(niterations=nequil)
-
-                # Collect data on switching
-                print('Production...')
-                testsystem.exen_samplers[ENV].run(niterations=niterations)
-
-                analysis = Analysis(testsystem.storage_filename)
-                print(analysis.get_environments())
-                if ncmc_nsteps > 9:
-                    analysis.plot_ncmc_work('{0}_{1}-ncmc_work_over_{2}_steps.pdf'.format(molecule_name, name, ncmc_nsteps))
-                analysis.plot_exen_logp_components()
-                analyses[ncmc_nsteps] = analysis
-            benchmark_exen_ncmc_protocol(analyses, molecule_name, name)
+    timings = dict()
+    for prefetch_proposals in [False, True]:
+        np.random.seed(0)
+        testsystem = getattr(testsystems, testsystem_name)()
+        exen_sampler = testsystem.exen_samplers[environment]
+        exen_sampler.verbose = False
+        exen_sampler.sampler.verbose = False
+        exen_sampler.sampler.nsteps = nsteps
+        exen_sampler.prefetch_proposals = prefetch_proposals
+        exen_sampler.update()
+        exen_sampler.move_statistics = dict()
+        initial_time = time.time()
+        exen_sampler.run(niterations)
+        timings[prefetch_proposals] = { 'iteration' : (time.time() - initial_time) / niterations }
+        for move_name in ['positions', 'state']:
+            timings[prefetch_proposals][move_name] = exen_sampler.move_statistics[move_name]['time'] / niterations
+        print('{0:>32s} {1:>10s} prefetch {2!s:>5s}: {3:10.3f} s per iteration, {4:10.3f} s positions, {5:10.3f} s state'.format(testsystem_name, environment, prefetch_proposals, timings[prefetch_proposals]['iteration'], timings[prefetch_proposals]['positions'], timings[prefetch_proposals]['state']))
 
+    return timings
 
 if __name__ == "__main__":
     benchmark_ncmc_work_during_protocol()
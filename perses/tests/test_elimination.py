@@ -352,6 +352,49 @@ def test_ncmc_hybrid_engine_molecule():
             f.description = "Testing alchemical null elimination for '%s' with %d NCMC steps" % (molecule_name, ncmc_nsteps)
             yield f
 
+def test_ncmc_hybrid_engine_template_cache():
+    """
+    Check that NCMCHybridEngine reuses hybrid templates for a repeated chemical state pair, both in memory and from disk.
+    """
+    import tempfile, shutil, copy
+    from perses.tests.utils import createSystemFromIUPAC
+    from perses.rjmc.topology_proposal import TopologyProposal
+    from perses.annihilation.ncmc_switching import NCMCHybridEngine
+    [molecule, system, positions, topology] = createSystemFromIUPAC('pentane')
+    new_to_old_atom_map = { atom.index : atom.index for atom in topology.atoms() if str(atom.element.name) in ['carbon','nitrogen'] }
+    topology_proposal = TopologyProposal(
+        new_topology=topology, new_system=system, old_topology=topology, old_system=system,
+        old_chemical_state_key='pentane', new_chemical_state_key='pentane', logp_proposal=0.0, new_to_old_atom_map=new_to_old_atom_map, metadata={'test':0.0})
+    cache_directory = tempfile.mkdtemp()
+    try:
+        ncmc_engine = NCMCHybridEngine(temperature=temperature, nsteps=0, hybrid_cache_directory=cache_directory)
+        first = ncmc_engine.make_alchemical_system(topology_proposal, positions, positions)
+        second = ncmc_engine.make_alchemical_system(topology_proposal, positions, positions)
+        assert second[2] is first[2], "Hybrid system was rebuilt for a cached pair"
+        assert np.allclose(first[4] / unit.nanometers, second[4] / unit.nanometers)
+        assert second[5] == first[5] and second[6] == first[6]
+
+        # A changed box of the old System must be reflected in a reused template without modifying earlier hybrid systems.
+        original_box_vectors = first[2].getDefaultPeriodicBoxVectors()
+        resized_system = copy.deepcopy(system)
+        resized_system.setDefaultPeriodicBoxVectors(*[vector * 1.1 for vector in system.getDefaultPeriodicBoxVectors()])
+        resized_proposal = TopologyProposal(
+            new_topology=topology, new_system=system, old_topology=topology, old_system=resized_system,
+            old_chemical_state_key='pentane', new_chemical_state_key='pentane', logp_proposal=0.0, new_to_old_atom_map=new_to_old_atom_map, metadata={'test':0.0})
+        resized = ncmc_engine.make_alchemical_system(resized_proposal, positions, positions)
+        assert resized[2].getDefaultPeriodicBoxVectors() == resized_system.getDefaultPeriodicBoxVectors()
+        assert first[2].getDefaultPeriodicBoxVectors() == original_box_vectors
+
+        # A new engine sharing the directory should load the template from disk.
+        ncmc_engine = NCMCHybridEngine(temperature=temperature, nsteps=0, hybrid_cache_directory=cache_directory)
+        third = ncmc_engine.make_alchemical_system(topology_proposal, positions, positions)
+        assert third[2].getNumParticles() == first[2].getNumParticles()
+        assert third[2].getNumForces() == first[2].getNumForces()
+        assert np.allclose(first[4] / unit.nanometers, third[4] / unit.nanometers)
+        assert third[5] == first[5] and third[6] == first[6]
+    finally:
+        shutil.rmtree(cache_directory)
+
 @skipIf(os.environ.get("TRAVIS", None) == 'true', "Skip expensive test on travis")
 def test_alchemical_elimination_peptide():
     """
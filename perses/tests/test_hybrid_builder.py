@@ -253,5 +253,37 @@ def test_setup_hybrid_system():
 
     compute_alchemical_correction(leucine_system, alanine_system, system, leucine_positions, positions, positions, alanine_positions)
 
+
+def test_preserve_environment():
+    """
+    Test that keeping unchanged atoms in native forces does not change the hybrid endpoint energies.
+    """
+    alanine_topology, alanine_positions, leucine_topology, leucine_positions, atom_map = build_two_residues()
+
+    alanine_system = forcefield.createSystem(alanine_topology)
+    leucine_system = forcefield.createSystem(leucine_topology)
+
+    atom_map = {value : key for key, value in atom_map.items()}
+    hybrids = dict()
+    for preserve_environment in [False, True]:
+        hybrid = HybridTopologyFactory(leucine_system, alanine_system, leucine_topology, alanine_topology, leucine_positions, alanine_positions, atom_map, softening=0.0, preserve_environment=preserve_environment)
+        [system, topology, positions, sys2_indices_in_system, sys1_indices_in_system] = hybrid.createPerturbedSystem()
+        hybrids[preserve_environment] = (system, positions)
+
+    def compute_potential(system, positions, parameter):
+        integrator = openmm.VerletIntegrator(1.0 * unit.femtoseconds)
+        context = openmm.Context(system, integrator)
+        context.setPositions(positions)
+        for parameter_name in get_available_parameters(system):
+            context.setParameter(parameter_name, parameter)
+        potential = context.getState(getEnergy=True).getPotentialEnergy() / unit.kilojoules_per_mole
+        del context, integrator
+        return potential
+
+    for parameter in [0.0, 1.0]:
+        reference_potential = compute_potential(hybrids[False][0], hybrids[False][1], parameter)
+        preserved_potential = compute_potential(hybrids[True][0], hybrids[True][1], parameter)
+        assert abs(preserved_potential - reference_potential) < 1.0e-4 * abs(reference_potential) + 1.0e-3, "lambda = %f: %f kJ/mol with preserved environment, %f kJ/mol without" % (parameter, preserved_potential, reference_potential)
+
 if __name__ == '__main__':
     test_setup_hybrid_system()
@@ -114,15 +114,18 @@ def check_harmonic_oscillator_ncmc(ncmc_nsteps=50, ncmc_integrator="VV"):
     positions = unit.Quantity(np.zeros([1, 3], np.float32), unit.angstroms)
     functions = { 'x0' : 'lambda' } # drag spring center x0
 
-    from perses.annihilation import NCMCVVAlchemicalIntegrator, NCMCGHMCAlchemicalIntegrator
+    from perses.annihilation import NCMCVVAlchemicalIntegrator, NCMCGHMCAlchemicalIntegrator, NCMCBAOABAlchemicalIntegrator
     if ncmc_integrator=="VV":
         ncmc_insert = NCMCVVAlchemicalIntegrator(temperature, system, functions, direction='insert', nsteps=ncmc_nsteps, timestep=timestep) # 'insert' drags lambda from 0 -> 1
         ncmc_delete = NCMCVVAlchemicalIntegrator(temperature, system, functions, direction='delete', nsteps=ncmc_nsteps, timestep=timestep) # 'insert' drags lambda from 0 -> 1
     elif ncmc_integrator=="GHMC":
         ncmc_insert = NCMCGHMCAlchemicalIntegrator(temperature, system, functions, direction='insert', collision_rate=9.1/unit.picoseconds, nsteps=ncmc_nsteps, timestep=timestep) # 'insert' drags lambda from 0 -> 1
         ncmc_delete = NCMCGHMCAlchemicalIntegrator(temperature, system, functions, direction='delete', collision_rate=9.1/unit.picoseconds, nsteps=ncmc_nsteps, timestep=timestep) # 'insert' drags lambda from 0 -> 1
+    elif ncmc_integrator=="BAOAB":
+        ncmc_insert = NCMCBAOABAlchemicalIntegrator(temperature, system, functions, direction='insert', collision_rate=9.1/unit.picoseconds, nsteps=ncmc_nsteps, timestep=timestep) # 'insert' drags lambda from 0 -> 1
+        ncmc_delete = NCMCBAOABAlchemicalIntegrator(temperature, system, functions, direction='delete', collision_rate=9.1/unit.picoseconds, nsteps=ncmc_nsteps, timestep=timestep) # 'insert' drags lambda from 0 -> 1
     else:
-        raise Exception("%s not recognized as integrator name. Options are VV and GHMC" % ncmc_integrator)
+        raise Exception("%s not recognized as integrator name. Options are VV, GHMC, and BAOAB" % ncmc_integrator)
 
     # Run NCMC switching trials where the spring center is switched with lambda: 0 -> 1 over a finite number of steps.
     w_f = collect_switching_data(system, positions, functions, temperature, collision_rate, timestep, platform, ncmc_integrator=ncmc_insert, ncmc_nsteps=ncmc_nsteps, direction='insert')
@@ -144,7 +147,7 @@ def test_ncmc_integrator_harmonic_oscillator():
     Check NCMC integrator switching works for 0, 1, and 50 switching steps with a harmonic oscillator.
 
     """
-    for integrator_type in ["VV", "GHMC"]:
+    for integrator_type in ["VV", "GHMC", "BAOAB"]:
         for ncmc_nsteps in [0, 1, 50]:
             f = partial(check_harmonic_oscillator_ncmc, ncmc_nsteps, ncmc_integrator=integrator_type)
             f.description = "Testing %s NCMC switching using harmonic oscillator with %d NCMC steps" % (integrator_type, ncmc_nsteps)
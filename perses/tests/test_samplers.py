@@ -21,6 +21,7 @@ import os, os.path
 import sys, math
 import numpy as np
 import logging
+import copy
 from functools import partial
 
 import perses.tests.testsystems
@@ -70,6 +71,182 @@ def test_valence():
             f.description = "Testing MultiTargetDesign sampler with %s transfer free energy from vacuum -> %s" % (testsystem_name, environment)
             yield f
 
+def test_mcmc_sampler_system_copies():
+    """
+    Test that MCMCSampler iterations share the System instead of copying it.
+    """
+    from perses.tests.testsystems import AlkanesTestSystem
+    from perses.systems import get_system_copy_counts, reset_system_copy_counts
+    testsystem = AlkanesTestSystem()
+    mcmc_sampler = testsystem.mcmc_samplers['vacuum']
+    mcmc_sampler.nsteps = 5
+    mcmc_sampler.verbose = False
+    system = mcmc_sampler.sampler_state.system
+    reset_system_copy_counts()
+    mcmc_sampler.run(niterations=3)
+    assert sum(get_system_copy_counts().values()) == 0, "Unexpected System copies: %s" % str(get_system_copy_counts())
+    assert mcmc_sampler.sampler_state.system is system
+
+def test_mcmc_sampler_system_copies_npt():
+    """
+    Test that isobaric MCMCSampler iterations never copy the shared System, whose default box vectors are left unchanged.
+    """
+    from openmmtools import testsystems
+    from perses.samplers.samplers import SamplerState, MCMCSampler
+    from perses.samplers.thermodynamics import ThermodynamicState
+    from perses.systems import get_system_copy_counts, reset_system_copy_counts
+    temperature = 300.0 * unit.kelvin
+    pressure = 1.0 * unit.atmospheres
+    testsystem = testsystems.WaterBox()
+    box_vectors = testsystem.system.getDefaultPeriodicBoxVectors()
+    system = testsystem.system
+    for force_index in reversed(range(system.getNumForces())):
+        if system.getForce(force_index).__class__.__name__ == 'CMMotionRemover':
+            system.removeForce(force_index)
+    # The barostat pressure is specified in bar, unlike the thermodynamic state pressure.
+    system.addForce(openmm.MonteCarloBarostat(pressure.in_units_of(unit.bar), temperature))
+    reset_system_copy_counts()
+    thermodynamic_state = ThermodynamicState(system=system, temperature=temperature, pressure=pressure)
+    sampler_state = SamplerState(system=system, positions=testsystem.positions, box_vectors=system.getDefaultPeriodicBoxVectors())
+    mcmc_sampler = MCMCSampler(thermodynamic_state, sampler_state)
+    mcmc_sampler.nsteps = 5
+    mcmc_sampler.verbose = False
+    niterations = 3
+    mcmc_sampler.run(niterations=niterations)
+    counts = get_system_copy_counts()
+    # The System already has a matching barostat, and box vectors are only kept in the sampler state and Context.
+    assert sum(counts.values()) == 0, "Unexpected System copies: %s" % str(counts)
+    assert mcmc_sampler.sampler_state.system is system
+    assert mcmc_sampler.thermodynamic_state.system is system
+    assert system.getDefaultPeriodicBoxVectors() == box_vectors
+
+def test_mcmc_sampler_persistent_context():
+    """
+    Test that MCMCSampler keeps its Context until the System changes.
+    """
+    from perses.tests.testsystems import AlkanesTestSystem
+    testsystem = AlkanesTestSystem()
+    mcmc_sampler = testsystem.mcmc_samplers['vacuum']
+    mcmc_sampler.nsteps = 5
+    mcmc_sampler.verbose = False
+    mcmc_sampler.run(niterations=1)
+    context = mcmc_sampler._context
+    mcmc_sampler.run(niterations=2)
+    assert mcmc_sampler._context is context, "Context was recreated although the System did not change"
+    # Replacing the System must invalidate the Context.
+    system = copy.deepcopy(mcmc_sampler.sampler_state.system)
+    mcmc_sampler.thermodynamic_state.system = system
+    mcmc_sampler.sampler_state.system = system
+    mcmc_sampler.run(niterations=1)
+    assert mcmc_sampler._context is not context, "Context was not recreated after the System changed"
+
+def _create_cached_alkanes_sampler(scheme='ncmc-geometry-ncmc', **options):
+    """
+    Create an alkanes ExpandedEnsembleSampler in vacuum with the specified scheme and additional options, such as cache sizes.
+    """
+    from perses.tests.testsystems import AlkanesTestSystem
+    from perses.samplers.samplers import ExpandedEnsembleSampler
+    testsystem = AlkanesTestSystem()
+    environment = 'vacuum'
+    options['nsteps'] = 5
+    chemical_state_key = testsystem.proposal_engines[environment].compute_state_key(testsystem.topologies[environment])
+    exen_sampler = ExpandedEnsembleSampler(testsystem.mcmc_samplers[environment], testsystem.topologies[environment], chemical_state_key, testsystem.proposal_engines[environment], testsystem.geometry_engine, scheme=scheme, options=options)
+    exen_sampler.sampler.nsteps = 5
+    exen_sampler.verbose = False
+    return exen_sampler
+
+def test_context_cache():
+    """
+    Test least-recently-used eviction and reuse of Contexts in ExpandedEnsembleSampler.
+    """
+    from perses.samplers.samplers import ContextCache
+    systems = dict()
+    for state_key in ['A', 'B', 'C']:
+        systems[state_key] = openmm.System()
+        systems[state_key].addParticle(1.0)
+    cache = ContextCache(max_contexts=2)
+    cache.put('A', 'mcmc', 'context-A', systems['A'])
+    cache.put('B', 'mcmc', 'context-B', systems['B'])
+    assert cache.get('A', 'mcmc') == ('context-A', systems['A'])
+    cache.put('C', 'mcmc', 'context-C', systems['C']) # evicts 'B', the least recently used state
+    assert cache.ncontexts == 2
+    assert cache.get('B', 'mcmc') == (None, None)
+    assert cache.pop('A', 'mcmc') == 'context-A'
+    assert cache.get('A', 'mcmc') == (None, None)
+
+    # Caching can be disabled.
+    exen_sampler = _create_cached_alkanes_sampler(context_cache_size=0)
+    assert exen_sampler.context_cache is None
+
+    # By default, the MD Context of a chemical state is parked when the state is left and re-attached when it is revisited.
+    exen_sampler = _create_cached_alkanes_sampler()
+    assert exen_sampler.context_cache.max_memory is not None
+    exen_sampler.run(niterations=1)
+    (state_key, topology, system, positions) = (exen_sampler.state_key, exen_sampler.topology, exen_sampler.sampler.sampler_state.system, exen_sampler.sampler.sampler_state.positions)
+    exen_sampler.sampler._get_context()
+    context = exen_sampler.sampler._context
+    exen_sampler._enter_chemical_state('other', topology, copy.deepcopy(system), positions)
+    exen_sampler.sampler.update()
+    assert exen_sampler.sampler._context is not context
+    exen_sampler._enter_chemical_state(state_key, topology, system, positions)
+    exen_sampler.sampler.update()
+    assert exen_sampler.sampler._context is context, "Parked Context was not re-attached on revisit"
+
+    # Parked MD Contexts stay within the limit over a run.
+    exen_sampler.run(niterations=3)
+    assert exen_sampler.context_cache.ncontexts <= exen_sampler.context_cache.max_contexts
+
+def test_energy_evaluator():
+    """
+    Test that EnergyEvaluator reuses Contexts and agrees with a freshly created Context.
+    """
+    from openmmtools import testsystems
+    from perses.samplers.energies import EnergyEvaluator
+    from perses.tests.utils import compute_potential
+    testsystem = testsystems.AlanineDipeptideVacuum()
+    evaluator = EnergyEvaluator(max_contexts=1)
+    reference = compute_potential(testsystem.system, testsystem.positions)
+    potentials = evaluator.compute_potentials(testsystem.system, [testsystem.positions, testsystem.positions])
+    for potential in potentials:
+        assert abs((potential - reference) / unit.kilojoules_per_mole) < 1.0e-4
+    evaluator.compute_potential(testsystem.system, testsystem.positions)
+    assert evaluator.ncreated == 1
+
+    # Under an explicit key, an equivalent System reuses the Context, but one with different parameters does not.
+    evaluator = EnergyEvaluator(max_contexts=1)
+    evaluator.compute_potential(testsystem.system, testsystem.positions, key='state')
+    evaluator.compute_potential(copy.deepcopy(testsystem.system), testsystem.positions, key='state')
+    assert evaluator.ncreated == 1
+    modified_system = copy.deepcopy(testsystem.system)
+    for force in modified_system.getForces():
+        if force.__class__.__name__ == 'NonbondedForce':
+            [charge, sigma, epsilon] = force.getParticleParameters(0)
+            force.setParticleParameters(0, 2.0 * charge, sigma, epsilon)
+    potential = evaluator.compute_potential(modified_system, testsystem.positions, key='state')
+    assert evaluator.ncreated == 2
+    assert abs((potential - compute_potential(modified_system, testsystem.positions)) / unit.kilojoules_per_mole) < 1.0e-4
+
+    # Without retention, every evaluation creates a new Context.
+    evaluator = EnergyEvaluator(max_contexts=0)
+    evaluator.compute_potential(testsystem.system, testsystem.positions)
+    evaluator.compute_potential(testsystem.system, testsystem.positions)
+    assert evaluator.ncreated == 2
+
+    # By default, repeating a chemical move between the same Systems creates no new energy Context.
+    exen_sampler = _create_cached_alkanes_sampler()
+    topology_proposal = exen_sampler.proposal_engine.propose(exen_sampler.sampler.thermodynamic_state.system, exen_sampler.topology)
+    positions = exen_sampler.sampler.sampler_state.positions
+    exen_sampler._ncmc_geometry_ncmc(topology_proposal, positions, 0.0, 0.0)
+    ncreated = exen_sampler.energy_evaluator.ncreated
+    exen_sampler._ncmc_geometry_ncmc(topology_proposal, positions, 0.0, 0.0)
+    assert exen_sampler.energy_evaluator.ncreated == ncreated, "A repeated chemical move created new energy Contexts"
+
+    # The endpoint energies of chemical moves should reuse Contexts of revisited chemical states.
+    exen_sampler = _create_cached_alkanes_sampler()
+    niterations = 3
+    exen_sampler.run(niterations=niterations)
+    assert exen_sampler.energy_evaluator.ncreated <= niterations + 1
+
 def test_testsystems_travis():
     """
     Test samplers on basic test systems for travis.
@@ -159,6 +336,318 @@ def test_hybrid_scheme():
         f.description = "Testing expanded ensemble sampler with AlanineDipeptideTestSystem '%s'" % environment
         yield f
 
+def test_delayed_acceptance():
+    """
+    Test delayed-acceptance expanded ensemble moves, where the instantaneous acceptance probability screens proposals before NCMC.
+    """
+    niterations = 5 # number of iterations to run
+
+    exen_sampler = _create_cached_alkanes_sampler(scheme='geometry-ncmc-geometry')
+    exen_sampler.delayed_acceptance = True
+    exen_sampler.run(niterations)
+    assert exen_sampler.naccepted + exen_sampler.nrejected == niterations
+
+    # A large log weight penalty for every other state forces surrogate rejections
+    exen_sampler = _create_cached_alkanes_sampler(scheme='geometry-ncmc-geometry')
+    exen_sampler.delayed_acceptance = True
+    exen_sampler.log_weights = { state_key : (0.0 if state_key == exen_sampler.state_key else -1000.0) for state_key in exen_sampler.proposal_engine.chemical_state_list }
+    exen_sampler.run(niterations)
+    assert exen_sampler.nrejected_surrogate == niterations
+    assert exen_sampler.naccepted == 0
+
+def test_multiple_try():
+    """
+    Test multiple-try expanded ensemble moves, where one of several candidate proposals is selected before NCMC.
+    """
+    niterations = 3 # number of iterations to run
+
+    # Candidates drawn in worker processes have the same weights as candidates drawn in this process.
+    exen_sampler = _create_cached_alkanes_sampler(scheme='geometry-ncmc-geometry')
+    exen_sampler.ntries = 3
+    [system, topology, positions] = [exen_sampler.sampler.thermodynamic_state.system, exen_sampler.topology, exen_sampler.sampler.sampler_state.positions]
+    log_weights = dict()
+    for multiple_try_processes in [1, 3]:
+        exen_sampler.multiple_try_processes = multiple_try_processes
+        np.random.seed(0)
+        seeds, candidates = exen_sampler._draw_multiple_try_candidates(system, topology, positions, exen_sampler.ntries)
+        log_weights[multiple_try_processes] = [candidate[3] for candidate in candidates]
+    assert np.allclose(log_weights[1], log_weights[3])
+
+    for multiple_try_processes in [1, 3]:
+        exen_sampler = _create_cached_alkanes_sampler(scheme='geometry-ncmc-geometry')
+        exen_sampler.ntries = 3
+        exen_sampler.multiple_try_processes = multiple_try_processes
+        exen_sampler.run(niterations)
+        assert exen_sampler.naccepted + exen_sampler.nrejected == niterations
+        (old_state_key, proposed_state_key, acceptance_probability) = exen_sampler.last_transition
+        assert 0.0 <= acceptance_probability <= 1.0
+
+def test_prefetch_proposals():
+    """
+    Test that prefetching chemical proposals during MD gives the same trajectory of chemical states as building them afterwards.
+    """
+    from perses.tests.testsystems import AlkanesTestSystem
+    niterations = 3 # number of iterations to run
+
+    state_keys = list()
+    for prefetch_proposals in [False, True]:
+        np.random.seed(0)
+        testsystem = AlkanesTestSystem()
+        exen_sampler = testsystem.exen_samplers['vacuum']
+        exen_sampler.sampler.nsteps = 5
+        exen_sampler.prefetch_proposals = prefetch_proposals
+        visited = list()
+        for iteration in range(niterations):
+            exen_sampler.update()
+            visited.append(exen_sampler.last_transition[:2])
+        state_keys.append(visited)
+    assert state_keys[0] == state_keys[1]
+
+def test_move_schedule():
+    """
+    Test ordered and weighted move schedules and the per-move statistics.
+    """
+    from perses.tests.testsystems import AlkanesTestSystem
+    niterations = 2 # number of iterations to run
+
+    testsystem = AlkanesTestSystem()
+    exen_sampler = testsystem.exen_samplers['vacuum']
+    exen_sampler.sampler.nsteps = 5
+    exen_sampler.move_schedule = [('positions', 1), ('state', 3)]
+    exen_sampler.run(niterations)
+    assert exen_sampler.move_statistics['positions']['nattempted'] == niterations
+    assert exen_sampler.move_statistics['state']['nattempted'] == 3 * niterations
+    assert exen_sampler.move_statistics['state']['naccepted'] == exen_sampler.naccepted
+    assert exen_sampler.naccepted + exen_sampler.nrejected == 3 * niterations
+
+    exen_sampler.move_selection = 'weighted'
+    exen_sampler.run(niterations)
+    assert sum(statistics['nattempted'] for statistics in exen_sampler.move_statistics.values()) == 8 * niterations
+
+def test_superposition_scheme():
+    """
+    Test expanded ensemble moves between ligands superposed in a single hybrid System.
+    """
+    from perses.tests.testsystems import AlkanesTestSystem
+    from perses.samplers.samplers import ExpandedEnsembleSampler
+    niterations = 5 # number of iterations to run
+
+    testsystem = AlkanesTestSystem()
+    environment = 'vacuum'
+    proposal_engine = testsystem.proposal_engines[environment]
+    mcmc_sampler = testsystem.mcmc_samplers[environment]
+    chemical_state_key = proposal_engine.compute_state_key(testsystem.topologies[environment])
+    exen_sampler = ExpandedEnsembleSampler(mcmc_sampler, testsystem.topologies[environment], chemical_state_key, proposal_engine, testsystem.geometry_engine, scheme='superposition', options={'nsteps':50})
+    # All ligands share one System, so the number of particles covers every ligand
+    assert exen_sampler.sampler.thermodynamic_state.system.getNumParticles() == exen_sampler.topology.getNumAtoms()
+    assert set(exen_sampler.superposition.state_keys) == set(proposal_engine.chemical_state_list)
+    exen_sampler.run(niterations)
+    assert exen_sampler.naccepted + exen_sampler.nrejected == niterations
+    assert exen_sampler.ncmc_engine.nattempted == niterations
+
+def test_state_array():
+    """
+    Test that StateArray behaves like a dict and supports vectorized updates across registries.
+    """
+    from perses.samplers.states import ChemicalStateRegistry, StateArray
+    registry = ChemicalStateRegistry(['C', 'CC', 'CCC'])
+    logZ = StateArray(registry, {'C' : 1.0, 'CCC' : 4.0})
+    assert len(logZ) == 2 and 'CC' not in logZ
+    logZ['CCCC'] = 2.0
+    assert registry.index('CCCC') == 3
+    logZ -= logZ['C']
+    assert dict(logZ) == {'C' : 0.0, 'CCC' : 3.0, 'CCCC' : 1.0}
+    log_weights = - logZ
+    assert log_weights['CCC'] == -3.0 and logZ['CCC'] == 3.0
+
+    # Arrays of different registries are combined by key.
+    other = StateArray(ChemicalStateRegistry(['CCC', 'CCCCC']), {'CCC' : 1.0, 'CCCCC' : 2.0})
+    total = StateArray(registry)
+    total.add_scaled(logZ, 1.0)
+    total.add_scaled(other, -2.0)
+    assert dict(total) == {'C' : 0.0, 'CCC' : 1.0, 'CCCC' : 1.0, 'CCCCC' : -4.0}
+    counts = StateArray(registry, dtype=np.int64)
+    counts['CC'] = 0
+    counts['CC'] += 1
+    assert counts == {'CC' : 1}
+
+def test_rao_blackwellized_sams():
+    """
+    Test SAMS with Rao-Blackwellized logZ updates from the acceptance probabilities of chemical state moves.
+    """
+    from perses.tests.testsystems import AlkanesTestSystem
+    from perses.samplers.samplers import SAMSSampler
+    testsystem = AlkanesTestSystem()
+    exen_sampler = testsystem.exen_samplers['vacuum']
+    exen_sampler.sampler.nsteps = 5
+    sams_sampler = SAMSSampler(exen_sampler, update_type='rao-blackwellized')
+    sams_sampler.run(niterations=3)
+    (old_state_key, proposed_state_key, acceptance_probability) = exen_sampler.last_transition
+    assert 0.0 <= acceptance_probability <= 1.0
+    assert exen_sampler.state_key in [old_state_key, proposed_state_key]
+    state_weights = sams_sampler._compute_state_weights(exen_sampler.state_key, exen_sampler.last_transition)
+    assert abs(sum(state_weights.values()) - 1.0) < 1.0e-12
+
+def test_checkpoint_resume():
+    """
+    Test that a SAMS sampler resumed from a checkpoint continues exactly like the uninterrupted run.
+    """
+    import tempfile
+    from perses.samplers.checkpoint import write_checkpoint, resume
+    from perses.tests.testsystems import AlkanesTestSystem
+    def create_sams_sampler():
+        testsystem = AlkanesTestSystem()
+        sams_sampler = testsystem.sams_samplers['vacuum']
+        sams_sampler.sampler.sampler.nsteps = 5
+        return sams_sampler
+
+    niterations = 2
+    filename = os.path.join(tempfile.mkdtemp(), 'checkpoint.pickle')
+    np.random.seed(0)
+    sams_sampler = create_sams_sampler()
+    sams_sampler.run(niterations)
+    write_checkpoint(sams_sampler, filename)
+    sams_sampler.run(niterations)
+
+    resumed_sampler = resume(create_sams_sampler(), filename)
+    assert resumed_sampler.iteration == niterations
+    resumed_sampler.run(niterations)
+    assert resumed_sampler.iteration == sams_sampler.iteration
+    assert resumed_sampler.logZ == sams_sampler.logZ
+    assert resumed_sampler.sampler.state_key == sams_sampler.sampler.state_key
+    positions = sams_sampler.sampler.sampler.sampler_state.positions / unit.nanometers
+    resumed_positions = resumed_sampler.sampler.sampler.sampler_state.positions / unit.nanometers
+    assert np.all(positions == resumed_positions)
+
+def _create_alkanes_walker(walker_index):
+    """
+    Create an expanded ensemble walker for the multi-walker SAMS test; module-level so that it can be pickled.
+    """
+    from perses.tests.testsystems import AlkanesTestSystem
+    testsystem = AlkanesTestSystem()
+    exen_sampler = testsystem.exen_samplers['vacuum']
+    exen_sampler.sampler.nsteps = 5
+    exen_sampler.verbose = False
+    return exen_sampler
+
+def test_multiwalker_sams():
+    """
+    Test multi-walker SAMS with both transports, and that runs with the same seed are reproducible.
+    """
+    from perses.samplers.samplers import MultiWalkerSAMSSampler
+    nwalkers = 2
+    niterations = 2
+
+    sams_sampler = MultiWalkerSAMSSampler(_create_alkanes_walker, nwalkers, seed=1, transport='multiprocessing')
+    sams_sampler.run(niterations)
+    sams_sampler.close()
+    assert sum(sams_sampler.number_of_state_visits.values()) == nwalkers * niterations
+    assert len(sams_sampler.walker_state_keys) == nwalkers
+
+    logZ = list()
+    for replicate in range(2):
+        sams_sampler = MultiWalkerSAMSSampler(_create_alkanes_walker, nwalkers, seed=1, transport='serial')
+        sams_sampler.run(niterations)
+        sams_sampler.close()
+        logZ.append(sams_sampler.logZ)
+    assert logZ[0] == logZ[1]
+
+def _create_reference_alkanes_walker(walker_index):
+    """
+    Create an expanded ensemble walker whose Contexts all use the deterministic Reference platform; module-level so that it can be pickled.
+    """
+    # Contexts created without an explicit platform (such as the MD Context) use OPENMM_DEFAULT_PLATFORM.
+    os.environ['OPENMM_DEFAULT_PLATFORM'] = 'Reference'
+    from perses.tests.testsystems import AlkanesTestSystem
+    from perses.samplers.samplers import ExpandedEnsembleSampler
+    testsystem = AlkanesTestSystem()
+    environment = 'vacuum'
+    platform = openmm.Platform.getPlatformByName('Reference')
+    chemical_state_key = testsystem.proposal_engines[environment].compute_state_key(testsystem.topologies[environment])
+    exen_sampler = ExpandedEnsembleSampler(testsystem.mcmc_samplers[environment], testsystem.topologies[environment], chemical_state_key, testsystem.proposal_engines[environment], testsystem.geometry_engine, options={'nsteps':5}, platform=platform)
+    exen_sampler.sampler.nsteps = 5
+    exen_sampler.verbose = False
+    return exen_sampler
+
+def test_multiwalker_sams_transports_agree():
+    """
+    Test that multi-walker SAMS gives the same logZ estimates in worker processes as in a single process on the Reference platform.
+    """
+    from perses.samplers.samplers import MultiWalkerSAMSSampler
+    nwalkers = 2
+    niterations = 2
+    default_platform = os.environ.get('OPENMM_DEFAULT_PLATFORM', None)
+    try:
+        logZ = dict()
+        for transport in ['serial', 'multiprocessing']:
+            sams_sampler = MultiWalkerSAMSSampler(_create_reference_alkanes_walker, nwalkers, seed=1, transport=transport)
+            sams_sampler.run(niterations)
+            sams_sampler.close()
+            logZ[transport] = sams_sampler.logZ
+        assert logZ['serial'] == logZ['multiprocessing'], "logZ differs between transports: %s" % str(logZ)
+    finally:
+        if default_platform is None:
+            os.environ.pop('OPENMM_DEFAULT_PLATFORM', None)
+        else:
+            os.environ['OPENMM_DEFAULT_PLATFORM'] = default_platform
+
+def test_parallel_multitarget_design():
+    """
+    Test MultiTargetDesign with target samplers updated concurrently in worker processes.
+    """
+    from perses.tests.testsystems import AlanineDipeptideTestSystem
+    from perses.samplers.samplers import MultiTargetDesign
+    niterations = 2
+    testsystem = AlanineDipeptideTestSystem()
+    for environment in ['vacuum', 'implicit']:
+        testsystem.exen_samplers[environment].sampler.nsteps = 5
+    target_samplers = { testsystem.sams_samplers['implicit'] : 1.0, testsystem.sams_samplers['vacuum'] : -1.0 }
+    designer = MultiTargetDesign(target_samplers, parallel=True)
+    designer.run(niterations)
+    designer.close()
+    # The samplers in this process mirror the iterations and logZ estimates of the workers
+    for sampler in target_samplers:
+        assert sampler.iteration == niterations
+        assert sampler.sampler.state_key in sampler.logZ
+    assert set(designer.log_target_probabilities.keys()) >= set(testsystem.sams_samplers['vacuum'].state_keys)
+
+def test_parallel_refuses_gpu_platforms():
+    """
+    Test that environment worker processes are refused for samplers using a platform that cannot be used after forking.
+    """
+    from perses.samplers.samplers import _EnvironmentProcess
+    exen_sampler = _create_cached_alkanes_sampler()
+    default_platform = os.environ.get('OPENMM_DEFAULT_PLATFORM', None)
+    os.environ['OPENMM_DEFAULT_PLATFORM'] = 'CUDA'
+    try:
+        try:
+            _EnvironmentProcess(exen_sampler)
+        except Exception as e:
+            assert 'CUDA' in str(e)
+        else:
+            raise Exception("A worker process was started for a sampler using the CUDA platform")
+    finally:
+        if default_platform is None:
+            os.environ.pop('OPENMM_DEFAULT_PLATFORM', None)
+        else:
+            os.environ['OPENMM_DEFAULT_PLATFORM'] = default_platform
+
+def test_replica_exchange():
+    """
+    Test replica exchange between expanded ensemble samplers, serially and in worker processes.
+    """
+    from perses.samplers.samplers import ReplicaExchangeSampler
+    for parallel in [False, True]:
+        replicas = [_create_alkanes_walker(index) for index in range(2)]
+        sampler = ReplicaExchangeSampler(replicas, exchange_interval=2, parallel=parallel)
+        sampler.run(2)
+        assert sampler.nattempted[0] == 1
+        # Replicas at the same temperature with the same log weights always swap.
+        state_keys = sampler.state_keys
+        sampler.exchange_replicas()
+        sampler.close()
+        assert sampler.naccepted[0] == 2
+        assert sampler.state_keys == list(reversed(state_keys))
 
 if __name__=="__main__":
     for t in test_hybrid_scheme():
@@ -20,7 +20,7 @@ from functools import partial
 import pickle
 import json
 
-from perses.storage import NetCDFStorage, NetCDFStorageView
+from perses.storage import NetCDFStorage, NetCDFStorageView, AsyncConfigurationWriter
 import perses.tests.testsystems
 
 import perses.rjmc.topology_proposal as topology_proposal
@@ -124,6 +124,42 @@ def test_write_object():
         assert ('iteration' in obj)
         assert (obj['iteration'] == iteration)
 
+def test_async_write_configuration():
+    """Test asynchronous writing of a sequence of configurations.
+    """
+    tmpfile = tempfile.NamedTemporaryFile()
+    storage = NetCDFStorage(tmpfile.name, mode='w')
+    view = NetCDFStorageView(storage, 'envname', 'modname')
+
+    from openmmtools import testsystems
+    testsystem = testsystems.AlanineDipeptideVacuum()
+    nframes = 10
+    writer = AsyncConfigurationWriter(view, maxsize=2)
+    for frame in range(nframes):
+        positions = testsystem.positions + frame * unit.angstroms
+        writer.write_configuration('positions', positions, testsystem.topology, iteration=0, frame=frame, nframes=nframes)
+    writer.close()
+
+    for frame in range(nframes):
+        positions = storage._ncfile['/envname/modname/positions_0'][frame,:,:]
+        assert np.allclose(positions, (testsystem.positions + frame * unit.angstroms) / unit.angstroms, atol=1.0e-4)
+
+def test_ncmc_engine_close():
+    """Test that closing an NCMC engine stops its background trajectory writer.
+    """
+    tmpfile = tempfile.NamedTemporaryFile()
+    storage = NetCDFStorage(tmpfile.name, mode='w')
+
+    from perses.annihilation.ncmc_switching import NCMCEngine
+    ncmc_engine = NCMCEngine(nsteps=1, write_ncmc_interval=1, storage=storage)
+    ncmc_engine._frame_writer = AsyncConfigurationWriter(ncmc_engine._storage)
+    thread = ncmc_engine._frame_writer._thread
+    ncmc_engine.close()
+    assert ncmc_engine._frame_writer is None
+    assert not thread.is_alive()
+    ncmc_engine.close()
+    storage.close()
+
 def run_sampler(sampler, niterations):
     sampler.run(niterations)
 
@@ -71,6 +71,29 @@ def oemol_to_omm_ff(oemol, molecule_name):
     positions = extractPositionsFromOEMOL(oemol)
     return system, positions, topology
 
+def test_atom_map():
+    """
+    Check that AtomMap behaves like the dict it was built from and supports array-based position transfer
+    """
+    from perses.rjmc.topology_proposal import AtomMap
+    atom_map_dict = {0 : 3, 2 : 1, 5 : 0}
+    atom_map = AtomMap(atom_map_dict)
+    assert atom_map == atom_map_dict
+    assert atom_map_dict == atom_map
+    assert len(atom_map) == 3
+    assert atom_map[2] == 1 and atom_map.get(1) is None and atom_map.get(6, -1) == -1
+    assert (5 in atom_map) and (1 not in atom_map) and (-1 not in atom_map)
+    assert sorted(atom_map.keys()) == [0, 2, 5]
+    assert dict(atom_map) == atom_map_dict
+    assert atom_map.inverse() == {3 : 0, 1 : 2, 0 : 5}
+    assert atom_map.unmapped_source_atoms(6) == [1, 3, 4]
+    assert atom_map.unmapped_destination_atoms(5) == [2, 4]
+    positions = np.arange(18, dtype=np.float64).reshape([6, 3])
+    transferred = np.zeros([4, 3])
+    transferred[atom_map.destination_indices] = positions[atom_map.source_indices]
+    for (source, destination) in atom_map_dict.items():
+        assert np.all(transferred[destination] == positions[source])
+
 def test_small_molecule_proposals():
     """
     Make sure the small molecule proposal engine generates molecules
@@ -99,6 +122,98 @@ def test_small_molecule_proposals():
         assert oechem.OEMolToSmiles(oemol) == proposal.new_chemical_state_key
         proposal = new_proposal
 
+def test_parallel_probability_matrix():
+    """
+    Make sure the MCSS probability matrix computed in several processes is identical to the serial one, and that it can be cancelled
+    """
+    from perses.rjmc import topology_proposal
+    list_of_smiles = ['CCCC','CCCCC','CCCCCC','CC(C)C','CCC(C)C']
+    gaff_xml_filename = get_data_filename('data/gaff.xml')
+    system_generator = topology_proposal.SystemGenerator([gaff_xml_filename])
+    serial_engine = topology_proposal.SmallMoleculeSetProposalEngine(list_of_smiles, system_generator)
+    progress = list()
+    parallel_engine = topology_proposal.SmallMoleculeSetProposalEngine(list_of_smiles, system_generator, mcss_processes=2, mcss_progress=lambda ncompleted, npairs : progress.append(ncompleted))
+    assert np.all(parallel_engine._probability_matrix == serial_engine._probability_matrix)
+    assert progress[-1] == 10
+    assert progress == sorted(progress)
+    try:
+        topology_proposal.SmallMoleculeSetProposalEngine(list_of_smiles, system_generator, mcss_processes=2, mcss_progress=lambda ncompleted, npairs : False)
+    except Exception as e:
+        assert 'cancelled' in str(e)
+    else:
+        raise Exception("Cancelling the MCSS computation did not raise an exception")
+
+def test_small_molecule_proposal_cache():
+    """
+    Make sure repeated small molecule proposals reuse the generated Topology, System and atom map and write no scratch files
+    """
+    from perses.rjmc import topology_proposal
+    import tempfile
+    list_of_smiles = ['CCCC','CCCCC']
+    gaff_xml_filename = get_data_filename('data/gaff.xml')
+    system_generator = topology_proposal.SystemGenerator([gaff_xml_filename])
+    proposal_engine = topology_proposal.SmallMoleculeSetProposalEngine(list_of_smiles, system_generator)
+    initial_molecule = generate_initial_molecule('CCCC')
+    initial_system, initial_positions, initial_topology = oemol_to_omm_ff(initial_molecule, "MOL")
+    cwd = os.getcwd()
+    directory = tempfile.mkdtemp()
+    try:
+        os.chdir(directory)
+        proposals = [proposal_engine.propose(initial_system, initial_topology) for index in range(2)]
+        assert os.listdir(directory) == []
+    finally:
+        os.chdir(cwd)
+    assert proposals[1].new_system is proposals[0].new_system
+    assert proposals[1].new_topology is proposals[0].new_topology
+    assert proposals[1].new_to_old_atom_map == proposals[0].new_to_old_atom_map
+
+    # Receptors with the same number of atoms but different residues must not share cache entries.
+    from simtk.openmm.app import Topology, element
+    receptor_topologies = list()
+    for (residue_name, atom_names) in [('HOH', ['O', 'H1', 'H2']), ('MET', ['C', 'H1', 'H2'])]:
+        topology = Topology()
+        residue = topology.addResidue(residue_name, topology.addChain())
+        for atom_name in atom_names:
+            topology.addAtom(atom_name, element.get_by_symbol(atom_name[0]), residue)
+        receptor_topologies.append(topology)
+    receptor_keys = [proposal_engine._receptor_key(topology, 3, 0) for topology in receptor_topologies]
+    assert receptor_keys[0] != receptor_keys[1]
+    import copy
+    assert proposal_engine._receptor_key(copy.deepcopy(receptor_topologies[0]), 3, 0) == receptor_keys[0]
+
+def test_adaptive_small_molecule_proposals():
+    """
+    Make sure the adaptive proposal matrix favors accepted transitions, keeps the MCSS nonzero pattern, and freezes after burn-in
+    """
+    from perses.rjmc import topology_proposal
+    list_of_smiles = ['CCCC','CCCCC','CCCCCC']
+    gaff_xml_filename = get_data_filename('data/gaff.xml')
+    system_generator = topology_proposal.SystemGenerator([gaff_xml_filename])
+    nburn_in = 60
+    proposal_engine = topology_proposal.SmallMoleculeSetProposalEngine(list_of_smiles, system_generator, adaptive_burn_in=nburn_in)
+    mcss_probability_matrix = proposal_engine._probability_matrix.copy()
+    # Transitions between butane and pentane are always accepted; all others are always rejected.
+    productive_pair = set(['CCCC', 'CCCCC'])
+    state_key = 'CCCC'
+    for iteration in range(nburn_in):
+        proposed_state_key, logp_proposal = proposal_engine.propose_state_key(state_key)
+        acceptance_probability = 1.0 if set([state_key, proposed_state_key]) == productive_pair else 0.0
+        proposal_engine.record_proposal_outcome(state_key, proposed_state_key, acceptance_probability)
+        if acceptance_probability > 0.0:
+            state_key = proposed_state_key
+    adapted_probability_matrix = proposal_engine._probability_matrix.copy()
+    assert np.all((adapted_probability_matrix > 0) == (mcss_probability_matrix > 0))
+    assert np.allclose(adapted_probability_matrix.sum(axis=1), 1.0)
+    [butane, pentane, hexane] = [proposal_engine.chemical_state_list.index(smiles) for smiles in list_of_smiles]
+    assert adapted_probability_matrix[butane, pentane] > mcss_probability_matrix[butane, pentane]
+    # The matrix is frozen after the burn-in.
+    proposal_engine.record_proposal_outcome('CCCC', 'CCCCCC', 1.0)
+    assert np.all(proposal_engine._probability_matrix == adapted_probability_matrix)
+    # The adapted matrix survives a checkpoint.
+    restored_engine = topology_proposal.SmallMoleculeSetProposalEngine(list_of_smiles, system_generator, adaptive_burn_in=nburn_in)
+    restored_engine.set_checkpoint_state(proposal_engine.get_checkpoint_state())
+    assert np.all(restored_engine._probability_matrix == adapted_probability_matrix)
+
 def load_pdbid_to_openmm(pdbid):
     """
     create openmm topology without pdb file
@@ -90,7 +90,7 @@ class PersesTestSystem(object):
         """
         self.storage = None
         if storage_filename is not None:
-            self.storage = NetCDFStorage(storage_filename, mode='w')
+            self.storage = NetCDFStorage(storage_filename, mode=mode)
         self.environments = list()
         self.topologies = dict()
         self.positions = dict()
@@ -103,6 +103,39 @@ class PersesTestSystem(object):
         self.designer = None
         self.geometry_engine = FFAllAngleGeometryEngine(metadata={})
 
+    def get_checkpoint_state(self):
+        """
+        Return the state of all samplers of the testsystem, for `set_checkpoint_state`.
+
+        Returns
+        -------
+        state : dict
+            Picklable state
+        """
+        state = { 'designer' : None, 'sams_samplers' : dict() }
+        design_samplers = list()
+        if self.designer is not None:
+            state['designer'] = self.designer.get_checkpoint_state()
+            design_samplers = self.designer.samplers
+        for (environment, sams_sampler) in self.sams_samplers.items():
+            if sams_sampler not in design_samplers:
+                state['sams_samplers'][environment] = sams_sampler.get_checkpoint_state()
+        return state
+
+    def set_checkpoint_state(self, state):
+        """
+        Restore the state of all samplers of the testsystem from `get_checkpoint_state`.
+
+        Parameters
+        ----------
+        state : dict
+            State returned by `get_checkpoint_state`
+        """
+        if state['designer'] is not None:
+            self.designer.set_checkpoint_state(state['designer'])
+        for (environment, sams_state) in state['sams_samplers'].items():
+            self.sams_samplers[environment].set_checkpoint_state(sams_state)
+
 class AlanineDipeptideTestSystem(PersesTestSystem):
     """
     Create a consistent set of SAMS samplers useful for testing PointMutationEngine on alanine dipeptide in various solvents.
@@ -937,7 +970,7 @@ class AblImatinibResistanceTestSystem(PersesTestSystem):
                 mcmc_samplers[environment] = MCMCSampler(thermodynamic_state, sampler_state, topology=topologies[environment], storage=storage)
                 mcmc_samplers[environment].nsteps = 5 # reduce number of steps for testing
                 mcmc_samplers[environment].verbose = True
-                exen_samplers[environment] = ExpandedEnsembleSampler(mcmc_samplers[environment], topologies[environment], chemical_state_key, self.geometry_engine, proposal_engines[environment], options={'nsteps':5}, storage=storage)
+                exen_samplers[environment] = ExpandedEnsembleSampler(mcmc_samplers[environment], topologies[environment], chemical_state_key, proposal_engines[environment], self.geometry_engine, options={'nsteps':5}, storage=storage)
                 exen_samplers[environment].verbose = True
                 sams_samplers[environment] = SAMSSampler(exen_samplers[environment], storage=storage)
                 sams_samplers[environment].verbose = True